@@ -20,7 +20,31 @@ class GraphGUI:
         :return:
         """
         if len(self.graph_list)==0: return  #Exit if no graphs in dictionary
+        self.__draw()
 
+        #Display chart
+        self.__plt.show()
+
+    def save(self,filename:str):
+        """
+        Draws the graphs on a new figure and saves it to an image file instead of displaying it
+        (Works with a non-interactive backend such as Agg)
+        :param filename: File location, the extension picks the format (.png, .svg...)
+        :return:
+        """
+        if len(self.graph_list)==0: return  #Exit if no graphs in dictionary
+        figure=self.__plt.figure()
+        try:
+            self.__draw()
+            figure.savefig(filename)
+        finally:
+            self.__plt.close(figure)
+
+    def __draw(self):
+        """
+        Plot each graph on the current figure
+        :return:
+        """
         #Plot each graph in dictionary:
         for graph in self.graph_list.values():
             self.__plt.plot(graph.x_values,graph.y_values,color=graph.line_color)
@@ -32,9 +56,6 @@ class GraphGUI:
         plt.ylabel(self.__y_label)
         plt.xlabel(self.__x_label)
 
-        #Display chart
-        self.__plt.show()
-
     def add_graph(self,graph:Graph):
         """
         Add a graph to the list of charts to be drawn. Must be done before calling the show routine
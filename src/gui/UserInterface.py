@@ -1,9 +1,15 @@
-import copy
 import os
+import queue
+import threading
 from src.gui.Graph import GraphGUI
 from src.gui.Window_GUI import Window
-from src.model.g_naive_bayes import NaiveBayesModel
-from src.model.structures import DataSet, Range
+from src.model.data_session import DataSession
+from src.model.g_naive_bayes import NaiveBayesModel, PredictionCancelled
+from src.model.model_store import ModelStore
+from src.model.prediction_cache import PredictionCache
+from src.model.prediction_runner import PredictionRunner
+from src.model.structures import Range
+from src.model.weather_data import WeatherData
 from src.utils.input_validation import validate_float
 
 
@@ -19,6 +25,18 @@ class UserInterface:
     ABSOLUTE_PATH=os.path.join(os.path.dirname(__file__),'..')
     D_FILE = f"{ABSOLUTE_PATH}/data/final_combined_data.csv"
     C_FILE = f"{ABSOLUTE_PATH}/data/crop_conditions_updated.csv"
+    MODEL_DIR = f"{ABSOLUTE_PATH}/data/models"
+    PREDICTION_DIR = f"{ABSOLUTE_PATH}/data/predictions"
+    POLL_INTERVAL = 100 #Milliseconds between checks for results from the background worker
+    STAGES = ("Loading data","Training and predicting")    #Steps shown on the progress bar
+    EXECUTOR = PredictionRunner.THREADS #PredictionRunner.PROCESSES runs each variable in its own process instead
+    #How the ranges are scored. MODE_GRID samples every step of the ranges (Same curves as the original point by
+    #point loop). MODE_TABLE answers from a precomputed posterior table and is much faster for wide ranges,
+    #but it averages over the table's fine points instead of the range steps. That is no bound the window can rely on:
+    #temperature curves (1 degree steps) differ by up to 20% L1, and days with few samples whose variance is
+    #tiny can differ by more than 100%. So Execute keeps the grid, and the table is used by the batch reports
+    #and the prediction service when asked for (--mode table):
+    PREDICTION_MODE = NaiveBayesModel.MODE_GRID
 
     def __init__(self):
         #Main window and frame to hold objects
@@ -40,8 +58,12 @@ class UserInterface:
         self.__prcp_checked=Window.IntVar()
         self.__wind_checked=Window.IntVar()
 
+        #Prepared data is kept for the session and only reloaded when the files change
+        self.__session=DataSession(f"{self.ABSOLUTE_PATH}/data/final_combined_data.csv",
+                                   f"{self.ABSOLUTE_PATH}/data/crop_conditions_updated.csv",
+                                   WeatherData.prepare_data,schema=WeatherData.DATA_SCHEMA)
+
         #Datasets for each variable
-        self.__main_data=None
         self.__temp_data=None
         self.__prcp_data=None
         self.__wind_data=None
@@ -51,6 +73,15 @@ class UserInterface:
         self.__prcp_model=NaiveBayesModel()
         self.__wind_model=NaiveBayesModel()
 
+        #Trained models are saved here and only retrained when their data changes
+        self.__model_store=ModelStore(self.MODEL_DIR)
+        #Predictions already made for the same model and inputs are reused instead of computed again
+        self.__prediction_cache=PredictionCache(directory=self.PREDICTION_DIR)
+        self.__cache_hits=0 #Variables of the last run taken from the prediction cache
+        #Trains and predicts the three variables at the same time:
+        self.__runner=PredictionRunner(self.__model_store,self.EXECUTOR,cache=self.__prediction_cache)
+        self.__job_progress=dict()  #Fraction done of each variable's prediction
+
         #Ranges for each dataset
         self.__temp_range=Range(20,55)
         self.__prcp_range=Range(0,1,0.01)
@@ -59,6 +90,11 @@ class UserInterface:
         #Handles the charting
         self.__graph=GraphGUI("Condition Probabilities","Day of Year","Likelihood")
 
+        #Background worker that runs the predictions (Keeps the window responsive)
+        self.__worker=None
+        self.__cancel_event=threading.Event()   #Set by the Cancel button
+        self.__worker_events=queue.Queue()  #Progress and results handed back to the window
+
         #Import data
         self.__import_data()
 
@@ -84,6 +120,7 @@ class UserInterface:
         self.__create_labels()
         self.__create_buttons()
         self.__create_text_fields()
+        self.__create_progress()
 
     def __create_text_fields(self):
         """
@@ -151,14 +188,30 @@ class UserInterface:
         b1 = Window.Button("btnExit", "Exit", 10, 1, 350, 450)
         # Execute button:
         b2 = Window.Button("btnExecute", "Execute", 10, 1, 150, 450)
+        # Cancel button:
+        b3 = Window.Button("btnCancel", "Cancel", 10, 1, 550, 450)
 
         # Attach functions to buttons:
         b1.on_click = self.__main_window.exit
         b2.on_click = self.display_predictions
+        b3.on_click = self.cancel_predictions
 
         # Attach buttons to frame
         self.__main_frame.add_widget(b1)
         self.__main_frame.add_widget(b2)
+        self.__main_frame.add_widget(b3)
+
+    def __create_progress(self):
+        """
+        Progress bar and status text for predictions running in the background
+        :return:
+        """
+        self.__progress_bar = Window.ProgressBar("prgPredict", 580, 1, 150, 530)
+        status = Window.Label("lblStatus", "", 40, 1, 150, 570)
+        status.font_size = 12
+
+        self.__main_frame.add_widget(self.__progress_bar)
+        self.__main_frame.add_widget(status)
 
     def __create_comboboxes(self):
         """
@@ -189,14 +242,125 @@ class UserInterface:
     def display_predictions(self):
         """
         Runs when user clicks execute button
+        The work is done by a background thread, the window picks up progress and results as they come
         :return:
         """
-        self.__import_data()
-        self.reset_models()
-        self.filter_data(self.__location_to_use)
-        self.train_models()
-        self.get_predictions()
-        self.show_graph()
+        if self.__worker is not None and self.__worker.is_alive():
+            self.__main_window.show_message("A prediction is already running.",title="Busy")
+            return
+
+        self.set_values()
+        self.__cancel_event.clear()
+        self.__show_progress(0,"Starting")
+        self.__worker=threading.Thread(target=self.__run_predictions,daemon=True)
+        self.__worker.start()
+        self.__main_window.after(self.POLL_INTERVAL,self.__check_worker)
+
+    def cancel_predictions(self):
+        """
+        Runs when user clicks cancel button. Stops the background prediction at its next step
+        :return:
+        """
+        if self.__worker is not None and self.__worker.is_alive():
+            self.__cancel_event.set()
+            self.__show_progress(None,"Cancelling...")
+
+    def __run_predictions(self):
+        """
+        Import, filter, train and predict. Runs on the background thread so it must not touch the window,
+        everything for the window goes through the worker events queue
+        :return:
+        """
+        try:
+            self.__post_stage(0)
+            self.__import_data()
+            self.filter_data(self.__location_to_use)
+            self.__stop_if_cancelled()
+            self.__post_stage(1)
+            self.train_and_predict()
+            self.__worker_events.put(("done",self.__cache_hits))
+        except PredictionCancelled:
+            self.__worker_events.put(("cancelled",))
+        except Exception as err:
+            self.__worker_events.put(("error",str(err)))
+
+    def __check_worker(self):
+        """
+        Runs on the window's main loop. Applies everything the background worker has sent so far
+        :return:
+        """
+        finished=False
+        while not self.__worker_events.empty():
+            event=self.__worker_events.get()
+            if event[0]=="progress":
+                self.__show_progress(event[1],event[2])
+            elif event[0]=="message":
+                self.__main_window.show_message(event[1],title=event[2])
+            elif event[0]=="done":
+                self.__show_progress(100,f"Done ({event[1]} of 3 from cache)" if event[1] else "Done")
+                self.show_graph()
+                finished=True
+            elif event[0]=="cancelled":
+                self.__show_progress(0,"Cancelled")
+                finished=True
+            elif event[0]=="error":
+                self.__show_progress(0,"Failed")
+                self.__main_window.show_message(event[1],title="Prediction failed")
+                finished=True
+
+        if not finished:
+            self.__main_window.after(self.POLL_INTERVAL,self.__check_worker)
+
+    def __show_progress(self,percent,text):
+        """
+        Update the progress bar and status text (Main loop only)
+        :param percent: 0-100 or None to leave the bar as is
+        :param text: Status text
+        :return:
+        """
+        if percent is not None:
+            self.__progress_bar.variable.set(percent)
+        status=self.__main_frame.get_child("lblStatus")
+        if status is not None:
+            status.config(text=text)
+
+    def __post_stage(self,stage:int,done:int=0,total:int=1):
+        """
+        Sends the progress of the background worker to the window
+        :param stage: Index in STAGES
+        :param done: Grid points scored in this stage
+        :param total: Grid points to score in this stage
+        :return:
+        """
+        fraction=done/total if total else 1
+        percent=(stage+fraction)/len(self.STAGES)*100
+        self.__worker_events.put(("progress",percent,f"{self.STAGES[stage]}: {fraction:.0%}"))
+
+    def __post_job(self,name:str,done:int,total:int):
+        """
+        Sends the progress of one variable's prediction to the window (Called from the prediction threads)
+        :param name: Variable
+        :param done: Grid points scored
+        :param total: Grid points to score
+        :return:
+        """
+        self.__job_progress[name]=done/total if total else 1
+        fraction=sum(self.__job_progress.values())/len(self.__job_progress)
+        text=" | ".join(f"{job} {value:.0%}" for job,value in self.__job_progress.items())
+        self.__worker_events.put(("progress",(1+fraction)/len(self.STAGES)*100,text))
+
+    def __stop_if_cancelled(self):
+        if self.__cancel_event.is_set():
+            raise PredictionCancelled("Prediction cancelled")
+
+    def __notify(self,message:str,title:str=None):
+        """
+        Shows a message box from any thread (The window displays it from its main loop)
+        :param message: message to display
+        :param title: Title of window
+        :return:
+        """
+        self.__worker_events.put(("message",message,title))
 
     def reset_models(self):
         """
@@ -259,48 +423,21 @@ class UserInterface:
 
     def __import_data(self):
         """
-        Import data
+        Import data (Files are only read again if they changed since the last import)
         :return:
         """
-        datafile=f"{self.ABSOLUTE_PATH}/data/final_combined_data.csv"
-        cropfile=f"{self.ABSOLUTE_PATH}/data/crop_conditions_updated.csv"
-
-        #Import csv file into dataset and process:
-        self.__main_data=DataSet("Everything",datafile)
-        crop_data=DataSet("Crops",cropfile)
+        self.__session.refresh()
 
-        #Copy the imported data, process it and save it to each dataset:
-        my_data=copy.deepcopy(self.__main_data)
-        self.__temp_data= self.__prepare_data(my_data)
-        self.__wind_data= self.__prepare_data(my_data)
-        self.__prcp_data= self.__prepare_data(my_data)
+        #Each variable gets a view of the processed data (No copies are made):
+        self.__temp_data= self.__session.view("Temperature")
+        self.__wind_data= self.__session.view("Wind")
+        self.__prcp_data= self.__session.view("Precipitation")
 
         #Generate dropdown lists for the combobox components
-        self.__location_options=self.__main_data.get_category_list('COUNTY')
-        self.__crop_dict=crop_data.get_dictionary_from_data('Commodity')
-        self.__crop_options=[key for key in self.__crop_dict]
-
-
-    def __prepare_data(self,dataset):
-        """
-        Drop unnecessary columns and sort data
-        :param dataset:
-        :return:
-        """
+        self.__location_options=self.__session.get_locations()
+        self.__crop_dict=self.__session.get_crop_dict()
+        self.__crop_options=self.__session.get_crop_options()
 
-        d=copy.deepcopy(dataset)
-
-        #Drop unecessary data and duplicates:
-        d.drop_data("SOURCE_FILE")
-        d.drop_data("VALUE")
-        d.drop_data('COMMODITY')
-        d.drop_duplicates()
-        d.drop_duplicates(['YEAR', 'COUNTY', 'DATE'], ['TAVG', 'TMAX', 'TMIN', 'PRCP', 'AWND', 'SNOW'])
-        d.convert_dates_to_julian('DATE')
-        d.sort_data(['YEAR'])
-
-        #Return updated dataset
-        return d
 
     def filter_data(self,location:str=None):
         """
@@ -309,109 +446,53 @@ class UserInterface:
         :param location: Location to filter data by
         :return:
         """
-        location_field='COUNTY'
-        #Filter location:
-        if location:
-            self.__temp_data.filter_data(location_field,location)
-            self.__wind_data.filter_data(location_field,location)
-            self.__prcp_data.filter_data(location_field,location)
-
-        #Temperature settings
-        self.__temp_data.replace_nan_using_avg('TAVG',['TMAX','TMIN'])
-        self.__temp_data.drop_nan_values(['TAVG'])
-        self.__temp_data.set_features(['TAVG'])
-        self.__temp_data.set_labels('DATE')
+        #Each dataset runs its steps as an optimized plan when its features are set:
+        get=WeatherData.get_variable
+        self.__temp_data=WeatherData.variable_data(self.__temp_data,get("Temperature"),location)
         self.__temp_data.input_ranges=[self.__temp_range]
-        self.__temp_data.set_name("Temperature")
-        self.__temp_data.set_graph_color("black","red")
         # self.__temp_data.set_scale(1)
 
-        #Precipitation settings
-        self.__prcp_data.drop_nan_values(['PRCP'])
-        self.__prcp_data.set_features(['PRCP'])
-        self.__prcp_data.set_labels('DATE')
+        self.__prcp_data=WeatherData.variable_data(self.__prcp_data,get("Precipitation"),location)
         self.__prcp_data.input_ranges = [self.__prcp_range]
-        self.__prcp_data.set_name("Precipitation")
-        self.__prcp_data.set_graph_color("black","blue")
         print(f"PRCP DATA:\n{self.__prcp_data.get_data()}\n\n")
 
-        #Wind Settings
-        self.__wind_data.drop_nan_values(['AWND'])
-        self.__wind_data.set_features(['AWND'])
-        self.__wind_data.set_labels('DATE')
+        self.__wind_data=WeatherData.variable_data(self.__wind_data,get("Wind"),location)
         self.__wind_data.input_ranges = [self.__wind_range]
-        self.__wind_data.set_name("Wind")
-        self.__wind_data.set_graph_color("black","green")
         print(f"WIND DATA:\n{self.__wind_data.get_data()}")
 
-    def train_models(self):
+    def train_and_predict(self):
         """
-        Train the models or alert user if dataset is empty
+        Train the models (Models already trained on the same data are reused from the model store)
+        and run predictions on them. The three variables are independent and run at the same time.
+        Alerts user if a dataset is empty
         :return:
         """
-        tm=self.__temp_model
-        td=self.__temp_data
+        jobs={
+            "Temperature":(self.__temp_model,self.__temp_data),
+            "Precipitation":(self.__prcp_model,self.__prcp_data),
+            "Wind":(self.__wind_model,self.__wind_data),
+        }
+        self.__job_progress={name:0 for name in jobs}
 
-        pm=self.__prcp_model
-        p_d=self.__prcp_data
+        #If the model has been trained, run predictions based on input (See PREDICTION_MODE).
+        #Progress is reported to the window, and the cancel button stops the predictions:
+        hits=self.__prediction_cache.hits
+        results=self.__runner.run(jobs,self.PREDICTION_MODE,progress=self.__post_job,cancel=self.__cancel_event)
+        self.__cache_hits=self.__prediction_cache.hits-hits
 
-        wm=self.__wind_model
-        wd=self.__wind_data
+        #(With processes the models and datasets come back as new objects)
+        self.__temp_model,self.__temp_data,temp_trained=results["Temperature"]
+        self.__prcp_model,self.__prcp_data,prcp_trained=results["Precipitation"]
+        self.__wind_model,self.__wind_data,wind_trained=results["Wind"]
 
         #Sometimes because of filtering and parameters, a dataset may
-        #be empty. This can throw an exception in the model, so check
-        # before attempting to train with an empty dataset.
-        # Displays a message if the dataset is empty.
-
-        #Temperature dataset:
-        if not td.is_empty():
-            tm.train_model(td)
-        else:
-            self.__main_window.show_message(
-                "No data available for the specified TEMPERATURES in this location.",
-                title="Empty Dataset"
-            )
-
-        #Precipitation dataset:
-        if not p_d.is_empty():
-            pm.train_model(p_d)
-        else:
-            self.__main_window.show_message(
-                "No data available for the specified PRECIPITATION in this location.",
-                title="Empty Dataset"
-            )
-
-        #Wind dataset:
-        if not wd.is_empty():
-            wm.train_model(wd)
-        else:
-            self.__main_window.show_message(
-                "No data available for the specified WIND SPEED in this location.",
-                title="Empty Dataset"
-            )
-
-    def get_predictions(self):
-        """
-        Run predictions on trained data
-        :return:
-        """
-        tm=self.__temp_model
-        td=self.__temp_data
-
-        pm=self.__prcp_model
-        p_d=self.__prcp_data
-
-        wm=self.__wind_model
-        wd=self.__wind_data
-
-        #If the model has been trained, run predictions based on input:
-        if tm.is_trained():
-            td=tm.run_prediction(td)
-        if pm.is_trained():
-            p_d=pm.run_prediction(p_d)
-        if wm.is_trained():
-            wd=wm.run_prediction(wd)
-
+        #be empty. Displays a message if the dataset is empty.
+        for trained,variable in ((temp_trained,"TEMPERATURES"),(prcp_trained,"PRECIPITATION"),(wind_trained,"WIND SPEED")):
+            if not trained:
+                self.__notify(
+                    f"No data available for the specified {variable} in this location.",
+                    title="Empty Dataset"
+                )
 
     def show_graph(self):
         """
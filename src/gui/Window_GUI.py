@@ -228,6 +228,17 @@ class Window(_Parent):
         """
         self.__main_panel.destroy()
 
+    def after(self, milliseconds, function):
+        """
+            Method:
+                Runs a function on the window's main loop after a delay
+                This is the safe way for other threads to get work done on the window
+            Parameters:
+                milliseconds - delay before running
+                function - function to execute (Takes no arguments)
+        """
+        self.__main_panel.after(milliseconds, function)
+
 
     def set_keypress(self, function):
         """
@@ -481,3 +492,24 @@ class Window(_Parent):
                 offvalue=0
             )
 
+    # -------------------ProgressBar-------------------------
+
+    class ProgressBar(_Element):
+        index = 0
+
+        def __init__(self, name="progress" + str(index), width=200, height=1, left=0, top=0):
+            super().__init__(name, left, top, width, height, Window.DEFAULT_BACKGROUND_COLOR, Window.DEFAULT_FONT_COLOR)
+            self.type = "progress"
+            self.maximum = 100
+            self.variable = tk.DoubleVar()
+            self.index += 1
+
+        def build(self, master):
+            return ttk.Progressbar(
+                master=master,
+                name=self.name,
+                variable=self.variable,
+                maximum=self.maximum,
+                length=self.width,
+                mode="determinate"
+            )
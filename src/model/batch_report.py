@@ -0,0 +1,192 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from src.model import file_hash
+from src.model.data_session import DataSession
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.model_store import ModelStore
+from src.model.weather_data import WeatherData
+
+
+class BatchReport:
+    """
+    Computes the temperature, precipitation and wind distributions of every crop in every county without a window.
+    Each county is one job: its three models are trained (or loaded from the model store) once
+    and then predict the ranges of every crop. Jobs are spread over a pool of processes,
+    each process loads the prepared data once through the columnar cache.
+    Every county gets <county>.npz and <county>.csv in the output directory (and plots/<county>/<crop>.png)
+    """
+    DAYS=np.arange(1,367)   #Julian days reported for every curve
+
+    def __init__(self,datafile:str,cropfile:str,output_dir:str,model_dir:str=None,
+                 mode:str=NaiveBayesModel.MODE_GRID,workers:int=1,plots:bool=False):
+        """
+        :param datafile: Weather data CSV
+        :param cropfile: Crop conditions CSV
+        :param output_dir: Where the reports are written
+        :param model_dir: Trained models are saved here and reused by later runs (None always trains)
+        :param mode: Prediction mode (Defaults to the one used by the window)
+        :param workers: Processes running counties at once (1 runs them in this process)
+        :param plots: Also draw a PNG for each crop of each county
+        """
+        self.__datafile=datafile
+        self.__cropfile=cropfile
+        self.__output_dir=output_dir
+        self.__model_dir=model_dir
+        self.__mode=mode
+        self.__workers=max(1,workers or 1)
+        self.__plots=plots
+
+    ##################################################################################################
+    def run(self,counties:list=None,crops:list=None)->dict:
+        """
+        Writes the reports of every county
+        :param counties: Counties to run (Defaults to every county in the weather data)
+        :param crops: Crops to run (Defaults to every crop in the crop file)
+        :return: {county: error message} of the counties that failed (Empty if all succeeded)
+        """
+        os.makedirs(self.__output_dir,exist_ok=True)
+        #Loading once here fills the columnar cache, so the workers start from it:
+        session=WeatherData.open_session(self.__datafile,self.__cropfile)
+        counties=counties or session.get_locations()
+        crop_dict=session.get_crop_dict()
+        crops={name:crop_dict[name] for name in (crops or crop_dict) if name in crop_dict}
+        if self.__model_dir is not None:
+            #Source file hash is saved before the workers need it:
+            file_hash.hash_file(self.__datafile,os.path.join(self.__model_dir,ModelStore.HASH_FILE))
+
+        self.__show_message(f"Running {len(crops)} crops in {len(counties)} counties with {self.__workers} worker(s)")
+        arguments=(self.__output_dir,self.__model_dir,self.__mode,self.__plots,crops)
+        failed=dict()
+        if self.__workers==1:
+            _init_worker(self.__datafile,self.__cropfile,session)
+            for number,county in enumerate(counties,1):
+                self.__collect(county,number,len(counties),failed,_run_county,county,*arguments)
+            return failed
+
+        executor=ProcessPoolExecutor(max_workers=self.__workers,initializer=_init_worker,
+                                     initargs=(self.__datafile,self.__cropfile))
+        with executor:
+            futures={executor.submit(_run_county,county,*arguments):county for county in counties}
+            for number,future in enumerate(as_completed(futures),1):
+                self.__collect(futures[future],number,len(counties),failed,future.result)
+        return failed
+
+    ##################################################################################################
+    def __collect(self,county:str,number:int,total:int,failed:dict,job,*arguments):
+        """
+        Runs or waits for one county and reports it
+        :param failed: Receives the error of a county that fails
+        :param job: Called with arguments, returns the number of seconds the county took
+        :return:
+        """
+        try:
+            seconds=job(*arguments)
+        except Exception as err:
+            failed[county]=str(err)
+            self.__handle_error(err,f"County {county} failed","run")
+            return
+        self.__show_message(f"[{number}/{total}] {county} done in {seconds:.1f}s")
+
+    ##################################################################################################
+    def __handle_error(self,err,msg:str=None,entry:str=None):
+        print(f"Error{(' in '+ entry) if not None else ''}:\n"
+              f"\t{msg}\n\t{err}")
+
+    ##################################################################################################
+    def __show_message(self,msg:str=""):
+        print(msg)
+
+
+##################################################################################################
+_session=None   #Prepared data of the worker process (Set by _init_worker)
+
+def _init_worker(datafile:str,cropfile:str,session:DataSession=None):
+    global _session
+    _session=session or WeatherData.open_session(datafile,cropfile)
+
+
+def _run_county(county:str,output_dir:str,model_dir:str,mode:str,plots:bool,crops:dict)->float:
+    """
+    One job: every crop of one county. Writes <county>.npz, <county>.csv and the plots
+    :param crops: {crop: row of the crop file}
+    :return: Seconds taken
+    """
+    start=time.perf_counter()
+    model_store=None if model_dir is None else ModelStore(model_dir)
+    names=list(crops)
+    variables=[variable[0] for variable in WeatherData.VARIABLES]
+    sums=np.zeros((len(names),len(variables),len(BatchReport.DAYS)))
+    counts=np.zeros(sums.shape,dtype=np.int64)
+    graphs={name:[] for name in names}  #Datasets holding each crop's curves, for the plots
+
+    for v,entry in enumerate(WeatherData.VARIABLES):
+        variable=entry[0]
+        #One model per variable, shared by every crop:
+        data=WeatherData.variable_data(_session.view(variable),entry,county)
+        if data.is_empty(): continue
+
+        model=NaiveBayesModel()
+        if model_store is not None:
+            model_store.prepare_model(model,data)
+        else:
+            model.train_model(data)
+        if not model.is_trained(): continue
+
+        for c,crop in enumerate(names):
+            crop_range=WeatherData.crop_range(crops[crop],entry)
+            if crop_range is None: continue
+            prediction=data.derive(variable)
+            prediction.input_ranges=[crop_range]
+            prediction.set_graph_color(*entry[4])
+            prediction=model.run_prediction(prediction,mode)
+            for day,prob,count in prediction.get_probability_dist():
+                sums[c,v,int(day)-1]=prob
+                counts[c,v,int(day)-1]=count
+            graphs[crop].append(prediction)
+
+    filename=os.path.join(output_dir,_safe_name(county))
+    _write_reports(filename,county,names,variables,sums,counts)
+    if plots:
+        _write_plots(os.path.join(output_dir,"plots",_safe_name(county)),county,graphs)
+    return time.perf_counter()-start
+
+
+def _write_reports(filename:str,county:str,crops:list,variables:list,sums,counts):
+    """
+    <filename>.npz holds crops x variables x days arrays, <filename>.csv one row per crop, variable and day
+    """
+    with np.errstate(invalid="ignore",divide="ignore"):
+        averages=np.where(counts>0,sums/counts,np.nan)
+    with open(filename+".npz","wb") as file:
+        np.savez_compressed(file,county=county,crops=np.array(crops),variables=np.array(variables),
+                            days=BatchReport.DAYS,sums=sums,counts=counts,averages=averages)
+
+    with open(filename+".csv","w",newline="") as file:
+        file.write("COUNTY,CROP,VARIABLE,DAY,SUM,COUNT,AVERAGE\n")
+        for c,crop in enumerate(crops):
+            for v,variable in enumerate(variables):
+                for d in np.flatnonzero(counts[c,v]):
+                    file.write(f'"{county}","{crop}",{variable},{BatchReport.DAYS[d]},'
+                               f'{float(sums[c,v,d])!r},{counts[c,v,d]},{float(averages[c,v,d])!r}\n')
+
+
+def _write_plots(directory:str,county:str,graphs:dict):
+    """
+    One PNG per crop with the smoothed curve of each variable (Like the window's chart)
+    """
+    from src.gui.Graph import GraphGUI
+    os.makedirs(directory,exist_ok=True)
+    for crop,datasets in graphs.items():
+        if len(datasets)==0: continue
+        chart=GraphGUI(f"{crop} in {county}","Day of Year","Likelihood")
+        for dataset in datasets:
+            dataset.gaussify()
+            chart.add_graph(dataset.graph)
+        chart.save(os.path.join(directory,f"{_safe_name(crop)}.png"))
+
+
+def _safe_name(name:str)->str:
+    return re.sub(r"[^\w\-]+","_",str(name)).strip("_") or "_"
@@ -0,0 +1,414 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+class ColumnarCache:
+    """
+    Binary copy of a CSV file stored one column per .npy file, so later loads skip CSV parsing.
+    Numeric columns are memory-mapped when loaded. Nullable numeric columns (Int16, Float32...) keep their
+    dtype and are stored as values plus a missing value mask. Text columns are stored as category codes plus
+    the list of categories and come back with the dtype they were read with (str, object or category),
+    so a DataFrame loaded from the cache matches one parsed from the CSV.
+    The cache is rebuilt when the source file's modification time or size changes
+    """
+    MANIFEST="manifest.json"    #Describes the cached columns and the source they came from
+    VERSION=3   #Change when the file layout changes
+    DEFAULT_FOLDER=".cache" #Created next to the source file when no directory is given
+
+    def __init__(self,source:str,directory:str=None):
+        """
+        :param source: CSV file location
+        :param directory: Where the cache files are kept (Defaults to .cache/<file name> next to the source)
+        """
+        self.__source=source
+        if directory is None:
+            directory=self.default_directory(source)
+        self.__directory=directory
+
+    ##################################################################################################
+    @staticmethod
+    def default_directory(source:str)->str:
+        """
+        :return: .cache/<file name> next to the source file
+        """
+        return os.path.join(os.path.dirname(os.path.abspath(source)),ColumnarCache.DEFAULT_FOLDER,
+                            os.path.basename(source))
+
+    ##################################################################################################
+    def read_csv(self,**read_options)->pd.DataFrame:
+        """
+        Loads the CSV from the cache if it is up to date, otherwise parses it and refreshes the cache
+        :param read_options: Passed to pandas.read_csv (Also part of the cache key)
+        :return: DataFrame
+        """
+        data=self.load(**read_options)
+        if data is not None:
+            self.__show_message(f"Loaded {self.__source} from cache")
+            return data
+
+        data=pd.read_csv(self.__source,**read_options)
+        self.save(data,**read_options)
+        return data
+
+    ##################################################################################################
+    def is_valid(self,**read_options)->bool:
+        """
+        :param read_options: Options the CSV would be read with
+        :return: True if the cache matches the current source file and options
+        """
+        manifest=self.__read_manifest()
+        return manifest is not None and manifest["source"]==self.__describe_source(read_options)
+
+    ##################################################################################################
+    def load(self,**read_options):
+        """
+        Loads the cached columns. Numeric columns are memory-mapped copy-on-write,
+        so changing the DataFrame never touches the files
+        :param read_options: Options the CSV would be read with
+        :return: DataFrame or None if the cache is missing or out of date
+        """
+        manifest=self.__read_manifest()
+        if manifest is None or manifest["source"]!=self.__describe_source(read_options):
+            return None
+
+        columns=dict()
+        try:
+            for column in manifest["columns"]:
+                path=os.path.join(self.__directory,column["file"])
+                if column["kind"]=="category":
+                    codes=np.load(path,mmap_mode="c")
+                    categories=np.load(path.replace(".npy",".categories.npy"),allow_pickle=True)
+                    values=pd.Categorical.from_codes(codes,categories=categories)
+                    if column["dtype"]!="category":
+                        values=values.astype(pd.api.types.pandas_dtype(column["dtype"]))
+                    columns[column["name"]]=values
+                elif column["kind"]=="masked":
+                    values=np.load(path,mmap_mode="c")
+                    mask=np.load(path.replace(".npy",".mask.npy"))
+                    dtype=pd.api.types.pandas_dtype(column["dtype"])
+                    columns[column["name"]]=dtype.construct_array_type()(values,mask)
+                else:
+                    columns[column["name"]]=np.load(path,mmap_mode="c")
+        except (OSError,ValueError,TypeError) as err:
+            self.__handle_error(err,f"Could not read cache for {self.__source}","load")
+            return None
+
+        data=pd.DataFrame(columns,copy=False)
+        #The numeric columns should still be the mapped files, not copies of them:
+        copied=[name for name,values in columns.items()
+                if isinstance(values,np.memmap) and not np.shares_memory(data[name].to_numpy(),values)]
+        if copied:
+            self.__show_message(f"Cached columns {copied} of {self.__source} were copied into memory")
+        return data
+
+    ##################################################################################################
+    def save(self,data:pd.DataFrame,**read_options):
+        """
+        Writes every column of the DataFrame to the cache
+        :param data: DataFrame read from the source
+        :param read_options: Options the CSV was read with
+        :return:
+        """
+        try:
+            os.makedirs(self.__directory,exist_ok=True)
+            #Remove the manifest first so a half written cache is never treated as valid:
+            manifest_path=os.path.join(self.__directory,self.MANIFEST)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+
+            columns=[]
+            for i,name in enumerate(data.columns):
+                file=f"col{i}.npy"
+                path=os.path.join(self.__directory,file)
+                series=data[name]
+                if _is_plain_numeric(series):
+                    np.save(path,series.to_numpy())
+                    columns.append({"name":name,"file":file,"kind":"array"})
+                elif _is_masked_numeric(series):
+                    mask=series.isna().to_numpy()
+                    np.save(path,series.to_numpy(dtype=series.dtype.numpy_dtype,na_value=0))
+                    np.save(path.replace(".npy",".mask.npy"),mask)
+                    columns.append({"name":name,"file":file,"kind":"masked","dtype":str(series.dtype)})
+                else:
+                    categorical=series.astype("category").array
+                    np.save(path,np.asarray(categorical.codes))
+                    np.save(path.replace(".npy",".categories.npy"),
+                            np.asarray(categorical.categories,dtype=object),allow_pickle=True)
+                    columns.append({"name":name,"file":file,"kind":"category","dtype":str(series.dtype)})
+
+            with open(manifest_path,"w") as file:
+                json.dump({"source":self.__describe_source(read_options),"columns":columns},file)
+        except OSError as err:
+            self.__handle_error(err,f"Could not write cache for {self.__source}","save")
+
+    ##################################################################################################
+    def writer(self,**read_options):
+        """
+        Starts writing the cache a chunk at a time, for files read in chunks (See CacheWriter)
+        :param read_options: Options that describe how the data was read (Part of the cache key)
+        :return: CacheWriter
+        """
+        return CacheWriter(self.__directory,self.__describe_source(read_options))
+
+    ##################################################################################################
+    def load_lookup(self,name:str,keys,**options):
+        """
+        Values worked out earlier for a list of keys, for example parsed dates for each distinct date string.
+        Only returned if the source file is unchanged and the keys and options are exactly the same
+        :param name: Name the lookup was saved under
+        :param keys: Keys the values are needed for
+        :param options: Settings the values were worked out with, for example date_format="%Y-%m-%d"
+        :return: Array of values in the order of keys, or None
+        """
+        try:
+            with np.load(os.path.join(self.__directory,f"{name}.lookup.npz")) as file:
+                if json.loads(str(file["source"]))!=self.__describe_source({"lookup":name,**options}):
+                    return None
+                if not np.array_equal(file["keys"],np.asarray(keys,dtype=str)):
+                    return None
+                return file["values"]
+        except (OSError,ValueError,KeyError):
+            return None
+
+    ##################################################################################################
+    def save_lookup(self,name:str,keys,values,**options):
+        """
+        Saves values worked out for a list of keys (See load_lookup)
+        :param name: Name to save the lookup under
+        :param keys: Keys (Saved as text)
+        :param values: Numeric or datetime64 array, one value per key
+        :param options: Settings the values were worked out with (Must match when loading)
+        :return:
+        """
+        try:
+            os.makedirs(self.__directory,exist_ok=True)
+            path=os.path.join(self.__directory,f"{name}.lookup.npz")
+            #Written under a temporary name first so a half written file is never read:
+            with open(path+".tmp","wb") as file:
+                np.savez(file,keys=np.asarray(keys,dtype=str),values=np.asarray(values),
+                         source=np.array(json.dumps(self.__describe_source({"lookup":name,**options}))))
+            os.replace(path+".tmp",path)
+        except OSError as err:
+            self.__handle_error(err,f"Could not save {name} for {self.__source}","save_lookup")
+
+    ##################################################################################################
+    def __describe_source(self,read_options:dict)->dict:
+        stat=os.stat(self.__source)
+        return {
+            "version":self.VERSION,
+            "mtime":stat.st_mtime_ns,
+            "size":stat.st_size,
+            "options":json.loads(json.dumps(read_options,sort_keys=True,default=str)),
+        }
+
+    ##################################################################################################
+    def __read_manifest(self):
+        try:
+            with open(os.path.join(self.__directory,self.MANIFEST)) as file:
+                return json.load(file)
+        except (OSError,ValueError):
+            return None
+
+    ##################################################################################################
+    def __handle_error(self,err,msg:str=None,entry:str=None):
+        print(f"Error{(' in '+ entry) if not None else ''}:\n"
+              f"\t{msg}\n\t{err}")
+
+    ##################################################################################################
+    def __show_message(self,msg:str=""):
+        print(msg)
+
+
+class CacheWriter:
+    """
+    Builds a ColumnarCache from DataFrames appended one at a time, so only one chunk is ever in memory.
+    Each column is appended to a raw file and turned into a .npy file by finish().
+    Text and categorical columns share one list of categories across chunks.
+    Column kinds and dtypes are set by the first chunk. A numeric column is widened when a later chunk needs it
+(int64 becomes float64 once a value is missing) and the rows already written are converted
+    """
+
+    def __init__(self,directory:str,source:dict):
+        """
+        :param directory: Cache directory
+        :param source: Description of the source written to the manifest (Makes the cache valid)
+        """
+        self.__directory=directory
+        self.__source=source
+        self.__columns=None #Manifest entries, set by the first chunk
+        self.__files=dict() #Open raw files {path: file}
+        self.__categories=dict()    #{column name: {category: code}}
+        self.__rows=0
+
+        os.makedirs(directory,exist_ok=True)
+        #Remove the manifest first so a half written cache is never treated as valid:
+        manifest_path=os.path.join(directory,ColumnarCache.MANIFEST)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+    ##################################################################################################
+    def append(self,data:pd.DataFrame):
+        """
+        Adds the rows of a chunk to the end of each column
+        :param data: Chunk with the same columns as the first one
+        :return:
+        """
+        if self.__columns is None:
+            self.__columns=[self.__describe_column(i,name,data[name]) for i,name in enumerate(data.columns)]
+
+        for column in self.__columns:
+            series=data[column["name"]]
+            path=os.path.join(self.__directory,column["file"])
+            if column["kind"]!="category":
+                self.__widen(column,series)
+            if column["kind"]=="array":
+                self.__write(path,series.to_numpy(dtype=np.dtype(column["dtype"])))
+            elif column["kind"]=="masked":
+                values=series.to_numpy(dtype=pd.api.types.pandas_dtype(column["dtype"]).numpy_dtype,na_value=0)
+                self.__write(path,values)
+                self.__write(path.replace(".npy",".mask.npy"),series.isna().to_numpy())
+            else:
+                self.__write(path,self.__encode(column["name"],series))
+        self.__rows+=len(data)
+
+    ##################################################################################################
+    def abort(self):
+        """
+        Closes and removes the raw column files without writing the manifest (The cache stays invalid)
+        :return:
+        """
+        for raw,file in self.__files.items():
+            file.close()
+            if os.path.exists(raw):
+                os.remove(raw)
+        self.__files.clear()
+
+    ##################################################################################################
+    def finish(self)->int:
+        """
+        Turns the raw column files into .npy files and writes the manifest, which makes the cache valid
+        :return: Number of rows written
+        """
+        for file in self.__files.values():
+            file.close()
+        for column in self.__columns or []:
+            path=os.path.join(self.__directory,column["file"])
+            if column["kind"]=="category":
+                self.__to_npy(path,np.dtype(np.int32))
+                categories=list(self.__categories[column["name"]])
+                np.save(path.replace(".npy",".categories.npy"),np.asarray(categories,dtype=object),allow_pickle=True)
+            elif column["kind"]=="masked":
+                self.__to_npy(path,pd.api.types.pandas_dtype(column["dtype"]).numpy_dtype)
+                self.__to_npy(path.replace(".npy",".mask.npy"),np.dtype(bool))
+            else:
+                self.__to_npy(path,np.dtype(column["dtype"]))
+
+        with open(os.path.join(self.__directory,ColumnarCache.MANIFEST),"w") as file:
+            json.dump({"source":self.__source,"columns":self.__columns or []},file)
+        return self.__rows
+
+    ##################################################################################################
+    def __describe_column(self,i:int,name,series:pd.Series)->dict:
+        file=f"col{i}.npy"
+        if _is_plain_numeric(series):
+            return {"name":name,"file":file,"kind":"array","dtype":series.dtype.str}
+        if _is_masked_numeric(series):
+            return {"name":name,"file":file,"kind":"masked","dtype":str(series.dtype)}
+        self.__categories[name]=dict()
+        return {"name":name,"file":file,"kind":"category","dtype":str(series.dtype)}
+
+    ##################################################################################################
+    def __widen(self,column:dict,series:pd.Series):
+        """
+        Changes a numeric column's dtype to one that also holds the chunk's values.
+        The rows already written are converted to the new dtype
+        :param column: Manifest entry of the column (Updated)
+        :param series: Column of the new chunk
+        :return:
+        """
+        if _is_plain_numeric(series):
+            kind,incoming="array",series.dtype
+        elif _is_masked_numeric(series):
+            kind,incoming="masked",series.dtype.numpy_dtype
+        else:
+            kind,incoming="category",series.dtype
+        if kind!=column["kind"]:
+            raise ValueError(f"Column {column['name']} changed from {column['dtype']} to {series.dtype} between chunks. "
+                             f"Declare its dtype in the schema")
+
+        old=np.dtype(column["dtype"]) if kind=="array" else pd.api.types.pandas_dtype(column["dtype"]).numpy_dtype
+        new=np.result_type(old,incoming)
+        if new==old:
+            return
+        self.__convert(os.path.join(self.__directory,column["file"]),old,new)
+        column["dtype"]=new.str if kind=="array" else str(pd.array(np.empty(0,dtype=new)).dtype)
+
+    ##################################################################################################
+    def __convert(self,path:str,old:np.dtype,new:np.dtype):
+        """
+        Rewrites a raw column file with a wider dtype (Converted in blocks, never loaded whole)
+        """
+        raw=path+".bin"
+        if raw not in self.__files:
+            return
+        self.__files.pop(raw).close()
+        block=(1<<20)//old.itemsize*old.itemsize
+        with open(raw,"rb") as data, open(raw+".tmp","wb") as out:
+            for chunk in iter(lambda: data.read(block),b""):
+                out.write(np.frombuffer(chunk,dtype=old).astype(new).tobytes())
+        os.replace(raw+".tmp",raw)
+        self.__files[raw]=open(raw,"ab")
+
+    ##################################################################################################
+    def __encode(self,name,series:pd.Series)->np.ndarray:
+        """
+        :return: Codes of the values in the column's list of categories (New values are added to the list)
+        """
+        if isinstance(series.dtype,pd.CategoricalDtype):
+            codes,values=series.cat.codes.to_numpy(),series.cat.categories
+        else:
+            codes,values=pd.factorize(series)
+        lookup=self.__categories[name]
+        mapping=np.array([lookup.setdefault(value,len(lookup)) for value in values]+[-1],dtype=np.int32)
+        return mapping[codes]   #Missing values have code -1, which picks the -1 at the end
+
+    ##################################################################################################
+    def __write(self,path:str,values:np.ndarray):
+        raw=path+".bin"
+        if raw not in self.__files:
+            self.__files[raw]=open(raw,"wb")
+        self.__files[raw].write(np.ascontiguousarray(values).tobytes())
+
+    ##################################################################################################
+    def __to_npy(self,path:str,dtype:np.dtype):
+        """
+        Puts a .npy header in front of the raw column file (Copied in blocks, never loaded whole)
+        """
+        raw=path+".bin"
+        if not os.path.exists(raw):
+            open(raw,"wb").close()
+        with open(path,"wb") as out, open(raw,"rb") as data:
+            np.lib.format.write_array_header_1_0(out,{"descr":np.lib.format.dtype_to_descr(dtype),
+                                                      "fortran_order":False,"shape":(self.__rows,)})
+            shutil.copyfileobj(data,out,1<<20)
+        os.remove(raw)
+
+
+##################################################################################################
+def _is_plain_numeric(series:pd.Series)->bool:
+    """
+    :return: True if the column is a numpy numeric or boolean array that can be saved as is
+    """
+    return isinstance(series.dtype,np.dtype) and series.dtype.kind in "biuf"
+
+
+##################################################################################################
+def _is_masked_numeric(series:pd.Series)->bool:
+    """
+    :return: True if the column uses a pandas nullable numeric or boolean dtype (Int16, Float32, boolean...)
+    """
+    return isinstance(series.dtype,pd.api.extensions.ExtensionDtype) and \
+        getattr(series.dtype,"numpy_dtype",np.dtype(object)).kind in "biuf"
@@ -0,0 +1,131 @@
+import os
+import threading
+from src.model.file_hash import hash_file
+from src.model.structures import DataSet
+
+
+class DataSession:
+    """
+    Keeps the prepared data for the whole session so running predictions again does not re-read the CSV files.
+    The files are only reloaded when they change on disk: modification time and size are checked first
+    and the content hash decides if a touched file really changed.
+    Each run gets its own view of the prepared data (see DataSet.derive), so filtering is the only cost
+    """
+
+    def __init__(self,datafile:str,cropfile:str,prepare=None,use_cache:bool=True,schema:dict=None):
+        """
+        :param datafile: Weather data CSV
+        :param cropfile: Crop conditions CSV
+        :param prepare: Function that takes the imported weather DataSet and returns it prepared
+        :param use_cache: Load the weather data through the columnar cache
+        :param schema: Columns and dtypes to load from the weather data (See DataSet.import_data)
+        """
+        self.__datafile=datafile
+        self.__cropfile=cropfile
+        self.__prepare=prepare
+        self.__use_cache=use_cache
+        self.__schema=schema
+        self.__base=None    #Prepared weather data, shared by every view
+        self.__crop_dict=dict()
+        self.__locations=[]
+        self.__stamps=dict()    #{path:(mtime,size,sha256)} of the files currently loaded
+        self.__lock=threading.Lock()    #Views can be requested from the background worker
+
+    ##################################################################################################
+    def refresh(self)->bool:
+        """
+        Loads the files if they have not been loaded yet or have changed since
+        :return: True if the data was (re)loaded
+        """
+        with self.__lock:
+            reload_data=self.__base is None or self.__has_changed(self.__datafile)
+            reload_crops=not self.__crop_dict or self.__has_changed(self.__cropfile)
+
+            if reload_data:
+                self.__show_message(f"Loading {self.__datafile}")
+                base=DataSet("Everything",self.__datafile,use_cache=self.__use_cache,schema=self.__schema)
+                if self.__prepare is not None:
+                    base=self.__prepare(base)
+                self.__base=base
+                self.__locations=base.get_category_list('COUNTY')
+                self.__stamps[self.__datafile]=self.__stamp(self.__datafile)
+
+            if reload_crops:
+                crop_data=DataSet("Crops",self.__cropfile)
+                self.__crop_dict=crop_data.get_dictionary_from_data('Commodity')
+                self.__stamps[self.__cropfile]=self.__stamp(self.__cropfile)
+
+            return reload_data or reload_crops
+
+    ##################################################################################################
+    def view(self,name:str="")->DataSet:
+        """
+        :param name: Name of the new dataset
+        :return: Dataset sharing the prepared data (Changes to it don't affect the session)
+        """
+        self.refresh()
+        return self.__base.derive(name)
+
+    ##################################################################################################
+    def is_current(self)->bool:
+        """
+        :return: True if both files are loaded and unchanged on disk
+        """
+        with self.__lock:
+            return (self.__base is not None and bool(self.__crop_dict)
+                    and not self.__has_changed(self.__datafile) and not self.__has_changed(self.__cropfile))
+
+    ##################################################################################################
+    def get_locations(self)->list:
+        return list(self.__locations)
+
+    def get_crop_dict(self)->dict:
+        return self.__crop_dict
+
+    def get_crop_options(self)->list:
+        return [key for key in self.__crop_dict]
+
+    ##################################################################################################
+    def __has_changed(self,filename:str)->bool:
+        """
+        Compares the file against the stamp taken when it was loaded.
+        The hash is only calculated when the modification time or size differ
+        :param filename: File location
+        :return: True if the content differs from what was loaded
+        """
+        known=self.__stamps.get(filename)
+        if known is None:
+            return True
+        try:
+            stat=os.stat(filename)
+        except OSError:
+            return False    #Keep using what was loaded
+        if (stat.st_mtime_ns,stat.st_size)==known[:2]:
+            return False
+
+        sha=hash_file(filename)
+        if sha==known[2]:
+            #Touched but not changed
+            self.__stamps[filename]=(stat.st_mtime_ns,stat.st_size,sha)
+            return False
+        return True
+
+    ##################################################################################################
+    def __stamp(self,filename:str)->tuple:
+        #The hash worked out by __has_changed is reused while the file stays the same:
+        try:
+            stat=os.stat(filename)
+        except OSError as err:
+            self.__handle_error(err,f"Could not read {filename}","__stamp")
+            return (None,None,"")
+        return (stat.st_mtime_ns,stat.st_size,hash_file(filename))
+
+    ##################################################################################################
+    def __handle_error(self,err,msg:str=None,entry:str=None):
+        print(f"Error{(' in '+ entry) if not None else ''}:\n"
+              f"\t{msg}\n\t{err}")
+
+    ##################################################################################################
+    def __show_message(self,msg:str=""):
+        print(msg)
+
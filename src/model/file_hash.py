@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import threading
+
+_HASH_LOCK=threading.Lock() #Files may be hashed from several threads at once
+_known=dict()   #{path:{"mtime","size","sha256"}} of the files hashed by this process
+_stores=dict()  #{store file:{path:{"mtime","size","sha256"}}} of the stores read so far
+
+
+##################################################################################################
+def hash_file(filename:str,store:str=None)->str:
+    """
+    sha256 of a file. The hash is reused while the file's modification time and size stay the same
+    :param filename: File location
+    :param store: JSON file keeping the hashes between sessions (Read once, written when a hash is added)
+    :return: Hex string or "" if there is no file
+    """
+    if not filename or not os.path.exists(filename):
+        return ""
+    path=os.path.abspath(filename)
+    with _HASH_LOCK:
+        stat=os.stat(path)
+        saved=_load_store(store) if store is not None else dict()
+        for entries in (_known,saved):
+            entry=entries.get(path)
+            if entry is not None and entry["mtime"]==stat.st_mtime_ns and entry["size"]==stat.st_size:
+                break
+        else:
+            sha=hashlib.sha256()
+            with open(path,"rb") as file:
+                for chunk in iter(lambda: file.read(1<<20),b""):
+                    sha.update(chunk)
+            entry={"mtime":stat.st_mtime_ns,"size":stat.st_size,"sha256":sha.hexdigest()}
+
+        _known[path]=entry
+        if store is not None and saved.get(path)!=entry:
+            saved[path]=entry
+            _save_store(store,saved)
+        return entry["sha256"]
+
+
+##################################################################################################
+def _load_store(store:str)->dict:
+    if store not in _stores:
+        try:
+            with open(store) as file:
+                _stores[store]=json.load(file)
+        except (OSError,ValueError):
+            _stores[store]=dict()
+    return _stores[store]
+
+
+##################################################################################################
+def _save_store(store:str,hashes:dict):
+    try:
+        with open(store,"w") as file:
+            json.dump(hashes,file)
+    except OSError as err:
+        print(f"Error in _save_store:\n\tCould not save file hashes\n\t{err}")
@@ -1,7 +1,11 @@
-
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import numpy as np
+from scipy.special import log_ndtr, logsumexp
 from sklearn.model_selection import train_test_split
 from sklearn.naive_bayes import GaussianNB
-from src.model.structures import DataSet,Range
+from src.model.posterior_table import PosteriorTable
+from src.model.structures import DataSet,Range,PredictionGrid,ProbabilityAccumulator,ClassStatistics
 
 
 #Steps to running model
@@ -14,18 +18,43 @@ from src.model.structures import DataSet,Range
 #   Train the model:
 #       model=GaussianNB(), model.fit(X_train.values,y_train
 
+class PredictionCancelled(Exception):
+    """
+    Raised by run_prediction when its cancel event is set
+    """
+
+
 class NaiveBayesModel:
     """
     First import the data using a Dataset object found in the structures.py
     Train model with train_model method and pass in the dataset
     Finally run_prediction. The returned value is a new dataset with chartable data
     """
+    MODE_GRID="grid"    #Scores the input grid in blocks (default)
+    MODE_LEGACY="legacy"    #Scores the input grid one point at a time
+    MODE_INTEGRATED="integrated"    #Closed form posterior of the whole input range (ignores Range.step)
+    MODE_TABLE="table"  #Looks the ranges up in a table of precomputed posteriors (ignores Range.step)
+    MODE_FACTORIZED="factorized"    #Scores the input grid from per feature likelihood tables
+    DEFAULT_BLOCK_SIZE=4096 #Grid points scored per call to the sklearn model
+    DEFAULT_TABLE_POINTS=20000  #Grid points in the posterior lookup table (Split between features)
+    SHARDS_PER_WORKER=4 #Grid is split in more shards than workers so they stay busy
+    JULIAN_DAYS=np.arange(1,367)   #Every label a weather model can see, declared up front for incremental training
+    FITTED_PARAMETERS=("classes_","theta_","var_","class_prior_","class_count_","epsilon_")  #Saved by save_model
+    INCREMENTAL_MODES=(MODE_GRID,MODE_FACTORIZED)   #Modes that only score the part of the grid that changed
+
     def __init__(self):
         self.__data_filename=None
         self.__data=None
         self.__data_sets=dict() #Stores all of the datasets
         self.__model=GaussianNB()   #sklearn GNB class
         self.__model_trained=False  #tracks if training has occurred
+        self.__fingerprint=None #Identifies the data the model was trained on (Set by ModelStore)
+        self.__posterior_table=None #Precomputed posteriors for MODE_TABLE, built on first use
+        self.__range_state=None #(mode, threshold, axes, sums, counts) of the last grid prediction, see __range_update
+        self.__progress=None    #Progress callback of the prediction that is running
+        self.__cancel=None  #Cancel event of the prediction that is running
+        self.__points_done=0    #Points scored so far by the point by point path
+        self.__points_total=0   #Points the point by point path will score
 
 
     def reset_model(self):
@@ -38,6 +67,9 @@ class NaiveBayesModel:
         self.__data_sets=dict()
         self.__model=GaussianNB()
         self.__model_trained=False
+        self.__fingerprint=None
+        self.__posterior_table=None
+        self.__range_state=None
 
     ##################################################################################################
     def add_dataset(self,key,dataset:DataSet):
@@ -80,15 +112,242 @@ class NaiveBayesModel:
 
 
         #Train model
-        self.__model.fit(x_train.values,y_train)
+        #(Features are always fitted as float64, whatever dtype they were loaded with)
+        self.__model.fit(x_train.to_numpy(dtype=float),y_train)
 
         self.__show_message("Model training successful")
         self.__model_trained=True
+        self.__fingerprint=None
+        self.__posterior_table=None
+        self.__range_state=None
+
+    ##################################################################################################
+    def update_model(self,dataset:DataSet,classes=None,test_size=0.3,random_state=40):
+        """
+        Incremental training: updates the model with new rows only (for example a new year of data)
+        instead of refitting on the full history. Cost grows with the new data only.
+        A model trained with train_model is extended to the full class list first
+        :param dataset: Dataset object holding only the new rows
+        :param classes: Every label the model may ever see (Defaults to all Julian days)
+        :param test_size: Size of test data vs training data (Same split as train_model)
+        :param random_state: Randomization
+        :return:
+        """
+        if dataset.get_data() is None or dataset.is_empty():
+            self.__show_message("No new data to train with.")
+            return
+
+        try:
+            x_train,x_test,y_train,y_test=train_test_split(
+                dataset.get_features(),
+                dataset.get_labels(),
+                test_size=test_size,
+                random_state=random_state
+            )
+        except ValueError as err:
+            self.__handle_error(err,"Bad value passed to trainer","update_model")
+            return
+
+        all_classes=np.asarray(self.JULIAN_DAYS if classes is None else classes)
+        if not self.__model_trained:
+            self.__model.partial_fit(x_train.to_numpy(dtype=float),y_train,classes=all_classes)
+        else:
+            self.__add_classes(all_classes)
+            self.__model.partial_fit(x_train.to_numpy(dtype=float),y_train)
+        self.__drop_empty_classes()
+
+        self.__show_message(f"Model updated with {len(y_train)} rows")
+        self.__model_trained=True
+        self.__fingerprint=None
+        self.__posterior_table=None
+        self.__range_state=None
+
+    ##################################################################################################
+    def train_stream(self,chunks,test_size=0.3,random_state=40,var_smoothing=1e-9):
+        """
+        Trains on data that doesn't fit in memory, one chunk of rows at a time.
+        Per class counts, means and variances are merged chunk by chunk, giving the same model as a full fit.
+        Rows are held out for testing by a hash of their position and random_state instead of a shuffle,
+        so the split is the same whatever the chunk size
+        Example:
+            chunks=dataset.iter_chunks(filename,schema=schema)
+            model.train_stream((chunk[['TAVG']],chunk['DATE']) for chunk in chunks)
+        :param chunks: Iterable of (features, labels) pairs, features 2-D with one row per label
+        :param test_size: Fraction of rows held out (Not trained on)
+        :param random_state: Seed of the holdout hash
+        :param var_smoothing: Fraction of the largest feature variance added to every variance (Same as GaussianNB)
+        :return:
+        Raises ValueError naming the chunk if it holds NaN or infinite values, like GaussianNB.fit
+        (Drop or fill them first, for example with drop_nan_values in the lazy plan)
+        """
+        statistics=None
+        rows_seen=0
+        rows_held_out=0
+        for number,(features,labels) in enumerate(chunks):
+            features=np.asarray(features,dtype=float)
+            if features.ndim==1:
+                features=features.reshape(-1,1)
+            labels=np.asarray(labels)
+            bad=~np.isfinite(features).all(axis=1)
+            if labels.dtype.kind=="f":
+                bad|=~np.isfinite(labels)
+            if bad.any():
+                raise ValueError(f"Chunk {number} (rows {rows_seen} to {rows_seen+len(labels)-1}) has "
+                                 f"{int(bad.sum())} rows with NaN or infinite values")
+            train=~_holdout_mask(rows_seen,len(labels),test_size,random_state)
+            rows_seen+=len(labels)
+            rows_held_out+=int((~train).sum())
+            if statistics is None:
+                statistics=ClassStatistics(features.shape[1])
+            statistics.add(features[train],labels[train])
+
+        if statistics is None or statistics.counts.sum()==0:
+            self.__show_message("No data to train with.")
+            return
+
+        model=GaussianNB(var_smoothing=var_smoothing)
+        model.epsilon_=var_smoothing*np.max(statistics.total_variance())
+        model.classes_=statistics.classes
+        model.theta_=statistics.means
+        model.var_=statistics.variances()+model.epsilon_
+        model.class_count_=statistics.counts
+        model.class_prior_=statistics.counts/statistics.counts.sum()
+        model.n_features_in_=statistics.means.shape[1]
+
+        self.reset_model()
+        self.__model=model
+        self.__model_trained=True
+        self.__show_message(f"Model trained on {rows_seen-rows_held_out} rows ({rows_held_out} held out)")
+
+    ##################################################################################################
+    def __add_classes(self,classes):
+        """
+        Adds classes the trained model has never seen, with no samples, so partial_fit accepts them
+        :param classes: Classes that must be known to the model
+        :return:
+        """
+        model=self.__model
+        all_classes=np.union1d(model.classes_,classes)
+        if len(all_classes)==len(model.classes_): return
+
+        positions=np.searchsorted(all_classes,model.classes_)
+        n_features=model.theta_.shape[1]
+
+        theta=np.zeros((len(all_classes),n_features))
+        #partial_fit removes epsilon_ from var_ before updating, so empty classes hold just epsilon_:
+        var=np.full((len(all_classes),n_features),model.epsilon_)
+        class_count=np.zeros(len(all_classes))
+        theta[positions]=model.theta_
+        var[positions]=model.var_
+        class_count[positions]=model.class_count_
+
+        model.classes_=all_classes
+        model.theta_=theta
+        model.var_=var
+        model.class_count_=class_count
+        model.class_prior_=class_count/class_count.sum()
+
+    ##################################################################################################
+    def __drop_empty_classes(self):
+        """
+        Removes classes with no samples. Their prior is 0, so they never get any probability
+        but would make every prediction take log(0). __add_classes brings them back before the next update
+        :return:
+        """
+        model=self.__model
+        keep=model.class_count_>0
+        if keep.all(): return
+        model.classes_=model.classes_[keep]
+        model.theta_=model.theta_[keep]
+        model.var_=model.var_[keep]
+        model.class_count_=model.class_count_[keep]
+        model.class_prior_=model.class_count_/model.class_count_.sum()
+
+    ##################################################################################################
+    def save_model(self,filename:str):
+        """
+        Saves the fitted parameters and class list of a trained model to a compressed numpy file
+        :param filename: File location
+        :return:
+        """
+        if not self.__model_trained:
+            self.__show_message("Model must be trained before saving.")
+            return
+        parameters={name:getattr(self.__model,name) for name in self.FITTED_PARAMETERS}
+        with open(filename,"wb") as file:
+            np.savez_compressed(
+                file,
+                var_smoothing=self.__model.var_smoothing,
+                fingerprint=str(self.__fingerprint or ""),
+                **parameters
+            )
+        self.__show_message(f"Model saved to {filename}")
+
+    ##################################################################################################
+    def load_model(self,filename:str)->bool:
+        """
+        Restores a model saved with save_model. Replaces the current model
+        :param filename: File location
+        :return: True if the model was loaded
+        """
+        try:
+            with np.load(filename,allow_pickle=False) as saved:
+                model=GaussianNB(var_smoothing=float(saved["var_smoothing"]))
+                for name in self.FITTED_PARAMETERS:
+                    setattr(model,name,saved[name])
+                fingerprint=str(saved["fingerprint"]) or None
+        except (OSError,KeyError,ValueError) as err:
+            self.__handle_error(err,f"Could not load model from {filename}","load_model")
+            return False
+
+        model.n_features_in_=model.theta_.shape[1]
+        self.reset_model()
+        self.__model=model
+        self.__drop_empty_classes() #(Models saved with empty classes by older versions)
+        self.__model_trained=True
+        self.__fingerprint=fingerprint
+        self.__show_message(f"Model loaded from {filename}")
+        return True
+
+    ##################################################################################################
+    def build_posterior_table(self,max_points:int=DEFAULT_TABLE_POINTS,block_size:int=DEFAULT_BLOCK_SIZE,progress=None):
+        """
+        Precomputes the posteriors used by MODE_TABLE. Runs automatically on the first MODE_TABLE prediction
+        :param max_points: Number of grid points in the table (More points give finer ranges but use more memory)
+        :param block_size: Number of grid points scored at once
+        :param progress: Called as progress(done,total) while the table is built
+        :return:
+        """
+        if not self.__model_trained:
+            self.__show_message("Model must be trained before building a lookup table.")
+            return
+        self.__posterior_table=PosteriorTable(self.__model,max_points,block_size,progress)
+        self.__show_message("Posterior lookup table built")
 
     ##################################################################################################
     def is_trained(self):
         return self.__model_trained
     ##################################################################################################
+    def get_fingerprint(self):
+        return self.__fingerprint
+    ##################################################################################################
+    def set_fingerprint(self,fingerprint:str):
+        self.__fingerprint=fingerprint
+    ##################################################################################################
+    def get_parameter_hash(self)->str:
+        """
+        Identifies the fitted parameters, so two models that predict the same have the same hash
+        (Used to key cached predictions, see PredictionCache)
+        :return: sha256 of the fitted parameters or None if the model is not trained
+        """
+        if not self.__model_trained: return None
+        sha=hashlib.sha256(repr(float(self.__model.var_smoothing)).encode())
+        for name in self.FITTED_PARAMETERS:
+            value=np.ascontiguousarray(getattr(self.__model,name))
+            sha.update(f"{name}:{value.dtype.str}:{value.shape}".encode())
+            sha.update(value.tobytes())
+        return sha.hexdigest()
+    ##################################################################################################
     def drop_data(self,category:str):
         """
         Call this method to drop a category from data to be processed
@@ -103,28 +362,355 @@ class NaiveBayesModel:
                 self.__handle_error(err,f"Could not drop data category {category}","drop_data")
 
     ##################################################################################################
-    def run_prediction(self,dataset:DataSet)->DataSet:
+    def run_prediction(self,dataset:DataSet,mode:str=MODE_GRID,block_size:int=DEFAULT_BLOCK_SIZE,workers:int=None,
+                       progress=None,cancel=None,cache=None)->DataSet:
         """
         Performs prediction based on provided dataset
         :param dataset: Dataset object
+        :param mode: MODE_GRID scores the grid in blocks, MODE_LEGACY one point at a time,
+            MODE_INTEGRATED integrates the class likelihoods over each range instead of sampling it,
+            MODE_TABLE averages precomputed posteriors over each range,
+            MODE_FACTORIZED scores the same grid as MODE_GRID from per feature likelihood tables
+        :param block_size: Number of grid points scored at once in MODE_GRID and MODE_FACTORIZED
+        :param workers: Number of processes used to score the grid in MODE_GRID (None or 1 runs in this process)
+        :param progress: Called as progress(done,total) with the number of grid points scored so far
+        :param cancel: threading.Event, once set the prediction stops by raising PredictionCancelled
+            and the dataset is left unchanged
+        :param cache: PredictionCache, a prediction already made with the same parameters, ranges,
+            threshold, mode and settings is taken from it instead of being computed again
         :return: new dataset with predictions
+        In MODE_GRID and MODE_FACTORIZED the totals of the last prediction are kept, and when only one range
+        changed since (for example its high was raised) only the added or removed values of that range are scored
         """
-        # Approx 11,027 per minute
-        # multiply instructions by 0.0054409662487301 to get estimated seconds
         if not self.__model_trained:
             self.train_model(dataset)
+        #Sums and counts for every day, continuing from any distribution already in the dataset:
+        accumulator=dataset.get_accumulator(self.__model.classes_)
+
+        key=None
+        if cache is not None:
+            key=cache.make_key(self.get_parameter_hash(),dataset.input_ranges,dataset.threshold,mode,
+                               self.__prediction_settings(mode,block_size))
+            cached=cache.get(key)
+            if cached is not None and np.array_equal(cached[0],self.__model.classes_):
+                self.__show_message("Prediction cache hit")
+                accumulator.add_totals(cached[1],cached[2])
+                dataset.set_accumulator(accumulator)
+                return dataset
+
+        #This run's own totals, kept apart from the distribution it continues from
+        #(They are what the cache and the incremental state hold):
+        run=ProbabilityAccumulator(self.__model.classes_)
+        update=self.__range_update(dataset,mode) if mode in self.INCREMENTAL_MODES else None
+
         print("Prediction running")
-        #Recursive function: O(i*n)
-        dataset=self.__recursive_predict(dataset,dataset.input_ranges)
+        self.__progress=progress
+        self.__cancel=cancel
+        try:
+            if mode==self.MODE_LEGACY:
+                # Approx 11,027 per minute
+                # multiply instructions by 0.0054409662487301 to get estimated seconds
+                #Recursive function: O(i*n)
+                self.__points_done=0
+                self.__points_total=PredictionGrid(dataset.input_ranges).size
+                dataset=self.__recursive_predict(dataset,run,dataset.input_ranges)
+            elif update is not None:
+                dataset=self.__incremental_predict(dataset,run,mode,block_size,workers,*update)
+            elif mode==self.MODE_GRID and workers is not None and workers>1:
+                dataset=self.__sharded_predict(dataset,run,block_size,workers)
+            elif mode==self.MODE_GRID:
+                dataset=self.__grid_predict(dataset,run,block_size)
+            elif mode==self.MODE_INTEGRATED:
+                dataset=self.__integrated_predict(dataset,run)
+            elif mode==self.MODE_TABLE:
+                dataset=self.__table_predict(dataset,run,block_size)
+            elif mode==self.MODE_FACTORIZED:
+                dataset=self.__factorized_predict(dataset,run,block_size)
+            else:
+                raise ValueError(f"Unknown prediction mode: {mode}")
+        finally:
+            self.__progress=None
+            self.__cancel=None
+
+        if mode in self.INCREMENTAL_MODES:
+            axes=PredictionGrid(dataset.input_ranges).axes
+            self.__range_state=(mode,dataset.threshold,axes,run.sums.copy(),run.counts.copy())
+        if cache is not None:
+            cache.put(key,run.classes,run.sums,run.counts)
+        accumulator.add_totals(run.sums,run.counts)
+
+        #Save the distribution and build the graph once the run is done:
+        dataset.set_accumulator(accumulator)
+        return dataset
+
+    ##################################################################################################
+    def __prediction_settings(self,mode:str,block_size:int)->dict:
+        """
+        Options besides the ranges and threshold that change a prediction's result (Part of the cache key).
+        Workers are left out, the sharded grid gives the same sums as scoring it in one process
+        :return: Dictionary
+        """
+        settings={"block_size":block_size}
+        if mode==self.MODE_TABLE:
+            table=self.__posterior_table
+            settings["table_points"]=self.DEFAULT_TABLE_POINTS if table is None else table.max_points
+        return settings
+
+    ##################################################################################################
+    def __grid_predict(self,dataset:DataSet,accumulator:ProbabilityAccumulator,block_size:int,
+                       grid:PredictionGrid=None)->DataSet:
+        """
+        Scores every combination of the input ranges, a block of points per call to the model.
+        Gives the same days and counts as the point by point path. Probabilities only differ by
+        floating point rounding (sklearn normalizes a block slightly differently than a single row)
+        :param dataset: Dataset object
+        :param accumulator: Receives the probabilities
+        :param block_size: Number of grid points per block
+        :param grid: Points to score (Defaults to the grid of the dataset's input ranges)
+        :return: Dataset object
+        """
+        if grid is None:
+            grid=PredictionGrid(dataset.input_ranges)
+        if grid.size==0: return dataset   #Nothing to score
+
+        self.__step(0,grid.size)
+        for start,points in grid.blocks(block_size):
+            accumulator.add_block(self.__model.predict_proba(points),dataset.threshold)
+            self.__step(start+len(points),grid.size)
+
+        dataset.input_data=grid.block(grid.size-1,grid.size)[0].tolist()
         return dataset
 
     ##################################################################################################
-    def __recursive_predict(self,dataset:DataSet,all_ranges:list,pre_list:list=[])->DataSet:
+    def __factorized_predict(self,dataset:DataSet,accumulator:ProbabilityAccumulator,block_size:int,
+                           grid:PredictionGrid=None)->DataSet:
+        """
+        Scores the same grid as __grid_predict without calling the model per point.
+        Under naive Bayes each feature adds its own log likelihood, so every value of every range is
+        evaluated once per class (sum of the range lengths x classes) and a grid point only adds up
+        one row of each feature's table before being normalized. Agrees with predict_proba to about 1e-15
+        :param dataset: Dataset object
+        :param accumulator: Receives the probabilities
+        :param block_size: Number of grid points per block
+        :param grid: Points to score (Defaults to the grid of the dataset's input ranges)
+        :return: Dataset object
+        """
+        if grid is None:
+            grid=PredictionGrid(dataset.input_ranges)
+        if grid.size==0: return dataset   #Nothing to score
+
+        model=self.__model
+        tables=_feature_log_likelihoods(model.theta_,model.var_,grid.axes)
+        with np.errstate(divide="ignore"):
+            log_prior=np.log(model.class_prior_)
+
+        self.__step(0,grid.size)
+        for start in range(0,grid.size,block_size):
+            stop=min(start+block_size,grid.size)
+            joint=log_prior+sum(table[index] for table,index in
+                                zip(tables,np.unravel_index(np.arange(start,stop),grid.shape)))
+            #Normalize each point (Same as subtracting logsumexp, with a single exp):
+            probabilities=np.exp(joint-joint.max(axis=1,keepdims=True))
+            probabilities/=probabilities.sum(axis=1,keepdims=True)
+            accumulator.add_block(probabilities,dataset.threshold)
+            self.__step(stop,grid.size)
+
+        dataset.input_data=grid.block(grid.size-1,grid.size)[0].tolist()
+        return dataset
+
+    ##################################################################################################
+    def __range_update(self,dataset:DataSet,mode:str):
+        """
+        Compares the dataset's ranges with those of the last prediction. Values are matched exactly,
+        so a range keeps its totals when its high changes, or its low changes by whole steps
+        :param dataset: Dataset object
+        :param mode: Prediction mode
+        :return: (axes, changed axis, added values, removed values) or None if the grid must be scored again
+        """
+        if self.__range_state is None: return None
+        old_mode,threshold,old_axes,sums,counts=self.__range_state
+        axes=PredictionGrid(dataset.input_ranges).axes
+        if old_mode!=mode or threshold!=dataset.threshold or len(axes)!=len(old_axes):
+            return None
+        if len(axes)==0:
+            return None #No ranges, nothing to continue from
+
+        changed=[i for i,(old,new) in enumerate(zip(old_axes,axes)) if not np.array_equal(old,new)]
+        if len(changed)==0:
+            return axes,0,axes[0][:0],axes[0][:0]
+        if len(changed)>1:
+            return None
+        axis=changed[0]
+        added=axes[axis][~np.isin(axes[axis],old_axes[axis])]
+        removed=old_axes[axis][~np.isin(old_axes[axis],axes[axis])]
+        if len(added)+len(removed)>=len(axes[axis]):
+            return None #Scoring the whole grid is as cheap
+        return axes,axis,added,removed
+
+    ##################################################################################################
+    def __incremental_predict(self,dataset:DataSet,accumulator:ProbabilityAccumulator,mode:str,block_size:int,
+                              workers:int,axes:list,axis:int,added,removed)->DataSet:
+        """
+        Continues from the totals of the last prediction, scoring only the slices of the grid
+        where one range gained or lost values (The other ranges are unchanged).
+        Counts are exact, sums differ from scoring the whole grid by floating point rounding
+        :param dataset: Dataset object
+        :param accumulator: Receives the totals
+        :param mode: MODE_GRID or MODE_FACTORIZED
+        :param block_size: Number of grid points per block
+        :param workers: Number of processes in MODE_GRID
+        :param axes: Values of every range
+        :param axis: Position of the range that changed
+        :param added: Values of that range that are new
+        :param removed: Values of that range that are gone
+        :return: Dataset object
+        """
+        sums,counts=self.__range_state[3:]
+        added_grid=PredictionGrid(axes=axes[:axis]+[added]+axes[axis+1:])
+        removed_grid=PredictionGrid(axes=axes[:axis]+[removed]+axes[axis+1:])
+        self.__show_message(f"Scoring {added_grid.size} added and {removed_grid.size} removed grid points")
+
+        #Progress of both slices as one run:
+        total=added_grid.size+removed_grid.size
+        progress=self.__progress
+        removed_totals=ProbabilityAccumulator(accumulator.classes)
+        for grid,target,offset in ((added_grid,accumulator,0),(removed_grid,removed_totals,added_grid.size)):
+            if progress is not None:
+                self.__progress=lambda done,_,offset=offset: progress(offset+done,total)
+            if mode==self.MODE_FACTORIZED:
+                self.__factorized_predict(dataset,target,block_size,grid)
+            elif workers is not None and workers>1:
+                self.__sharded_predict(dataset,target,block_size,workers,grid)
+            else:
+                self.__grid_predict(dataset,target,block_size,grid)
+        self.__progress=progress
+
+        counts=counts+accumulator.counts-removed_totals.counts
+        sums=sums+accumulator.sums-removed_totals.sums
+        #Rounding can leave a little above or below zero where every probability was removed:
+        sums=np.where(counts>0,np.maximum(sums,0.0),0.0)
+        accumulator.sums=sums
+        accumulator.counts=counts
+        return dataset
+
+    ##################################################################################################
+    def __sharded_predict(self,dataset:DataSet,accumulator:ProbabilityAccumulator,block_size:int,workers:int,
+                          grid:PredictionGrid=None)->DataSet:
+        """
+        Same as __grid_predict with the grid split into shards scored by a pool of processes.
+        The model and grid are sent once to each worker, tasks are only index bounds.
+        Shards return the totals of each block and these are added in block order,
+        so the result is bit for bit the same as the single process path
+        :param dataset: Dataset object
+        :param accumulator: Receives the probabilities
+        :param block_size: Number of grid points per block
+        :param workers: Number of processes
+        :param grid: Points to score (Defaults to the grid of the dataset's input ranges)
+        :return: Dataset object
+        """
+        if grid is None:
+            grid=PredictionGrid(dataset.input_ranges)
+        if grid.size==0: return dataset   #Nothing to score
+
+        #Shards hold a whole number of blocks so block boundaries match the single process path:
+        block_count=-(-grid.size//block_size)
+        blocks_per_shard=max(1,-(-block_count//(workers*self.SHARDS_PER_WORKER)))
+        shard_size=blocks_per_shard*block_size
+        starts=range(0,grid.size,shard_size)
+        stops=[min(start+shard_size,grid.size) for start in starts]
+
+        self.__step(0,grid.size)
+        executor=ProcessPoolExecutor(max_workers=workers,initializer=_init_shard_worker,initargs=(self.__model,grid))
+        try:
+            #map returns the shards in order no matter which finishes first:
+            shards=executor.map(_score_shard,starts,stops,[block_size]*len(stops),[dataset.threshold]*len(stops))
+            for stop,shard in zip(stops,shards):
+                for sums,counts in shard:
+                    accumulator.add_totals(sums,counts)
+                self.__step(stop,grid.size)
+        finally:
+            #Shards that have not started are dropped if the prediction was cancelled:
+            executor.shutdown(wait=True,cancel_futures=True)
+
+        dataset.input_data=grid.block(grid.size-1,grid.size)[0].tolist()
+        return dataset
+
+    ##################################################################################################
+    def __table_predict(self,dataset:DataSet,accumulator:ProbabilityAccumulator,block_size:int)->DataSet:
+        """
+        Averages the precomputed posteriors that fall within [low, high] of each range.
+        The threshold is applied to each day's average since single points are not kept in the table.
+        Falls back to scoring the grid when a range reaches outside the table
+        :param dataset: Dataset object
+        :param accumulator: Receives the sums and counts
+        :param block_size: Number of grid points per block (Table building and fallback)
+        :return: Dataset object
+        """
+        if len(dataset.input_ranges)==0: return dataset   #Nothing to score
+        if self.__posterior_table is None:
+            self.build_posterior_table(block_size=block_size,progress=self.__step)
+
+        self.__step(0,1)
+        result=self.__posterior_table.query(dataset.input_ranges)
+        if result is None:
+            self.__show_message("Ranges reach outside the lookup table, scoring the grid instead")
+            return self.__grid_predict(dataset,accumulator,block_size)
+
+        sums,count=result
+        passed=sums/count>=dataset.threshold
+        accumulator.add_totals(np.where(passed,sums,0.0),np.where(passed,count,0))
+        self.__step(1,1)
+        return dataset
+
+    ##################################################################################################
+    def __integrated_predict(self,dataset:DataSet,accumulator:ProbabilityAccumulator)->DataSet:
+        """
+        Posterior of each day given that every feature lies somewhere in its range [low, high].
+        Each class likelihood is the Gaussian averaged over the range, which has a closed form
+        using the normal CDF. Features are independent under naive Bayes so the log averages add up.
+        Cost depends on the number of features and classes only, not on Range.step
+        :param dataset: Dataset object
+        :param accumulator: Receives one probability per day
+        :return: Dataset object
+        """
+        ranges=dataset.input_ranges
+        if len(ranges)==0: return dataset   #Nothing to score
+        self.__step(0,1)
+
+        low=np.array([r.low for r in ranges],dtype=float)
+        high=np.array([r.high for r in ranges],dtype=float)
+        if (high<low).any():
+            raise ValueError("Range low must not be greater than high")
+
+        #Arrays are (classes x features):
+        mean=self.__model.theta_
+        std=np.sqrt(self.__model.var_)
+        width=high-low
+
+        #Average of the density over each range: (CDF(high)-CDF(low))/width
+        #A range with no width is just the density at that point:
+        with np.errstate(divide="ignore",invalid="ignore"):
+            log_average=np.where(
+                width>0,
+                _log_interval_mass(low,high,mean,std)-np.log(np.where(width>0,width,1)),
+                -0.5*np.log(2*np.pi*self.__model.var_)-((low-mean)**2)/(2*self.__model.var_)
+            )
+
+        joint_log_likelihood=np.log(self.__model.class_prior_)+log_average.sum(axis=1)
+        probabilities=np.exp(joint_log_likelihood-logsumexp(joint_log_likelihood))
+
+        accumulator.add(probabilities,dataset.threshold)
+        self.__step(1,1)
+        return dataset
+
+    ##################################################################################################
+    def __recursive_predict(self,dataset:DataSet,accumulator:ProbabilityAccumulator,all_ranges:list,pre_list:list=[])->DataSet:
         """
         Each variable must be calculated over a range of values.
         In the case where multiple variables have ranges, this recursion ensures that each
         combination is considered in the calculation
         :param dataset: Dataset object
+        :param accumulator: Receives the probabilities
         :param all_ranges: List of Range objects corresponding to each feature in the dataset
         :param pre_list: Used for recursion
         :return:
@@ -147,67 +733,51 @@ class NaiveBayesModel:
             #If there are still ranges in the list do recursion
             if len(ranges_copy) > 0:
                 #Recursion
-                self.__recursive_predict(dataset,ranges_copy, new_data)
+                self.__recursive_predict(dataset,accumulator,ranges_copy, new_data)
             else:
                 #If new_data has 1 number for each range, perform calculation:
                 dataset.input_data=new_data
-                dataset=self.__make_prediction(dataset)
+                dataset=self.__make_prediction(dataset,accumulator)
+                self.__points_done+=1
+                self.__step(self.__points_done,self.__points_total)
 
         return dataset
 
     ##################################################################################################
-    def __make_prediction(self,dataset:DataSet)->DataSet:
+    def __make_prediction(self,dataset:DataSet,accumulator:ProbabilityAccumulator)->DataSet:
         """
         Takes a dataset and makes a prediction using the Naive Bayes Model
-        Output is saved in the Dataset
+        Output is added to the accumulator
         :param dataset: Dataset object
-        :return: New Dataset
+        :param accumulator: Sum and count of probabilities for each Julian day.
+            The prob. sum is divided by prob. count to give the average
+        :return: Dataset object
         """
-        #This is the prior distribution curve saved to the dataset:
-        #Nested list [[<Julian day>,<Sum of probabilities>, <Count of probabilities>]]
-        #The prob. sum is divided by prob. count to give the average
-        all_conditions=dataset.get_probability_dist()
-
         #Get the input data to make prediction
         new_data = dataset.input_data  # Example [Temperature, Humidity, SoilCondition]
-        #Threshold can be controlled to only display meaningful values
-        threshold=dataset.threshold
 
         #Makes a probability distribution in the form of a list:
         probabilities = self.__model.predict_proba([new_data])
 
-        #Initialize new conditions list
-        new_conditions = []
-
-        #Cycles through the values in the new distribution and adds it to the new list
-        # if it surpasses the threshold requirements:
-        #self.__model.classes_[i] holds the julian day value associated with each prob
-        for i, prob in enumerate(probabilities[0]):
-            if prob >= threshold:
-                new_conditions.append([self.__model.classes_[i], prob])
-
-        #Compare each julian day/probability pair...
-        #Increment the count if found, else add to list:
-        for new_day, new_prob in new_conditions:
-            day_found = False
-            if len(all_conditions) > 0:
-                for i in range(len(all_conditions)):
-                    if new_day == all_conditions[i][0]:
-                        all_conditions[i][1] += new_prob
-                        all_conditions[i][2] += 1
-                        day_found = True
-                        break
-            if not day_found:
-                all_conditions.append([new_day, new_prob, 1])
-
-        #Save the new distribution to the dataset:
-        dataset.set_probability_dist(all_conditions)
-        # Sort dataset by day:
-        dataset.sort_probability_dist()
-
-        #Return new dataset (Technically not necessary since lists are passed by ref)
+        #Adds each probability to the sum for its day (same position as self.__model.classes_)
+        # if it surpasses the threshold requirements. Threshold can be controlled to only display meaningful values
+        accumulator.add(probabilities[0],dataset.threshold)
+
         return dataset
 
+    ##################################################################################################
+    def __step(self,done:int,total:int):
+        """
+        Reports progress of the running prediction and stops it if it was cancelled
+        :param done: Points scored so far
+        :param total: Points to score in total
+        :return:
+        """
+        if self.__cancel is not None and self.__cancel.is_set():
+            raise PredictionCancelled("Prediction cancelled")
+        if self.__progress is not None:
+            self.__progress(done,total)
+
     ##################################################################################################
     def __handle_error(self,err,msg:str=None,entry:str=None):
         print(f"Error{(' in '+ entry) if not None else ''}:\n"
@@ -216,3 +786,98 @@ class NaiveBayesModel:
     ##################################################################################################
     def __show_message(self,msg:str=""):
         print(msg)
+
+
+##################################################################################################
+def _splitmix64(values:np.ndarray)->np.ndarray:
+    """
+    splitmix64 mixing function, spreads consecutive integers over the whole uint64 range
+    :param values: uint64 array
+    :return: uint64 array
+    """
+    with np.errstate(over="ignore"):
+        z=values+np.uint64(0x9E3779B97F4A7C15)
+        z=(z^(z>>np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        z=(z^(z>>np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        return z^(z>>np.uint64(31))
+
+##################################################################################################
+def _holdout_mask(start:int,count:int,test_size:float,seed:int)->np.ndarray:
+    """
+    Decides which rows are held out for testing from their position in the data, the same way on every run
+    :param start: Position of the first row
+    :param count: Number of rows
+    :param test_size: Fraction of rows held out
+    :param seed: Changes which rows are picked
+    :return: Boolean array, True for held out rows
+    """
+    seed_hash=_splitmix64(np.array([seed],dtype=np.uint64))
+    positions=np.arange(start,start+count,dtype=np.uint64)
+    uniform=(_splitmix64(positions^seed_hash)>>np.uint64(11)).astype(float)/2.0**53
+    return uniform<test_size
+
+##################################################################################################
+def _feature_log_likelihoods(theta,var,axes:list)->list:
+    """
+    Gaussian log likelihood of every value of each feature for every class
+    :param theta: Class means, one row per class and one column per feature
+    :param var: Class variances, same shape as theta
+    :param axes: Values of each feature (1-D arrays)
+    :return: One array per feature, shape (values, classes)
+    """
+    tables=[]
+    for feature,values in enumerate(axes):
+        mean,variance=theta[:,feature],var[:,feature]
+        tables.append(-0.5*np.log(2.0*np.pi*variance)-0.5*(values[:,None]-mean)**2/variance)
+    return tables
+
+##################################################################################################
+def _log_interval_mass(low,high,mean,std):
+    """
+    log(CDF(high)-CDF(low)) of a normal distribution, accurate far out in either tail
+    :param low: Lower bounds (broadcast against mean)
+    :param high: Upper bounds (broadcast against mean)
+    :param mean: Means
+    :param std: Standard deviations
+    :return: Array of log probabilities
+    """
+    upper=(high-mean)/std
+    lower=(low-mean)/std
+    #Mirror intervals on the right of the mean so both ends sit in the left tail where log_ndtr is precise:
+    flip=lower>0
+    a=np.where(flip,-upper,lower)
+    b=np.where(flip,-lower,upper)
+    log_b=log_ndtr(b)
+    return log_b+np.log1p(-np.exp(log_ndtr(a)-log_b))
+
+
+##################################################################################################
+#State of a prediction worker process, set once by _init_shard_worker:
+_shard_worker={"model":None,"grid":None}
+
+def _init_shard_worker(model:GaussianNB,grid:PredictionGrid):
+    """
+    Runs once in each worker process of the pool
+    :param model: Trained sklearn model
+    :param grid: Grid being scored
+    :return:
+    """
+    _shard_worker["model"]=model
+    _shard_worker["grid"]=grid
+
+def _score_shard(start:int,stop:int,block_size:int,threshold:float)->list:
+    """
+    Scores a shard of the grid in a worker process
+    :param start: Index of the first point of the shard
+    :param stop: Index after the last point of the shard
+    :param block_size: Number of grid points per block
+    :param threshold: Probabilities below this are ignored
+    :return: List of (sums, counts), one per block in order
+    """
+    model=_shard_worker["model"]
+    grid=_shard_worker["grid"]
+    totals=[]
+    for block_start in range(start,stop,block_size):
+        points=grid.block(block_start,min(block_start+block_size,stop))
+        totals.append(ProbabilityAccumulator.block_totals(model.predict_proba(points),threshold))
+    return totals
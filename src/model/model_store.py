@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+from src.model import file_hash
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.structures import DataSet
+
+
+class ModelStore:
+    """
+    Keeps trained models on disk so they are only retrained when the data they came from changes.
+    Models are looked up by a fingerprint of the prepared dataset: hash of the source file,
+    every operation applied to the data since import, features, label and train/test split settings
+    """
+    HASH_FILE="file_hashes.json"    #Remembers file hashes between sessions
+    MODEL_EXTENSION=".npz"
+    FINGERPRINT_VERSION=1   #Change when the fingerprint contents change
+
+    def __init__(self,directory:str):
+        self.__directory=directory  #Where models are saved
+        os.makedirs(directory,exist_ok=True)
+        self.__hash_store=os.path.join(directory,self.HASH_FILE)   #Source file hashes (See file_hash.hash_file)
+
+    ##################################################################################################
+    def prepare_model(self,model:NaiveBayesModel,dataset:DataSet,test_size=0.3,random_state=40)->bool:
+        """
+        Makes sure the model is trained on the dataset. Reuses the model if it is already trained on the same
+        data, loads it from disk if it was saved before and only trains it if neither is possible
+        :param model: NaiveBayesModel
+        :param dataset: Prepared Dataset object
+        :param test_size: Size of test data vs training data
+        :param random_state: Randomization
+        :return: True if the model had to be trained
+        """
+        fingerprint=self.fingerprint(dataset,test_size,random_state)
+        if model.is_trained() and model.get_fingerprint()==fingerprint:
+            self.__show_message(f"Model for {dataset.name} is up to date")
+            return False
+
+        filename=self.get_filename(fingerprint)
+        if os.path.exists(filename) and model.load_model(filename):
+            if model.get_fingerprint()==fingerprint:
+                return False
+
+        model.reset_model()
+        model.train_model(dataset,test_size,random_state)
+        if model.is_trained():
+            model.set_fingerprint(fingerprint)
+            model.save_model(filename)
+        return True
+
+    ##################################################################################################
+    def update_model(self,model:NaiveBayesModel,new_rows:DataSet,dataset:DataSet=None,test_size=0.3,random_state=40):
+        """
+        Adds new rows to a trained model with partial_fit and replaces its saved copy.
+        The model is then saved under the fingerprint of the dataset it now represents
+        :param model: NaiveBayesModel (Usually returned by prepare_model for the old data)
+        :param new_rows: Dataset object holding only the new rows
+        :param dataset: Prepared dataset including the new rows (Used for the new fingerprint)
+        :param test_size: Size of test data vs training data
+        :param random_state: Randomization
+        :return:
+        """
+        old_fingerprint=model.get_fingerprint()
+        model.update_model(new_rows,test_size=test_size,random_state=random_state)
+        if dataset is None or not model.is_trained():
+            return
+
+        fingerprint=self.fingerprint(dataset,test_size,random_state)
+        model.set_fingerprint(fingerprint)
+        model.save_model(self.get_filename(fingerprint))
+
+        #The old file described data that has been replaced:
+        if old_fingerprint and old_fingerprint!=fingerprint and os.path.exists(self.get_filename(old_fingerprint)):
+            os.remove(self.get_filename(old_fingerprint))
+
+    ##################################################################################################
+    def fingerprint(self,dataset:DataSet,test_size=0.3,random_state=40)->str:
+        """
+        Identifies the data a model would be trained on
+        :param dataset: Prepared Dataset object
+        :param test_size: Size of test data vs training data
+        :param random_state: Randomization
+        :return: Hex string
+        """
+        features=dataset.get_features()
+        labels=dataset.get_labels()
+        description={
+            "version":self.FINGERPRINT_VERSION,
+            "source":file_hash.hash_file(dataset.get_filename(),self.__hash_store),
+            "history":dataset.get_history(),
+            "features":list(getattr(features,"columns",[])),
+            "label":getattr(labels,"name",None),
+            "test_size":test_size,
+            "random_state":random_state,
+        }
+        text=json.dumps(description,sort_keys=True,default=str)
+        return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+    ##################################################################################################
+    def get_filename(self,fingerprint:str)->str:
+        return os.path.join(self.__directory,f"{fingerprint}{self.MODEL_EXTENSION}")
+
+    ##################################################################################################
+    def __handle_error(self,err,msg:str=None,entry:str=None):
+        print(f"Error{(' in '+ entry) if not None else ''}:\n"
+              f"\t{msg}\n\t{err}")
+
+    ##################################################################################################
+    def __show_message(self,msg:str=""):
+        print(msg)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class PredictionCache:
+    """
+    Finished prediction results (sums and counts for each day) kept so the same query is never computed twice.
+    Results are looked up by the model's parameters, the input ranges, the threshold, the prediction mode
+    and the mode's settings (block size, lookup table resolution).
+    The least recently used results are dropped once max_entries is reached.
+    With a directory the results are also saved to disk and survive between sessions
+    """
+    FILE_EXTENSION=".npz"
+    VERSION=2   #Change when the key or the file layout changes
+
+    def __init__(self,max_entries:int=64,directory:str=None,max_files:int=1024):
+        """
+        :param max_entries: Results kept in memory
+        :param directory: Where results are saved (None keeps them in memory only)
+        :param max_files: Results kept on disk, the oldest files are removed first
+        """
+        self.__max_entries=max_entries
+        self.__directory=directory
+        self.__max_files=max_files
+        self.__entries=OrderedDict()    #{key:(classes,sums,counts)}, most recently used last
+        self.__lock=threading.Lock()    #Predictions can run on several threads
+        self.hits=0
+        self.misses=0
+        if directory is not None:
+            os.makedirs(directory,exist_ok=True)
+
+    def __getstate__(self):
+        #Sent to worker processes without the lock or the results in memory, they share the directory only
+        state=self.__dict__.copy()
+        del state["_PredictionCache__lock"]
+        state["_PredictionCache__entries"]=OrderedDict()
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.__lock=threading.Lock()
+
+    ##################################################################################################
+    def make_key(self,model_hash:str,ranges:list,threshold:float,mode:str,settings:dict=None)->str:
+        """
+        :param model_hash: NaiveBayesModel.get_parameter_hash()
+        :param ranges: Range objects of the prediction
+        :param threshold: Dataset threshold
+        :param mode: Prediction mode
+        :param settings: Every other option that changes the result, for example {"block_size":4096}
+        :return: Key of the result
+        """
+        description={
+            "version":self.VERSION,
+            "model":model_hash,
+            "ranges":[[float(r.low),float(r.high),float(r.step)] for r in ranges],
+            "threshold":float(threshold),
+            "mode":mode,
+            "settings":settings or dict(),
+        }
+        return hashlib.sha256(json.dumps(description,sort_keys=True).encode()).hexdigest()[:32]
+
+    ##################################################################################################
+    def get(self,key:str):
+        """
+        :param key: See make_key
+        :return: (classes, sums, counts) or None if the result is not cached
+        """
+        with self.__lock:
+            entry=self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+            else:
+                entry=self.__load(key)
+                if entry is not None:
+                    self.__remember(key,entry)
+
+            if entry is None:
+                self.misses+=1
+                return None
+            self.hits+=1
+            return tuple(array.copy() for array in entry)
+
+    ##################################################################################################
+    def put(self,key:str,classes,sums,counts):
+        """
+        Saves a finished result
+        :param key: See make_key
+        :param classes: The model's classes_
+        :param sums: Sum of probabilities for each class
+        :param counts: Count of probabilities for each class
+        :return:
+        """
+        entry=(np.array(classes),np.array(sums,dtype=float),np.array(counts,dtype=np.int64))
+        with self.__lock:
+            self.__remember(key,entry)
+            self.__save(key,entry)
+
+    ##################################################################################################
+    def clear(self):
+        """
+        Forgets the results kept in memory (Files on disk are kept)
+        :return:
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    ##################################################################################################
+    def __remember(self,key:str,entry:tuple):
+        self.__entries[key]=entry
+        self.__entries.move_to_end(key)
+        while len(self.__entries)>self.__max_entries:
+            self.__entries.popitem(last=False)
+
+    ##################################################################################################
+    def __load(self,key:str):
+        if self.__directory is None: return None
+        path=os.path.join(self.__directory,f"{key}{self.FILE_EXTENSION}")
+        try:
+            with np.load(path,allow_pickle=False) as saved:
+                entry=(saved["classes"],saved["sums"],saved["counts"])
+            os.utime(path)  #Recently used files are removed last
+            return entry
+        except (OSError,KeyError,ValueError):
+            return None
+
+    ##################################################################################################
+    def __save(self,key:str,entry:tuple):
+        if self.__directory is None: return
+        path=os.path.join(self.__directory,f"{key}{self.FILE_EXTENSION}")
+        try:
+            with open(path+".tmp","wb") as file:
+                np.savez(file,classes=entry[0],sums=entry[1],counts=entry[2])
+            os.replace(path+".tmp",path)
+
+            files=[os.path.join(self.__directory,name) for name in os.listdir(self.__directory)
+                   if name.endswith(self.FILE_EXTENSION)]
+            if len(files)>self.__max_files:
+                files.sort(key=os.path.getmtime)
+                for old in files[:len(files)-self.__max_files]:
+                    os.remove(old)
+        except OSError as err:
+            self.__handle_error(err,"Could not save prediction result","__save")
+
+    ##################################################################################################
+    def __handle_error(self,err,msg:str=None,entry:str=None):
+        print(f"Error{(' in '+ entry) if not None else ''}:\n"
+              f"\t{msg}\n\t{err}")
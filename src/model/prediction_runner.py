@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+from functools import partial
+from src.model.g_naive_bayes import NaiveBayesModel, PredictionCancelled
+from src.model.model_store import ModelStore
+from src.model.prediction_cache import PredictionCache
+from src.model.structures import DataSet
+
+
+class PredictionRunner:
+    """
+    Trains and predicts independent (model, dataset) pairs at the same time, one train->predict chain per pair.
+    Threads suit the numpy/sklearn work, which releases the GIL for most of its time.
+    Processes avoid the GIL completely but send the model and dataset to the worker and back,
+    cannot report progress while a chain runs and only stop chains that have not started when cancelled
+    """
+    THREADS="thread"
+    PROCESSES="process"
+
+    def __init__(self,model_store:ModelStore=None,executor:str=THREADS,workers:int=None,
+                 cache:PredictionCache=None):
+        """
+        :param model_store: Reuses saved models instead of training (None always trains)
+        :param executor: THREADS or PROCESSES
+        :param workers: Chains run at once (Defaults to one per job)
+        :param cache: Reuses finished predictions (See PredictionCache). With processes only
+            the results saved to the cache's directory are shared with the workers
+        """
+        if executor not in (self.THREADS,self.PROCESSES):
+            raise ValueError(f"Unknown executor: {executor}")
+        self.__model_store=model_store
+        self.__executor=executor
+        self.__workers=workers
+        self.__cache=cache
+
+    ##################################################################################################
+    def run(self,jobs:dict,mode:str=NaiveBayesModel.MODE_GRID,progress=None,cancel=None)->dict:
+        """
+        Runs every job and waits for all of them
+        :param jobs: {name: (NaiveBayesModel, DataSet)}
+        :param mode: Prediction mode passed to run_prediction
+        :param progress: Called as progress(name,done,total) while a job predicts (Threads only)
+        :param cancel: threading.Event, stops every job (Running jobs stop at their next step with threads)
+        :return: {name: (model, dataset, trained)}. With threads these are the objects passed in,
+            with processes they are the copies sent back by the workers. trained is False if the dataset was empty
+        """
+        if len(jobs)==0: return dict()
+        workers=self.__workers or len(jobs)
+        if self.__executor==self.THREADS:
+            executor=ThreadPoolExecutor(max_workers=workers,thread_name_prefix="prediction")
+        else:
+            executor=ProcessPoolExecutor(max_workers=workers)
+
+        results=dict()
+        error=None
+        try:
+            futures=dict()
+            for name,(model,dataset) in jobs.items():
+                if self.__executor==self.THREADS:
+                    job_progress=None if progress is None else partial(progress,name)
+                    futures[name]=executor.submit(_train_and_predict,model,dataset,self.__model_store,mode,
+                                                  job_progress,cancel,self.__cache)
+                else:
+                    futures[name]=executor.submit(_train_and_predict,model,dataset,self.__model_store,mode,
+                                                  cache=self.__cache)
+
+            for name,future in futures.items():
+                try:
+                    results[name]=future.result()
+                except CancelledError:
+                    continue
+                except Exception as err:
+                    #Keep waiting for the other jobs so none is left running, then report the first error:
+                    if error is None: error=err
+                    continue
+                if self.__executor==self.PROCESSES:
+                    if progress is not None:
+                        progress(name,1,1)
+                    if cancel is not None and cancel.is_set():
+                        error=error or PredictionCancelled("Prediction cancelled")
+                        for other in futures.values():
+                            other.cancel()
+        finally:
+            executor.shutdown(wait=True,cancel_futures=True)
+
+        if error is not None:
+            raise error
+        return results
+
+
+##################################################################################################
+def _train_and_predict(model:NaiveBayesModel,dataset:DataSet,model_store:ModelStore,mode:str,
+                       progress=None,cancel=None,cache=None):
+    """
+    One job: train (or reuse) the model on the dataset, then predict its input ranges
+    :return: (model, dataset, trained)
+    """
+    if dataset.is_empty():
+        model.reset_model()
+        return model,dataset,False
+
+    if model_store is not None:
+        model_store.prepare_model(model,dataset)
+    else:
+        model.reset_model()
+        model.train_model(dataset)
+    if not model.is_trained():
+        return model,dataset,False
+
+    dataset=model.run_prediction(dataset,mode,progress=progress,cancel=cancel,cache=cache)
+    return model,dataset,True
@@ -0,0 +1,362 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import numpy as np
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.model_store import ModelStore
+from src.model.prediction_cache import PredictionCache
+from src.model.structures import Range
+from src.model.weather_data import WeatherData
+
+
+class PredictionService:
+    """
+    Small HTTP/JSON service answering crop weather queries without the window. Only listens on localhost.
+        GET  /health    Service is up and the data is loaded
+        GET  /stats     Request, latency and throughput counters
+        POST /predict   {"county": "KING", "crop": "Apples"} uses the crop's ranges from the crop file, or
+                        {"county": "KING", "ranges": {"Temperature": [59, 68], "Wind": [0, 10, 0.5]}}
+                        ([low, high] uses the variable's usual step). Answers the average probability per day
+                        (Variables the crop file leaves blank for the crop are left out, like in BatchReport)
+    Trained models are kept warm per county and variable (least recently used are dropped past max_models).
+    Training and prediction run on a thread pool so the event loop keeps answering,
+    and identical requests that arrive while one is being computed share its result
+    """
+    HOST="127.0.0.1"
+    MAX_BODY=1<<20  #Largest request body accepted (bytes)
+    LATENCY_WINDOW=1000 #Latest requests the latency percentiles are taken from
+    RATE_WINDOW=60  #Seconds the recent throughput is measured over
+    REASONS={200:"OK",400:"Bad Request",404:"Not Found",405:"Method Not Allowed",
+             413:"Payload Too Large",500:"Internal Server Error",503:"Service Unavailable"}
+
+    def __init__(self,datafile:str,cropfile:str,model_dir:str=None,mode:str=NaiveBayesModel.MODE_GRID,
+                 workers:int=None,max_models:int=64,port:int=0):
+        """
+        :param datafile: Weather data CSV
+        :param cropfile: Crop conditions CSV
+        :param model_dir: Trained models are saved here and reused (None always trains)
+        :param mode: Prediction mode (Defaults to the one used by the window)
+        :param workers: Threads training and predicting at once (Defaults to ThreadPoolExecutor's choice)
+        :param max_models: Models kept in memory
+        :param port: Port to listen on (0 picks a free port, see start)
+        """
+        self.__datafile=datafile
+        self.__cropfile=cropfile
+        self.__model_store=None if model_dir is None else ModelStore(model_dir)
+        self.__mode=mode
+        self.__executor=ThreadPoolExecutor(max_workers=workers,thread_name_prefix="service")
+        self.__max_models=max_models
+        self.__port=port
+        self.__server=None
+        self.__session=None
+        self.__cache=PredictionCache()
+        self.__models=OrderedDict() #{(county, variable): Task returning (model, data, lock)}, most recently used last
+        self.__in_flight=dict() #{request key: Task} of the predictions being computed
+        self.__variables={variable[0]:variable for variable in WeatherData.VARIABLES}
+
+        #Counters:
+        self.__started=None
+        self.__requests=0
+        self.__errors=0
+        self.__computed=0   #Predictions computed
+        self.__coalesced=0  #Requests that shared a prediction already in flight
+        self.__latencies=deque(maxlen=self.LATENCY_WINDOW)  #Seconds taken by the latest requests
+        self.__finished=deque() #Times the requests of the last RATE_WINDOW seconds finished
+
+    ##################################################################################################
+    async def start(self)->int:
+        """
+        Loads the data and starts listening
+        :return: Port the service listens on
+        """
+        loop=asyncio.get_running_loop()
+        self.__session=await loop.run_in_executor(self.__executor,WeatherData.open_session,
+                                                  self.__datafile,self.__cropfile)
+        self.__server=await asyncio.start_server(self.__handle,self.HOST,self.__port)
+        self.__port=self.__server.sockets[0].getsockname()[1]
+        self.__started=time.monotonic()
+        self.__show_message(f"Prediction service listening on http://{self.HOST}:{self.__port}")
+        return self.__port
+
+    ##################################################################################################
+    async def stop(self):
+        """
+        Stops listening and waits for the running predictions
+        :return:
+        """
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server=None
+        self.__executor.shutdown(wait=True)
+
+    ##################################################################################################
+    def serve_forever(self):
+        """
+        Runs the service until interrupted (Ctrl+C)
+        :return:
+        """
+        async def serve():
+            await self.start()
+            try:
+                await self.__server.serve_forever()
+            finally:
+                await self.stop()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            self.__show_message("Prediction service stopped")
+
+    ##################################################################################################
+    def get_stats(self)->dict:
+        """
+        :return: Request counters, latency in milliseconds and throughput in requests per second
+        """
+        now=time.monotonic()
+        uptime=now-self.__started if self.__started is not None else 0.0
+        while self.__finished and self.__finished[0]<now-self.RATE_WINDOW:
+            self.__finished.popleft()
+        latencies=np.array(self.__latencies)*1000
+        return {
+            "uptime_s":round(uptime,3),
+            "requests":self.__requests,
+            "errors":self.__errors,
+            "in_flight":len(self.__in_flight),
+            "computed":self.__computed,
+            "coalesced":self.__coalesced,
+            "cache_hits":self.__cache.hits,
+            "warm_models":sum(1 for task in self.__models.values() if self.__is_warm(task)),
+            "latency_ms":{
+                "mean":round(float(latencies.mean()),3) if len(latencies) else None,
+                "p50":round(float(np.percentile(latencies,50)),3) if len(latencies) else None,
+                "p95":round(float(np.percentile(latencies,95)),3) if len(latencies) else None,
+                "max":round(float(latencies.max()),3) if len(latencies) else None,
+            },
+            "throughput_rps":{
+                "overall":round(self.__requests/uptime,3) if uptime>0 else 0.0,
+                "recent":round(len(self.__finished)/min(self.RATE_WINDOW,uptime),3) if uptime>0 else 0.0,
+            },
+        }
+
+    ##################################################################################################
+    async def __handle(self,reader:asyncio.StreamReader,writer:asyncio.StreamWriter):
+        """
+        Answers one HTTP request per connection
+        """
+        start=time.monotonic()
+        try:
+            status,answer=await self.__route(reader)
+        except ValueError as err:
+            status,answer=400,{"error":str(err)}
+        except Exception as err:
+            self.__handle_error(err,"Request failed","__handle")
+            status,answer=500,{"error":str(err)}
+
+        self.__requests+=1
+        if status>=400: self.__errors+=1
+        body=json.dumps(answer).encode()
+        try:
+            writer.write(f"HTTP/1.1 {status} {self.REASONS.get(status,'')}\r\n"
+                         f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("latin-1")+body)
+            await writer.drain()
+        except ConnectionError:
+            pass    #Client left before the answer
+        finally:
+            writer.close()
+        finished=time.monotonic()
+        self.__latencies.append(finished-start)
+        self.__finished.append(finished)
+
+    ##################################################################################################
+    async def __route(self,reader:asyncio.StreamReader):
+        """
+        Reads the request and dispatches it
+        :return: (HTTP status, JSON answer)
+        """
+        request_line=(await reader.readline()).decode("latin-1").split()
+        if len(request_line)!=3:
+            raise ValueError("Malformed request line")
+        method,target=request_line[0].upper(),urlsplit(request_line[1]).path
+
+        headers=dict()
+        while True:
+            line=await reader.readline()
+            if line in (b"\r\n",b"\n",b""): break
+            name,_,value=line.decode("latin-1").partition(":")
+            headers[name.strip().lower()]=value.strip()
+        try:
+            length=int(headers.get("content-length",0))
+        except ValueError:
+            raise ValueError("Content-Length must be a whole number") from None
+        if length<0:
+            raise ValueError("Content-Length must not be negative")
+        if length>self.MAX_BODY:
+            return 413,{"error":"Request body too large"}
+        try:
+            body=await reader.readexactly(length) if length>0 else b""
+        except asyncio.IncompleteReadError as err:
+            raise ValueError(f"Request body ended after {len(err.partial)} of {length} bytes") from None
+
+        if target=="/health":
+            return 200,{"status":"ok" if self.__session is not None else "loading"}
+        if target=="/stats":
+            return 200,self.get_stats()
+        if target=="/predict":
+            if method!="POST":
+                return 405,{"error":"Use POST with a JSON body"}
+            return 200,await self.predict(json.loads(body or b"{}"))
+        return 404,{"error":f"Unknown path {target}"}
+
+    ##################################################################################################
+    async def predict(self,query:dict)->dict:
+        """
+        Answers a /predict query (See the class description).
+        A query identical to one still being computed waits for that one instead of computing it again
+        :param query: Decoded JSON body
+        :return: {"county", "crop", "results": {variable: {"days", "averages", "counts"}}}
+        """
+        county,crop,ranges=self.__read_query(query)
+        key=json.dumps([county,ranges],sort_keys=True)
+        task=self.__in_flight.get(key)
+        if task is not None:
+            self.__coalesced+=1
+        else:
+            task=asyncio.ensure_future(self.__compute(county,ranges))
+            self.__in_flight[key]=task
+            task.add_done_callback(lambda _: self.__in_flight.pop(key,None))
+        #Shielded so a client that leaves doesn't cancel the prediction others are waiting for:
+        results=await asyncio.shield(task)
+        return {"county":county,"crop":crop,"results":results}
+
+    ##################################################################################################
+    def __read_query(self,query:dict):
+        """
+        Checks a /predict query
+        :return: (county, crop or None, {variable: [low, high, step]})
+        """
+        if not isinstance(query,dict) or not query.get("county"):
+            raise ValueError("Query needs a county")
+        county=str(query["county"])
+        if county not in self.__session.get_locations():
+            raise ValueError(f"Unknown county {county}")
+
+        crop=query.get("crop")
+        ranges=dict()
+        if crop is not None:
+            crop_dict=self.__session.get_crop_dict()
+            if crop not in crop_dict:
+                raise ValueError(f"Unknown crop {crop}")
+            for variable in WeatherData.VARIABLES:
+                crop_range=WeatherData.crop_range(crop_dict[crop],variable)
+                if crop_range is not None:
+                    ranges[variable[0]]=[crop_range.low,crop_range.high,crop_range.step]
+        for name,values in (query.get("ranges") or dict()).items():
+            if name not in self.__variables:
+                raise ValueError(f"Unknown variable {name}, use one of {list(self.__variables)}")
+            if not isinstance(values,list) or len(values) not in (2,3):
+                raise ValueError(f"Range of {name} must be [low, high] or [low, high, step]")
+            try:
+                low,high,step=[float(value) for value in values]+[self.__variables[name][3]]*(3-len(values))
+            except (TypeError,ValueError):
+                raise ValueError(f"Range of {name} must hold numbers") from None
+            if not all(np.isfinite([low,high,step])):
+                raise ValueError(f"Range of {name} must hold finite numbers")
+            if not step>0:
+                raise ValueError(f"Step of {name} must be positive")
+            ranges[name]=[low,high,step]
+        if len(ranges)==0:
+            raise ValueError(f"Crop {crop} has no ranges in the crop file" if crop is not None
+                             else "Query needs a crop or ranges")
+        return county,crop,ranges
+
+    ##################################################################################################
+    async def __compute(self,county:str,ranges:dict)->dict:
+        """
+        Predicts every requested variable, each on its warm model
+        """
+        self.__computed+=1
+        loop=asyncio.get_running_loop()
+        names=list(ranges)
+        models=await asyncio.gather(*[self.__get_model(county,name) for name in names])
+        predictions=await asyncio.gather(*[
+            loop.run_in_executor(self.__executor,self.__predict,warm,ranges[name])
+            for name,warm in zip(names,models)
+        ])
+        return dict(zip(names,predictions))
+
+    ##################################################################################################
+    def __get_model(self,county:str,name:str):
+        """
+        Trained model of one variable in one county. Models are only trained once,
+        a request arriving while the model is being trained waits for that training
+        :return: Task returning (model, data, lock)
+        """
+        key=(county,name)
+        task=self.__models.get(key)
+        if task is not None and (self.__is_warm(task) or not task.done()):
+            self.__models.move_to_end(key)
+            return task
+
+        loop=asyncio.get_running_loop()
+        task=asyncio.ensure_future(loop.run_in_executor(self.__executor,self.__train,county,self.__variables[name]))
+        self.__models[key]=task
+        while len(self.__models)>self.__max_models:
+            self.__models.popitem(last=False)
+        return task
+
+    ##################################################################################################
+    @staticmethod
+    def __is_warm(task)->bool:
+        """
+        :return: True if the model task finished training (Failed or cancelled trainings are not warm)
+        """
+        return task.done() and not task.cancelled() and task.exception() is None
+
+    ##################################################################################################
+    def __train(self,county:str,variable:tuple):
+        """
+        Runs on the thread pool
+        :return: (model, data, lock), the lock keeps predictions on the same model one at a time
+        """
+        data=WeatherData.variable_data(self.__session.view(variable[0]),variable,county)
+        model=NaiveBayesModel()
+        if not data.is_empty():
+            if self.__model_store is not None:
+                self.__model_store.prepare_model(model,data)
+            else:
+                model.train_model(data)
+        return model,data,threading.Lock()
+
+    ##################################################################################################
+    def __predict(self,warm:tuple,values:list)->dict:
+        """
+        Runs on the thread pool
+        :return: {"days", "averages", "counts"} (Empty if the county has no data for the variable)
+        """
+        model,data,lock=warm
+        if not model.is_trained():
+            return {"days":[],"averages":[],"counts":[]}
+        prediction=data.derive(data.name)
+        prediction.input_ranges=[Range(*values)]
+        with lock:
+            prediction=model.run_prediction(prediction,self.__mode,cache=self.__cache)
+        distribution=prediction.get_probability_dist()
+        return {
+            "days":[int(day) for day,prob,count in distribution],
+            "averages":[float(prob/count) for day,prob,count in distribution],
+            "counts":[int(count) for day,prob,count in distribution],
+        }
+
+    ##################################################################################################
+    def __handle_error(self,err,msg:str=None,entry:str=None):
+        print(f"Error{(' in '+ entry) if not None else ''}:\n"
+              f"\t{msg}\n\t{err}")
+
+    ##################################################################################################
+    def __show_message(self,msg:str=""):
+        print(msg)
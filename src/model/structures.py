@@ -1,20 +1,21 @@
-from unittest.mock import inplace
-
-from fontTools.subset import subset
+import weakref
 from scipy.ndimage import gaussian_filter1d
+import numpy as np
 import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+from src.model.data_cache import ColumnarCache
 
 # ------------------------DataSet----------------------------------
 class DataSet:
     """
     Dataset Structure used for the Naive Bayes model
     """
-    def __init__(self,name:str="",filename:str=""):
+    def __init__(self,name:str="",filename:str="",use_cache:bool=False,schema:dict=None):
         self.name = name    #Name
         self.__features = []    #Variables to compare against the labels, usually multiple
         self.__labels = []  #Usually the date, but can be any 1 variable
         self.threshold = 0  #Ignore values below ths
-        self.__probability_dist = [] #Used to chart probability [<Julian day>,<Sum of probabilities>, <Count of probabilities>]
+        self.__accumulator = None #Used to chart probability, sums and counts of probabilities for each Julian day
         self.__data_filename=filename   #Data file
         self.__data=None    #Processed dataset
         self.input_data = []    #Specific values to perform prediction. Corresponds to features
@@ -24,10 +25,46 @@ class DataSet:
         self.__filled_nan=False #Tracks if nan values were replaced by the fill_nan_value
         self.__fill_nan_value=None  #Can be used to replace NaN values
         self.__dropped_nan=False    #Tracks if NaN values were dropped
+        self.__history=[]   #Every operation applied to the data since import, used to fingerprint the dataset
+        self.__index=None   #GroupIndex on one column, only used while the data is the frame it was built on
+        self.__lazy=False   #When True, data operations are added to the plan instead of running
+        self.__plan=DataPlan()  #Operations waiting to run (Lazy mode)
 
         #Import data
         if filename != "" and filename is not None:
-            self.import_data(filename)
+            self.import_data(filename,use_cache,schema)
+
+    ##################################################################################################
+    def derive(self,name:str=""):
+        """
+        Creates a dataset that shares this dataset's prepared data instead of copying it.
+        Dataset methods never change a frame in place, so either dataset can keep
+        filtering, dropping NaN values etc. without affecting the other
+        Features, labels, ranges and the probability distribution are not carried over
+        :param name: Name of the new dataset
+        :return: New Dataset
+        """
+        self.__flush()
+        derived=DataSet(name)
+        derived.__data_filename=self.__data_filename
+        derived.__data=self.__data
+        derived.__filled_nan=self.__filled_nan
+        derived.__fill_nan_value=self.__fill_nan_value
+        derived.__dropped_nan=self.__dropped_nan
+        derived.__history=list(self.__history)
+        derived.__index=self.__index
+        derived.threshold=self.threshold
+        derived.__scale=self.__scale
+        return derived
+
+    ##################################################################################################
+    def __getstate__(self):
+        """
+        Datasets are pickled without their group index (It refers to its frame by weak reference)
+        """
+        state=self.__dict__.copy()
+        state["_DataSet__index"]=None
+        return state
 
     ##################################################################################################
     def is_empty(self):
@@ -35,6 +72,7 @@ class DataSet:
         Checks if resulting dataset is empty (Prevents bugs)
         :return:
         """
+        self.__flush()
         return self.__data.empty
 
     ##################################################################################################
@@ -44,18 +82,83 @@ class DataSet:
         :param category: Column to look for values in data
         :return: List of values
         """
+        self.__flush()
         cat_list=list()
-        if self.__data is not None:
+        index=self.__get_index(category)
+        if index is not None and not index.has_missing:
+            cat_list=index.get_values()
+        elif self.__data is not None:
             cat_list=self.__data[category].unique().tolist()
         return cat_list
 
+    ##################################################################################################
+    def build_index(self,category):
+        """
+        Groups the row positions of the data by the values in a column, so filter_data on that column
+        takes the matching rows directly instead of comparing every row.
+        The index is dropped as soon as the data changes. Derived datasets share it
+        :param category: Column to index (Example: 'COUNTY')
+        :return:
+        """
+        self.__flush()
+        if self.__data is None: return
+        self.__index=GroupIndex(self.__data,category)
+
+    ##################################################################################################
+    def set_lazy(self,lazy:bool=True):
+        """
+        In lazy mode the data operations (filter_data, drop_data, drop_duplicates, sort_data...) are only recorded.
+        The plan runs, optimized, when the data is needed (get_data, set_features, derive...),
+        when execute() is called or when lazy mode is turned off
+        :param lazy: True to start recording, False to run the plan and go back to running operations directly
+        :return:
+        """
+        if not lazy:
+            self.__flush()
+        self.__lazy=lazy
+
+    ##################################################################################################
+    def explain(self)->str:
+        """
+        :return: The optimized plan of the operations waiting to run, one line per pass over the data
+        """
+        return self.__plan.explain()
+
+    ##################################################################################################
+    def execute(self):
+        """
+        Runs the operations waiting in the plan. Row filters and column drops are moved ahead of the steps
+        that don't need the rows and columns they remove, and neighbouring drops, filters and NaN drops
+        run as one pass each (See DataPlan)
+        :return: The dataset data
+        """
+        plan,self.__plan=self.__plan,DataPlan()
+        lazy,self.__lazy=self.__lazy,False
+        try:
+            for step in plan.optimize():
+                self.__run_step(step)
+        finally:
+            self.__lazy=lazy
+        return self.__data
+
     ##################################################################################################
     def get_data(self):
         """
         :return: The dataset data
         """
+        self.__flush()
         return self.__data
     ##################################################################################################
+    def get_filename(self):
+        return self.__data_filename
+    ##################################################################################################
+    def get_history(self):
+        """
+        :return: List of the operations applied to the data since it was imported, with their arguments
+        """
+        self.__flush()
+        return list(self.__history)
+    ##################################################################################################
     def get_labels(self):
         return self.__labels
     ##################################################################################################
@@ -63,12 +166,39 @@ class DataSet:
         return self.__features
     ##################################################################################################
     def get_probability_dist(self):
-        return self.__probability_dist
+        """
+        :return: Nested list [[<Julian day>,<Sum of probabilities>, <Count of probabilities>]] sorted by day
+        """
+        if self.__accumulator is None: return []
+        return self.__accumulator.to_list()
+    ##################################################################################################
+    def get_accumulator(self,classes):
+        """
+        Accumulator the model adds its probabilities to. Holds a copy of the distribution saved so far,
+        so a run that stops early leaves the dataset unchanged
+        :param classes: The model's classes_ (Julian days)
+        :return: ProbabilityAccumulator indexed like classes
+        """
+        current=self.__accumulator
+        if current is not None and np.array_equal(current.classes,classes):
+            return current.copy()
+        return ProbabilityAccumulator(classes,self.get_probability_dist())
+    ##################################################################################################
+    def set_accumulator(self,accumulator):
+        """
+        Saves a finished accumulator as the probability distribution and rebuilds the graph once
+        :param accumulator: ProbabilityAccumulator
+        :return:
+        """
+        self.__accumulator=accumulator
+        self.__update_graph()
     ##################################################################################################
     def set_features(self,categories:list):
+        self.__flush()
         self.__features=self.__data[categories]
     ##################################################################################################
     def set_labels(self,category:str):
+        self.__flush()
         self.__labels=self.__data[category]
     ##################################################################################################
     def set_scale(self,size:float=1):
@@ -92,15 +222,8 @@ class DataSet:
         :param new_dist: New distribution
         :return:
         """
-        self.__probability_dist=new_dist
-        graph_probs = []
-        graph_names = []
-        for condition, prob, count in new_dist:
-            adjusted_prob = prob / count * self.__scale
-            graph_probs.append(adjusted_prob)
-            graph_names.append(condition)
-        self.graph.x_values=graph_names
-        self.graph.y_values=graph_probs
+        days=sorted(day for day,prob,count in new_dist)
+        self.set_accumulator(ProbabilityAccumulator(days,new_dist))
 
     ##################################################################################################
 
@@ -113,27 +236,112 @@ class DataSet:
         self.name=name
         self.graph.name=name
     ##################################################################################################
-    def import_data(self, filename):
+    def import_data(self, filename, use_cache:bool=False, schema:dict=None):
         """
         Import datasheet and process
         :param filename: File location
+        :param use_cache: Load from a columnar binary copy of the file, made on first load
+            (Text columns are loaded as categories)
+        :param schema: Columns to load and their dtypes {column: dtype}, all other columns are skipped.
+            A dtype of None lets pandas decide. Example: {'COUNTY':'category','TAVG':'float32','DATE':None}
         :return:
         """
         self.__data_filename = filename
+        self.__plan=DataPlan()
+        read_options=self.__read_options(schema)
         try:
-            self.__data = pd.read_csv(filename,low_memory=False)
+            if use_cache:
+                self.__data = ColumnarCache(filename).read_csv(**read_options)
+            else:
+                self.__data = pd.read_csv(filename,**read_options)
             self.__filled_nan=False
             self.__fill_nan_value=None
             self.__dropped_nan=False
+            self.__history=[]
+            if schema is not None:
+                self.__record("import_data",schema)
         except Exception as err:
             self.__handle_error(err, f"Could not import {filename}", "import_data")
     ##################################################################################################
+    def import_stream(self,filename,chunksize:int=100000,schema:dict=None,use_cache:bool=True):
+        """
+        Import a datasheet too large to load whole. The file is read chunksize rows at a time and the operations
+        waiting in the lazy plan that work row by row (filters, column drops, date conversion, NaN handling)
+        are done to each chunk before its rows are kept. The rest of the plan (From the first drop_duplicates or
+        sort_data on) stays in the plan and runs on the kept rows.
+        Memory use depends on the chunk size and the rows kept, not on the size of the file
+        Example:
+            d=DataSet("Everything")
+            d.set_lazy()
+            d.filter_data('COUNTY','KING')
+            d.convert_dates_to_julian('DATE')
+            d.import_stream(filename,schema=schema)
+        :param filename: File location
+        :param chunksize: Rows read at a time
+        :param schema: Columns to load and their dtypes (See import_data)
+        :param use_cache: Write the kept rows to a columnar cache chunk by chunk and memory-map the result.
+            Reused while the file, schema and row by row operations stay the same
+        :return:
+        """
+        self.__data_filename=filename
+        read_options=self.__read_options(schema)
+        row_steps,rest=self.__plan.split_row_steps()
+        try:
+            #No rows, only used to record the row by row operations:
+            header=self.__process_chunk(pd.read_csv(filename,nrows=0,**read_options),row_steps)
+
+            cache=ColumnarCache(filename,ColumnarCache.default_directory(filename)+".stream") if use_cache else None
+            cache_key={"steps":row_steps,"chunk_read":read_options}
+            data=cache.load(**cache_key) if cache is not None else None
+            if data is not None:
+                self.__show_message(f"Loaded {filename} from cache")
+            elif cache is not None:
+                writer=cache.writer(**cache_key)
+                try:
+                    for chunk in self.__read_chunks(filename,chunksize,read_options,row_steps):
+                        writer.append(chunk)
+                    writer.finish()
+                    data=cache.load(**cache_key)
+                except ValueError as err:
+                    #Chunks the cache cannot hold (A text value in a numeric column), kept in memory instead:
+                    writer.abort()
+                    self.__handle_error(err,f"Could not cache {filename}, reading it without the cache","import_stream")
+            if data is None:
+                chunks=list(self.__read_chunks(filename,chunksize,read_options,row_steps))
+                data=_concat_chunks(chunks) if chunks else header.__data
+
+            self.__data=data
+            self.__filled_nan=header.__filled_nan
+            self.__fill_nan_value=header.__fill_nan_value
+            self.__dropped_nan=header.__dropped_nan
+            self.__history=[]
+            if schema is not None:
+                self.__record("import_data",schema)
+            self.__history+=header.__history
+            self.__plan=rest
+        except Exception as err:
+            self.__handle_error(err, f"Could not import {filename}", "import_stream")
+    ##################################################################################################
+    def iter_chunks(self,filename,chunksize:int=100000,schema:dict=None):
+        """
+        Reads a datasheet chunksize rows at a time, for consumers that process the data as it arrives.
+        The row by row operations waiting in the lazy plan are done to each chunk (See import_stream),
+        the plan and the dataset's own data are not changed
+        :param filename: File location
+        :param chunksize: Rows read at a time
+        :param schema: Columns to load and their dtypes (See import_data)
+        :return: Generator of DataFrames
+        """
+        row_steps,rest=self.__plan.split_row_steps()
+        return self.__read_chunks(filename,chunksize,self.__read_options(schema),row_steps)
+    ##################################################################################################
     def get_dictionary_from_data(self,index_key):
         """
         Creates a dictionary from imported data
         :param index_key: Category that acts as the main dictionary key
         :return: Dictionary
         """
+        self.__flush()
         return self.__data.set_index(index_key).to_dict(orient='index')
     ##################################################################################################
     def filter_data(self,category,value):
@@ -141,26 +349,58 @@ class DataSet:
         Filters the data to those that match criteria
         :param category: column to search
         :param value: value to search for
-        :return: filtered list
+        :return: filtered list (None in lazy mode)
         """
-        data=self.__data[self.__data[category]==value]
+        if self.__defer("filter_data",category=category,value=value): return
+        index=self.__get_index(category)
+        if index is not None:
+            data=index.take(self.__data,value)
+        else:
+            data=self.__data[self.__data[category]==value]
         self.__data=data
+        self.__record("filter_data",category,value)
         return data
     ##################################################################################################
-    def drop_duplicates(self,criteria_list:list=None,sort_list:list=None):
+    def filter_range(self,category,low=None,high=None):
+        """
+        Filters the data to rows whose value lies within low and high (inclusive)
+        Example: filter_range('YEAR',2024) keeps the rows of a newly appended year
+        :param category: column to search
+        :param low: Smallest value kept (None for no minimum)
+        :param high: Largest value kept (None for no maximum)
+        :return: filtered list (None in lazy mode)
+        """
+        if self.__defer("filter_range",category=category,low=low,high=high): return
+        self.__data=self.__data[self.__range_mask(category,low,high)]
+        self.__record("filter_range",category,low,high)
+        return self.__data
+    ##################################################################################################
+    def drop_duplicates(self,criteria_list:list=None,sort_list:list=None,strategy:str="sort"):
         """
         Drop data that have duplicates in all fields in the criteria list. If no list specified, will match all items
         :param criteria_list: Each field to check for an exact match before discarding data
         :param sort_list: Ensures that items in the sorted list that contain data are favored over those that are empty or NaN
+        :param strategy: "sort" - sort by sort_list and keep the first row of each duplicate group
+                         "first_valid" - one record per group made of the first value in each column that is not NaN,
+                                         found with a single groupby instead of sorting (sort_list is not used).
+                                         Groups keep the order they first appear in and the index is renumbered
         :return:
         """
+        if self.__defer("drop_duplicates",criteria_list=criteria_list,sort_list=sort_list,strategy=strategy): return
         if criteria_list is None:
-            self.__data.drop_duplicates()
-        else:
+            self.__data=self.__data.drop_duplicates()
+        elif strategy=="sort":
             by_list=sort_list if sort_list is not None else criteria_list
             sorted_data=self.sort_data(by_list)
             self.__data = sorted_data.drop_duplicates(subset=criteria_list,keep='first')
+        elif strategy=="first_valid":
+            columns=self.__data.columns
+            grouped=self.__data.groupby(criteria_list,sort=False,dropna=False,observed=True).first()
+            self.__data=grouped.reset_index()[columns]
+        else:
+            raise ValueError(f"Unknown strategy: {strategy}")
 
+        self.__record("drop_duplicates",criteria_list,sort_list,strategy)
         self.__show_message("Duplicate rows dropped")
     ##################################################################################################
     def drop_data(self, category: str):
@@ -169,9 +409,14 @@ class DataSet:
         :param category: Column to discard
         :return:
         """
+        if self.__defer("drop_data",category=category): return
         if self.__data is not None:
+            if category not in self.__data.columns:
+                #Nothing to drop (Column was left out at import, for example by the schema)
+                return
             try:
                 self.__data = self.__data.drop(columns=category)
+                self.__record("drop_data",category)
                 self.__show_message(f"{category} column dropped.")
             except Exception as err:
                 self.__handle_error(err, f"Could not drop data category {category}", "drop_data")
@@ -183,18 +428,55 @@ class DataSet:
         :return:
         """
         if sort_criteria is None: return
-        self.__data= self.__data.sort_values(by=sort_criteria, na_position='last')
+        if self.__defer("sort_data",sort_criteria=sort_criteria): return
+        #Stable, so the row order does not depend on the dtypes the data was loaded with:
+        self.__data= self.__data.sort_values(by=sort_criteria, na_position='last', kind='stable')
+        self.__record("sort_data",sort_criteria)
         return self.__data
     ##################################################################################################
-    def convert_dates_to_julian(self,date_col):
+    def convert_dates_to_julian(self,date_col,date_format:str=None,keep_datetime:bool=False,use_cache:bool=False):
         """
         Converts dates to julian days
+        Each distinct date is parsed once (The categories of a categorical column, otherwise the unique values)
         :param date_col: Specifies which column contains the dates to be converted
+        :param date_format: Format of the dates, for example "%Y-%m-%d". Detected once from the first date if None
+        :param keep_datetime: Also keep the parsed dates in a new column '<date_col>_t'
+        :param use_cache: Reuse the parsed dates saved with the columnar cache of the data file (Saved on first use)
         :return:
         """
-        #Adds a new column 'DATE_t', stores the date time there, then replaces original date column with Julian day:
-        self.__data[f"{date_col}_t"]=pd.to_datetime(self.__data[date_col])
-        self.__data[date_col]=self.__data[f"{date_col}_t"].dt.dayofyear
+        if self.__defer("convert_dates_to_julian",date_col=date_col,date_format=date_format,
+                        keep_datetime=keep_datetime,use_cache=use_cache): return
+        column=self.__data[date_col]
+        if isinstance(column.dtype,pd.CategoricalDtype):
+            codes,uniques=column.cat.codes.to_numpy(),column.cat.categories
+        else:
+            codes,uniques=pd.factorize(column)
+
+        if date_format is None and len(uniques)>0:
+            date_format=guess_datetime_format(str(uniques[0]))
+        #Saved dates are only reused when they were parsed with the same format:
+        cache=ColumnarCache(self.__data_filename) if use_cache and self.__data_filename else None
+        lookup_options={"date_format":date_format}
+        parsed=cache.load_lookup(f"{date_col}_dates",uniques,**lookup_options) if cache is not None else None
+        if parsed is None:
+            parsed=pd.to_datetime(uniques,format=date_format).to_numpy(dtype="datetime64[ns]")
+            if cache is not None:
+                cache.save_lookup(f"{date_col}_dates",uniques,parsed,**lookup_options)
+        parsed=pd.DatetimeIndex(parsed)
+
+        #Replaces original date column with Julian day (Optionally keeps the dates in '<date_col>_t'):
+        #(Missing dates have code -1, which picks the extra value at the end)
+        missing=codes<0
+        days=parsed.dayofyear.to_numpy()
+        days=np.concatenate((days,np.zeros(1,days.dtype)))[codes]
+        if missing.any() or parsed.hasnans:
+            days=days.astype(float)
+            days[missing]=np.nan
+        columns={date_col:pd.Series(days,index=self.__data.index)}
+        if keep_datetime:
+            columns[f"{date_col}_t"]=pd.Series(parsed.take(codes,allow_fill=True,fill_value=pd.NaT),index=self.__data.index)
+        self.__set_columns(columns)
+        self.__record("convert_dates_to_julian",date_col,date_format)
         return self.__data
 
     ##################################################################################################
@@ -204,9 +486,11 @@ class DataSet:
         :param replacement: Value to replace NaN
         :return:
         """
+        if self.__defer("fill_nan_values",replacement=replacement): return
         self.__filled_nan=True
         self.__fill_nan_value=replacement
-        self.__data.fillna(replacement,inplace=True)
+        self.__data=self.__data.fillna(replacement)
+        self.__record("fill_nan_values",replacement)
 
     ##################################################################################################
     def drop_nan_values(self,categories:list=None):
@@ -215,39 +499,76 @@ class DataSet:
         :param categories: Columns to search for NaN values
         :return:
         """
+        if self.__defer("drop_nan_values",categories=categories): return
         if categories is None or categories == []:
-            self.__data.dropna(inplace=True)
+            self.__data=self.__data.dropna()
         else:
-            self.__data.dropna(subset=categories,inplace=True)
+            self.__data=self.__data.dropna(subset=categories)
 
         self.__dropped_nan=True
+        self.__record("drop_nan_values",categories)
     ##################################################################################################
-    def replace_nan_using_avg(self,nan_category,categories:list):
+    def replace_nan_using_avg(self,nan_category,categories:list,strategy:str="mean",weights:list=None):
         """
         Search a column for NaN values and use the average from other columns to fill missing value
+        Only the rows where nan_category is NaN are computed, column by column
+        Rows where none of the columns has a value stay NaN. Float columns keep their dtype, others become float64
         :param nan_category: Column to search for NaN values
         :param categories: Columns used to form an average for nan_category
+        :param strategy: "mean" - average of the columns that have a value
+                         "weighted" - weighted average of the columns that have a value (Uses weights)
+                         "first" - value of the first column in categories that has one
+        :param weights: One weight per column in categories (Only used by "weighted")
         :return:
         """
-        self.__data[nan_category] = self.__data.apply(
-            lambda row: row[categories].mean(skipna=True)
-            if pd.isna(row[nan_category]) else row[nan_category], axis=1
-        )
+        if self.__defer("replace_nan_using_avg",nan_category=nan_category,categories=categories,
+                        strategy=strategy,weights=weights): return
+        missing=self.__data[nan_category].isna().to_numpy()
+        if missing.any():
+            sources=self.__data.loc[missing,categories]
+            if strategy=="mean":
+                values=sources.mean(axis=1,skipna=True)
+            elif strategy=="weighted":
+                if weights is None or len(weights)!=len(categories):
+                    raise ValueError("weighted strategy needs one weight per column")
+                weights=np.asarray(weights,dtype=float)
+                available=sources.notna().to_numpy()
+                total_weight=(available*weights).sum(axis=1)
+                with np.errstate(invalid="ignore",divide="ignore"):
+                    values=(sources.fillna(0).to_numpy()*weights).sum(axis=1)/total_weight
+            elif strategy=="first":
+                values=sources.bfill(axis=1).iloc[:,0]
+            else:
+                raise ValueError(f"Unknown strategy: {strategy}")
+
+            #Float columns keep their dtype (Float32 stays nullable), other columns become float64:
+            column=self.__data[nan_category]
+            dtype=column.dtype if getattr(column.dtype,"kind","O")=="f" else np.dtype(float)
+            replacement=np.full(len(column),np.nan)
+            replacement[missing]=np.asarray(values,dtype=float)
+            replacement=pd.Series(replacement,index=column.index).astype(dtype)
+            self.__set_columns({nan_category:column.astype(dtype).where(~missing,replacement)})
+
+        self.__record("replace_nan_using_avg",nan_category,categories,strategy,weights)
     ##################################################################################################
     def sort_probability_dist(self):
         """
         Sort the probability distribution so that it plots properly on the chart
+        (The distribution is always kept sorted by day, this only redraws the graph)
         :return:
         """
-        self.__probability_dist.sort(key=lambda item: item[0])
-        graph_probs = []
-        graph_names = []
-        for condition, prob, count in self.__probability_dist:
-            adjusted_prob = prob / count * self.__scale
-            graph_probs.append(adjusted_prob)
-            graph_names.append(condition)
-        self.graph.x_values = graph_names
-        self.graph.y_values = graph_probs
+        self.__update_graph()
+    ##################################################################################################
+    def __update_graph(self):
+        """
+        Rebuild the graph values from the probability distribution
+        :return:
+        """
+        graph_names,graph_probs=[],[]
+        if self.__accumulator is not None:
+            graph_names,graph_probs=self.__accumulator.get_averages(self.__scale)
+        self.graph.x_values=graph_names
+        self.graph.y_values=graph_probs
     ##################################################################################################
     def gaussify(self,sigma=2):
         """
@@ -260,6 +581,137 @@ class DataSet:
         self.graph.y_values=gaussian_filter1d(self.graph.y_values,sigma=sigma)
 
     ##################################################################################################
+    def __set_columns(self,columns:dict):
+        """
+        Adds or replaces columns without writing into the current frame, which derived datasets may share.
+        Only the column references are copied, not the data
+        :param columns: {name: values}
+        :return:
+        """
+        data=self.__data.copy(deep=False)
+        for name,values in columns.items():
+            data[name]=values
+        self.__data=data
+    ##################################################################################################
+    def __defer(self,operation:str,**arguments)->bool:
+        """
+        Adds the operation to the plan when in lazy mode
+        :param operation: Method name
+        :param arguments: Arguments of the call
+        :return: True if the operation was deferred and the method should return
+        """
+        if not self.__lazy: return False
+        self.__plan.add(operation,arguments)
+        return True
+    ##################################################################################################
+    def __flush(self):
+        """
+        Runs the plan if operations are waiting (The data is about to be used)
+        :return:
+        """
+        if not self.__plan.is_empty():
+            self.execute()
+    ##################################################################################################
+    def __run_step(self,step:list):
+        """
+        Runs one step of an optimized plan. A step of several operations is done in one pass over the data,
+        each operation is still recorded in the history
+        :param step: List of (method name, arguments), see DataPlan.optimize
+        :return:
+        """
+        name=step[0][0]
+        if len(step)==1:
+            getattr(self,name)(**step[0][1])
+        elif name=="drop_data":
+            columns=[]
+            for operation,arguments in step:
+                if arguments["category"] in self.__data.columns and arguments["category"] not in columns:
+                    columns.append(arguments["category"])
+                    self.__record(operation,arguments["category"])
+            self.__data=self.__data.drop(columns=columns)
+            self.__show_message(f"{', '.join(columns)} columns dropped.")
+        elif name=="drop_nan_values":
+            subsets=[arguments["categories"] for operation,arguments in step]
+            if any(not subset for subset in subsets):
+                self.__data=self.__data.dropna()
+            else:
+                self.__data=self.__data.dropna(subset=list(dict.fromkeys(c for subset in subsets for c in subset)))
+            self.__dropped_nan=True
+            for subset in subsets:
+                self.__record("drop_nan_values",subset)
+        else:
+            #Filters: the first one can use the group index, the others are combined into one mask
+            getattr(self,name)(**step[0][1])
+            keep=np.ones(len(self.__data),dtype=bool)
+            for operation,arguments in step[1:]:
+                if operation=="filter_data":
+                    keep&=(self.__data[arguments["category"]]==arguments["value"]).to_numpy()
+                    self.__record(operation,arguments["category"],arguments["value"])
+                else:
+                    keep&=self.__range_mask(**arguments).to_numpy()
+                    self.__record(operation,arguments["category"],arguments["low"],arguments["high"])
+            self.__data=self.__data[keep]
+    ##################################################################################################
+    def __read_options(self,schema:dict=None)->dict:
+        """
+        :param schema: Columns to load and their dtypes (See import_data)
+        :return: Options for pandas.read_csv
+        """
+        read_options={"low_memory":False}
+        if schema is not None:
+            read_options["usecols"]=list(schema)
+            read_options["dtype"]={column:dtype for column,dtype in schema.items() if dtype is not None}
+        return read_options
+    ##################################################################################################
+    def __read_chunks(self,filename,chunksize:int,read_options:dict,row_steps:list):
+        """
+        :return: Generator of the file's chunks with the row by row steps done
+        """
+        with pd.read_csv(filename,chunksize=chunksize,**read_options) as reader:
+            for chunk in reader:
+                yield self.__process_chunk(chunk,row_steps).__data
+    ##################################################################################################
+    def __process_chunk(self,chunk:pd.DataFrame,row_steps:list):
+        """
+        :param chunk: Rows read from the file
+        :param row_steps: Steps of an optimized plan that work row by row
+        :return: Dataset holding the chunk after the steps
+        """
+        chunk_set=DataSet(self.name)
+        chunk_set.__data_filename=self.__data_filename
+        chunk_set.__data=chunk
+        for step in row_steps:
+            chunk_set.__run_step(step)
+        return chunk_set
+    ##################################################################################################
+    def __range_mask(self,category,low=None,high=None):
+        """
+        :return: Boolean Series, True where the column is within low and high (inclusive)
+        """
+        keep=self.__data[category].notna()
+        if low is not None: keep&=self.__data[category]>=low
+        if high is not None: keep&=self.__data[category]<=high
+        return keep
+    ##################################################################################################
+    def __get_index(self,category):
+        """
+        :param category: Column the index should be on
+        :return: GroupIndex or None if there is no index for the column on the current data
+        """
+        index=self.__index
+        if index is None or index.category!=category or not index.is_built_on(self.__data):
+            return None
+        return index
+    ##################################################################################################
+    def __record(self,operation:str,*args):
+        """
+        Adds an operation to the history of the data
+        :param operation: Method name
+        :param args: Arguments passed to the method
+        :return:
+        """
+        self.__history.append([operation,*args])
+    ##################################################################################################
     def __handle_error(self, err, msg: str = None, entry: str = None):
         print(f"Error{(' in ' + entry) if not None else ''}:\n"
               f"\t{msg}\n\t{err}")
@@ -280,6 +732,434 @@ class Range:
         self.high=high
         self.step=step
 
+    def get_values(self):
+        """
+        Values visited when the range is walked by the model.
+        The value is incremented before use and the walk stops once it reaches high,
+        so the sequence matches the point by point loop exactly (including floating point drift)
+        :return: 1-D numpy array of values
+        """
+        if self.step<=0:
+            raise ValueError(f"Range step must be positive, got {self.step}")
+        values=[]
+        i=self.low
+        while i < self.high:
+            i+=self.step
+            values.append(i)
+        return np.array(values,dtype=float)
+
+#------------------------ProbabilityAccumulator----------------------------------------
+class ProbabilityAccumulator:
+    """
+    Running sum and count of the probabilities given to each class of a model.
+    Sums and counts are dense arrays indexed by the position of the day in the model's classes_
+    """
+    def __init__(self,classes,prior_dist:list=None):
+        """
+        :param classes: The model's classes_ (Julian days)
+        :param prior_dist: Distribution to continue from [[<Julian day>,<Sum of probabilities>, <Count of probabilities>]]
+        """
+        self.classes=np.asarray(classes)
+        self.sums=np.zeros(len(self.classes))  #Sum of probabilities for each class
+        self.counts=np.zeros(len(self.classes),dtype=np.int64)    #Count of probabilities for each class
+        self.__passed=np.zeros(len(self.classes),dtype=bool)   #Reused by add so it doesn't allocate
+        self.__other_days=[]    #Days from the prior distribution that are not in classes
+
+        if prior_dist:
+            positions={day:i for i,day in enumerate(self.classes)}
+            for day,prob,count in prior_dist:
+                if day in positions:
+                    self.sums[positions[day]]+=prob
+                    self.counts[positions[day]]+=count
+                else:
+                    self.__other_days.append([day,prob,count])
+
+    def copy(self):
+        """
+        :return: Independent ProbabilityAccumulator with the same contents
+        """
+        duplicate=ProbabilityAccumulator(self.classes)
+        duplicate.add_totals(self.sums,self.counts)
+        duplicate.__other_days=[list(item) for item in self.__other_days]
+        return duplicate
+
+    def add(self,probabilities,threshold=0):
+        """
+        Add the probabilities of a single point
+        :param probabilities: 1-D array with one probability per class
+        :param threshold: Probabilities below this are ignored
+        :return:
+        """
+        np.greater_equal(probabilities,threshold,out=self.__passed)
+        np.add(self.sums,probabilities,out=self.sums,where=self.__passed)
+        np.add(self.counts,1,out=self.counts,where=self.__passed)
+
+    def add_block(self,probabilities,threshold=0):
+        """
+        Add the probabilities of many points
+        :param probabilities: 2-D array with one row per point and one column per class
+        :param threshold: Probabilities below this are ignored
+        :return:
+        """
+        self.add_totals(*ProbabilityAccumulator.block_totals(probabilities,threshold))
+
+    def add_totals(self,sums,counts):
+        """
+        Add partial results computed elsewhere (for example by block_totals in another process).
+        Adding the same partials in the same order always gives the same result
+        :param sums: Sum of probabilities for each class
+        :param counts: Count of probabilities for each class
+        :return:
+        """
+        self.sums+=sums
+        self.counts+=counts
+
+    @staticmethod
+    def block_totals(probabilities,threshold=0):
+        """
+        Partial sums and counts of a block of points, without adding them to an accumulator
+        :param probabilities: 2-D array with one row per point and one column per class
+        :param threshold: Probabilities below this are ignored
+        :return: (sums, counts)
+        """
+        passed=probabilities>=threshold
+        return np.where(passed,probabilities,0.0).sum(axis=0),passed.sum(axis=0)
+
+    def to_list(self):
+        """
+        :return: Nested list [[<Julian day>,<Sum of probabilities>, <Count of probabilities>]] sorted by day.
+            Days that never passed the threshold are left out
+        """
+        found=[[self.classes[i],self.sums[i],int(self.counts[i])] for i in np.flatnonzero(self.counts)]
+        return sorted(self.__other_days+found,key=lambda item: item[0])
+
+    def get_averages(self,scale:float=1):
+        """
+        Average probability for each day, ready for charting
+        :param scale: Multiplier applied to each average
+        :return: (list of days, list of averages)
+        """
+        days,averages=[],[]
+        for day,prob,count in self.to_list():
+            days.append(day)
+            averages.append(prob/count*scale)
+        return days,averages
+
+#------------------------ClassStatistics----------------------------------------
+class ClassStatistics:
+    """
+    Count, mean and sum of squared deviations (M2) of every feature for each class, built up a chunk at a time.
+    Two sets of statistics merge exactly (Chan et al. parallel variance), so chunks can be added in any
+    order or on different workers. The variances equal those of the whole data without ever holding it
+    """
+    def __init__(self,n_features:int):
+        self.classes=np.array([])   #Sorted labels seen so far
+        self.counts=np.zeros(0) #Rows seen for each class
+        self.means=np.zeros((0,n_features)) #Mean of each feature for each class
+        self.m2=np.zeros((0,n_features))    #Sum of squared deviations from the mean for each class
+
+    def add(self,features,labels):
+        """
+        Adds a chunk of rows
+        :param features: 2-D array, one row per sample
+        :param labels: 1-D array, one label per row
+        :return:
+        Raises ValueError if a feature or label is NaN or infinite (It would spoil its class for good)
+        """
+        features=np.asarray(features,dtype=float)
+        labels=np.asarray(labels)
+        if len(labels)==0: return
+        if not np.isfinite(features).all():
+            raise ValueError("Features must not be NaN or infinite")
+        if labels.dtype.kind=="f" and not np.isfinite(labels).all():
+            raise ValueError("Labels must not be NaN or infinite")
+        classes,rows=np.unique(labels,return_inverse=True)
+        counts=np.bincount(rows,minlength=len(classes)).astype(float)
+        sums=np.zeros((len(classes),features.shape[1]))
+        np.add.at(sums,rows,features)
+        means=sums/counts[:,None]
+        m2=np.zeros_like(sums)
+        np.add.at(m2,rows,(features-means[rows])**2)
+        self.__merge(classes,counts,means,m2)
+
+    def merge(self,other):
+        """
+        Adds the statistics of another set of rows (For example from another worker)
+        :param other: ClassStatistics with the same features
+        :return:
+        """
+        self.__merge(other.classes,other.counts,other.means,other.m2)
+
+    def variances(self):
+        """
+        :return: Variance of each feature for each class (Population variance like numpy.var)
+        """
+        return self.m2/self.counts[:,None]
+
+    def total_variance(self):
+        """
+        :return: Variance of each feature over all the rows, regardless of class
+        """
+        total=self.counts.sum()
+        mean=(self.means*self.counts[:,None]).sum(axis=0)/total
+        m2=self.m2.sum(axis=0)+(self.counts[:,None]*(self.means-mean)**2).sum(axis=0)
+        return m2/total
+
+    def __merge(self,classes,counts,means,m2):
+        if len(self.classes)==0:
+            self.classes=np.asarray(classes)[:0]    #Keep the label dtype
+        all_classes=np.union1d(self.classes,classes)
+        if len(all_classes)!=len(self.classes):
+            #Make room for new classes:
+            old=np.searchsorted(all_classes,self.classes)
+            n_features=means.shape[1]
+            expanded=[np.zeros(len(all_classes)),np.zeros((len(all_classes),n_features)),
+                      np.zeros((len(all_classes),n_features))]
+            expanded[0][old],expanded[1][old],expanded[2][old]=self.counts,self.means,self.m2
+            self.classes=all_classes
+            self.counts,self.means,self.m2=expanded
+
+        i=np.searchsorted(self.classes,classes)
+        count_a,count_b=self.counts[i][:,None],counts[:,None]
+        total=count_a+count_b
+        delta=means-self.means[i]
+        self.means[i]+=delta*count_b/total
+        self.m2[i]+=m2+delta**2*count_a*count_b/total
+        self.counts[i]+=counts
+
+#------------------------PredictionGrid----------------------------------------
+class PredictionGrid:
+    """
+    Cartesian product of a list of Range objects, one range per feature.
+    Points are ordered like nested loops with the first range outermost.
+    The grid is never built whole, rows are materialized in blocks on request
+    """
+    def __init__(self,ranges:list=None,axes:list=None):
+        """
+        :param ranges: One Range object per feature
+        :param axes: Or the values of each feature directly (1-D arrays)
+        """
+        if axes is None:
+            axes=[r.get_values() for r in ranges]
+        self.axes=[np.asarray(axis,dtype=float) for axis in axes]    #Values for each feature
+        self.shape=tuple(len(axis) for axis in self.axes)   #Number of values for each feature
+        self.size=int(np.prod(self.shape)) if len(self.axes)>0 else 0  #Total number of points
+
+    def block(self,start:int,stop:int):
+        """
+        Materialize a slice of the grid
+        :param start: Index of the first point
+        :param stop: Index after the last point
+        :return: 2-D array with one row per point and one column per feature
+        """
+        indices=np.unravel_index(np.arange(start,stop),self.shape)
+        return np.column_stack([axis[index] for axis,index in zip(self.axes,indices)])
+
+    def blocks(self,block_size:int):
+        """
+        Walk the whole grid in blocks
+        :param block_size: Maximum number of points in each block
+        :return: Generator of (start index, 2-D array)
+        """
+        for start in range(0,self.size,block_size):
+            yield start,self.block(start,min(start+block_size,self.size))
+
+##################################################################################################
+def _concat_chunks(chunks:list)->pd.DataFrame:
+    """
+    Joins chunks read separately. Categorical columns get the union of the chunks' categories
+    :param chunks: DataFrames with the same columns
+    :return: DataFrame
+    """
+    data=pd.concat(chunks,ignore_index=True)
+    for name in chunks[0].columns:
+        if isinstance(chunks[0][name].dtype,pd.CategoricalDtype):
+            data[name]=pd.api.types.union_categoricals([chunk[name] for chunk in chunks])
+    return data
+
+#------------------------DataPlan----------------------------------------
+class DataPlan:
+    """
+    Operations recorded by a DataSet in lazy mode, in the order they were called.
+    optimize() moves row filters and column drops as early as they can go without changing the result,
+    then groups neighbouring drops, filters and NaN drops so each group is done in one pass
+    """
+    FILTERS=("filter_data","filter_range")
+    FUSED=FILTERS+("drop_data","drop_nan_values")   #Operations that can share a pass with their neighbours
+    ROW_BY_ROW=FUSED+("convert_dates_to_julian","fill_nan_values","replace_nan_using_avg")  #Can be done chunk by chunk
+
+    def __init__(self):
+        self.operations=[]  #[(method name, {argument: value})]
+
+    def add(self,operation:str,arguments:dict):
+        self.operations.append((operation,arguments))
+
+    def is_empty(self)->bool:
+        return len(self.operations)==0
+
+    def split_row_steps(self):
+        """
+        Splits the optimized plan where it first needs all the rows at once (drop_duplicates, sort_data)
+        :return: (List of leading steps that work row by row, DataPlan of the remaining operations)
+        """
+        steps=self.optimize()
+        count=0
+        while count<len(steps) and steps[count][0][0] in self.ROW_BY_ROW:
+            count+=1
+        rest=DataPlan()
+        for step in steps[count:]:
+            for operation,arguments in step:
+                rest.add(operation,arguments)
+        return steps[:count],rest
+
+    def optimize(self)->list:
+        """
+        :return: List of steps, each step a list of (method name, arguments) done in one pass
+        """
+        ordered=[]
+        for operation in self.operations:
+            position=len(ordered)
+            while position>0 and self.__can_move_before(operation,ordered[position-1]):
+                position-=1
+            ordered.insert(position,operation)
+
+        steps=[]
+        for operation in ordered:
+            name=operation[0]
+            previous=steps[-1][0][0] if steps else None
+            if name in self.FUSED and (name==previous or (name in self.FILTERS and previous in self.FILTERS)):
+                steps[-1].append(operation)
+            else:
+                steps.append([operation])
+        return steps
+
+    def explain(self)->str:
+        """
+        :return: Optimized plan as text, one line per pass over the data
+        """
+        if self.is_empty():
+            return "Nothing to run"
+        lines=[]
+        for i,step in enumerate(self.optimize(),1):
+            calls=[f"{name}({', '.join(f'{key}={value!r}' for key,value in arguments.items())})"
+                   for name,arguments in step]
+            lines.append(f"{i}. "+" + ".join(calls))
+        return "\n".join(lines)
+
+    @staticmethod
+    def __can_move_before(operation:tuple,previous:tuple)->bool:
+        """
+        :param operation: Filter or column drop to move earlier
+        :param previous: Operation currently before it
+        :return: True if swapping the two leaves the resulting data unchanged
+        """
+        name,arguments=operation
+        previous_name,previous_arguments=previous
+        if name not in DataPlan.FILTERS and name!="drop_data":
+            return False
+        column=arguments["category"]
+
+        if name in DataPlan.FILTERS:
+            #Rows are removed: fine before anything that treats rows separately or whole groups containing them
+            if previous_name in DataPlan.FILTERS or previous_name=="fill_nan_values":
+                return False
+            if previous_name=="drop_duplicates":
+                criteria=previous_arguments["criteria_list"]
+                return criteria is None or column in criteria
+            if previous_name=="drop_data":
+                return previous_arguments["category"]!=column
+            return column not in DataPlan.__columns_changed(previous)
+
+        #Column drop: fine before anything that doesn't use the column
+        if previous_name=="drop_data":
+            return False
+        if previous_name=="fill_nan_values":
+            return True
+        used=DataPlan.__columns_used(previous)
+        return used is not None and column not in used
+
+    @staticmethod
+    def __columns_used(operation:tuple):
+        """
+        :return: Set of columns the operation reads or writes, None if it depends on every column
+        """
+        name,arguments=operation
+        if name in DataPlan.FILTERS or name=="drop_data":
+            return {arguments["category"]}
+        if name=="sort_data":
+            return set(arguments["sort_criteria"])
+        if name=="convert_dates_to_julian":
+            return DataPlan.__columns_changed(operation)
+        if name=="replace_nan_using_avg":
+            return {arguments["nan_category"],*arguments["categories"]}
+        if name=="drop_nan_values":
+            return set(arguments["categories"]) if arguments["categories"] else None
+        if name=="drop_duplicates":
+            criteria=arguments["criteria_list"]
+            if criteria is None:
+                return None
+            if arguments["strategy"]=="sort":
+                return set(criteria)|set(arguments["sort_list"] or [])
+            return set(criteria)
+        return None
+
+    @staticmethod
+    def __columns_changed(operation:tuple)->set:
+        """
+        :return: Columns whose values the operation replaces or adds
+        """
+        name,arguments=operation
+        if name=="convert_dates_to_julian":
+            return {arguments["date_col"],f"{arguments['date_col']}_t"}
+        if name=="replace_nan_using_avg":
+            return {arguments["nan_category"]}
+        return set()
+
+#------------------------GroupIndex----------------------------------------
+class GroupIndex:
+    """
+    Row positions of a frame grouped by the values of one column.
+    Positions are stably sorted by group, so each group is a slice that keeps the frame's row order.
+    Groups are numbered in order of first appearance, like Series.unique()
+    """
+    def __init__(self,data:pd.DataFrame,category):
+        """
+        :param data: Frame to index
+        :param category: Column to group the rows by
+        """
+        codes,values=pd.factorize(data[category],sort=False)
+        valid=codes>=0
+        self.category=category
+        self.has_missing=not valid.all()    #NaN values are not indexed
+        self.__frame=weakref.ref(data)  #Frame the positions belong to
+        self.__values=list(values)
+        self.__groups={value:i for i,value in enumerate(self.__values)} #value: group number
+        self.__positions=np.flatnonzero(valid)[np.argsort(codes[valid],kind="stable")]
+        self.__offsets=np.concatenate(([0],np.cumsum(np.bincount(codes[valid],minlength=len(self.__values)))))
+
+    def is_built_on(self,data:pd.DataFrame)->bool:
+        """
+        :return: True if the index belongs to this exact frame
+        """
+        return data is not None and self.__frame() is data
+
+    def get_values(self)->list:
+        """
+        :return: Unique values in order of first appearance
+        """
+        return list(self.__values)
+
+    def take(self,data:pd.DataFrame,value)->pd.DataFrame:
+        """
+        :param data: Frame the index was built on
+        :param value: Value to look for
+        :return: Rows where the column equals value, in their original order
+        """
+        group=self.__groups.get(value)
+        if group is None:
+            return data.iloc[0:0]
+        return data.iloc[self.__positions[self.__offsets[group]:self.__offsets[group+1]]]
+
 #------------------------Graph----------------------------------------
 class Graph:
     """
@@ -0,0 +1,121 @@
+import math
+from src.model.data_session import DataSession
+from src.model.structures import DataSet, Range
+
+
+class WeatherData:
+    """
+    How the weather data is loaded, prepared and split into one dataset per variable.
+    The window, the batch reports and the prediction service all use it, so their models train on the same data
+    """
+    LOCATION='COUNTY'   #Column the data is filtered by
+    #Weather columns that are used and the smallest dtypes that hold them (Other columns are never loaded):
+    DATA_SCHEMA={
+        "YEAR":"Int16",
+        "COUNTY":"category",
+        "DATE":None,
+        "TAVG":"float32",
+        "TMAX":"float32",
+        "TMIN":"float32",
+        "PRCP":"float32",
+        "AWND":"float32",
+        "SNOW":"float32",
+    }
+    #(name, feature, crop columns with the range, step, graph colors):
+    VARIABLES=(
+        ("Temperature","TAVG",("TAVG_MIN","TAVG_MAX"),1,("black","red")),
+        ("Precipitation","PRCP",("PRCP_MIN","PRCP_MAX"),0.01,("black","blue")),
+        ("Wind","AWND",("AWND_MIN","AWND_MAX"),0.01,("black","green")),
+    )
+
+    ##################################################################################################
+    @staticmethod
+    def open_session(datafile:str,cropfile:str)->DataSession:
+        """
+        :param datafile: Weather data CSV
+        :param cropfile: Crop conditions CSV
+        :return: Loaded DataSession holding the prepared weather data
+        """
+        session=DataSession(datafile,cropfile,WeatherData.prepare_data,schema=WeatherData.DATA_SCHEMA)
+        session.refresh()
+        return session
+
+    ##################################################################################################
+    @staticmethod
+    def prepare_data(dataset:DataSet)->DataSet:
+        """
+        Drop unnecessary columns, keep one record per day and county, convert dates to Julian days and sort
+        :param dataset: Imported weather data
+        :return: Prepared dataset, indexed by county
+        """
+        #Record the steps and run them as one optimized plan:
+        dataset.set_lazy()
+
+        #Drop unecessary data and duplicates:
+        dataset.drop_data("SOURCE_FILE")
+        dataset.drop_data("VALUE")
+        dataset.drop_data('COMMODITY')
+        dataset.drop_duplicates()
+        #(One record per day and county made of the first values present, no sort needed)
+        dataset.drop_duplicates(['YEAR','COUNTY','DATE'],strategy="first_valid")
+        dataset.convert_dates_to_julian('DATE',use_cache=True)
+        dataset.sort_data(['YEAR'])
+        dataset.set_lazy(False)
+
+        #Index the counties so each run's location filter is a lookup:
+        dataset.build_index(WeatherData.LOCATION)
+        return dataset
+
+    ##################################################################################################
+    @staticmethod
+    def variable_data(dataset:DataSet,variable:tuple,location:str=None)->DataSet:
+        """
+        Filters a view of the prepared data down to the training data of one variable.
+        Temperature is imputed from TMAX and TMIN where TAVG is blank. Also sets the name and graph colors
+        :param dataset: View of the prepared data (See DataSession.view)
+        :param variable: Entry of VARIABLES
+        :param location: County to keep (None keeps every county)
+        :return: The dataset with its features and labels set (May be empty)
+        """
+        name,feature=variable[:2]
+        #The steps run as an optimized plan when the features are set:
+        dataset.set_lazy()
+        if location:
+            dataset.filter_data(WeatherData.LOCATION,location)
+        if feature=='TAVG':
+            dataset.replace_nan_using_avg('TAVG',['TMAX','TMIN'])
+        dataset.drop_nan_values([feature])
+        dataset.set_features([feature])
+        dataset.set_labels('DATE')
+        dataset.set_name(name)
+        dataset.set_graph_color(*variable[4])
+        return dataset
+
+    ##################################################################################################
+    @staticmethod
+    def crop_range(crop:dict,variable:tuple):
+        """
+        :param crop: Row of the crop file (See DataSession.get_crop_dict)
+        :param variable: Entry of VARIABLES
+        :return: Range of the variable the crop grows in, or None if the crop file leaves it blank
+        """
+        low,high=(crop.get(column) for column in variable[2])
+        try:
+            low,high=float(low),float(high)
+        except (TypeError,ValueError):
+            return None
+        if math.isnan(low) or math.isnan(high):
+            return None
+        return Range(low,high,variable[3])
+
+    ##################################################################################################
+    @staticmethod
+    def get_variable(name:str)->tuple:
+        """
+        :param name: Name of the variable ("Temperature", "Precipitation" or "Wind")
+        :return: Entry of VARIABLES
+        """
+        for variable in WeatherData.VARIABLES:
+            if variable[0]==name:
+                return variable
+        raise ValueError(f"Unknown variable {name}")
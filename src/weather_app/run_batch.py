@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+
+#For compatibility:
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'../..'))
+
+from src.model.batch_report import BatchReport
+from src.model.g_naive_bayes import NaiveBayesModel
+
+DATA_DIR=os.path.join(os.path.dirname(__file__),'..','data')
+
+def main(argv=None):
+    #Computes the distributions of every crop in every county without opening the window:
+    parser=argparse.ArgumentParser(description="Precompute crop weather reports for every county")
+    parser.add_argument("--output",default=os.path.join(DATA_DIR,"reports"),help="Directory the reports are written to")
+    parser.add_argument("--data",default=os.path.join(DATA_DIR,"final_combined_data.csv"),help="Weather data CSV")
+    parser.add_argument("--crops-file",default=os.path.join(DATA_DIR,"crop_conditions_updated.csv"),help="Crop conditions CSV")
+    parser.add_argument("--models",default=os.path.join(DATA_DIR,"models"),help="Directory of saved models ('' always trains)")
+    parser.add_argument("--workers",type=int,default=1,help="Processes running counties at once")
+    parser.add_argument("--mode",default=NaiveBayesModel.MODE_GRID,
+                        choices=[NaiveBayesModel.MODE_TABLE,NaiveBayesModel.MODE_GRID,NaiveBayesModel.MODE_FACTORIZED,
+                                 NaiveBayesModel.MODE_INTEGRATED,NaiveBayesModel.MODE_LEGACY],
+                        help="Prediction mode (The window uses grid, table is faster for wide ranges but approximate)")
+    parser.add_argument("--county",action="append",help="Only run this county (Can be repeated)")
+    parser.add_argument("--crop",action="append",help="Only run this crop (Can be repeated)")
+    parser.add_argument("--plots",action="store_true",help="Also save a PNG chart for each crop of each county")
+    args=parser.parse_args(argv)
+    if args.plots:
+        #Charts are only saved to files, never displayed (Inherited by the worker processes):
+        os.environ["MPLBACKEND"]="Agg"
+
+    report=BatchReport(args.data,args.crops_file,args.output,args.models or None,args.mode,args.workers,args.plots)
+    failed=report.run(args.county,args.crop)
+    return 1 if failed else 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+#For compatibility:
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'../..'))
+
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.prediction_service import PredictionService
+
+DATA_DIR=os.path.join(os.path.dirname(__file__),'..','data')
+
+def main(argv=None):
+    #Answers crop weather queries over HTTP on localhost (See PredictionService):
+    parser=argparse.ArgumentParser(description="Local crop weather prediction service")
+    parser.add_argument("--port",type=int,default=8765,help="Port on 127.0.0.1")
+    parser.add_argument("--data",default=os.path.join(DATA_DIR,"final_combined_data.csv"),help="Weather data CSV")
+    parser.add_argument("--crops-file",default=os.path.join(DATA_DIR,"crop_conditions_updated.csv"),help="Crop conditions CSV")
+    parser.add_argument("--models",default=os.path.join(DATA_DIR,"models"),help="Directory of saved models ('' always trains)")
+    parser.add_argument("--workers",type=int,default=None,help="Threads training and predicting at once")
+    parser.add_argument("--mode",default=NaiveBayesModel.MODE_GRID,
+                        help="Prediction mode (The window uses grid, table is faster for wide ranges but approximate)")
+    args=parser.parse_args(argv)
+
+    service=PredictionService(args.data,args.crops_file,args.models or None,args.mode,args.workers,port=args.port)
+    service.serve_forever()
+
+
+if __name__=="__main__":
+    main()
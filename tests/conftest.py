@@ -0,0 +1,91 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+#Tests import the package the same way the apps do:
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.structures import DataSet, Range
+
+
+def make_weather_frame(counties=("CHELAN","KING"),years=range(2000,2003),seed=0)->pd.DataFrame:
+    """
+    Synthetic weather data laid out like final_combined_data.csv: a seasonal temperature curve,
+    missing TAVG values and duplicated days whose measurements are blank
+    """
+    rng=np.random.default_rng(seed)
+    frames=[]
+    for county in counties:
+        for year in years:
+            dates=pd.date_range(f"{year}-01-01",f"{year}-12-31")
+            day=dates.dayofyear.values
+            base=50+25*np.sin((day-100)/365*2*np.pi)
+            tmax=base+10+rng.normal(0,5,len(day))
+            tmin=base-10+rng.normal(0,5,len(day))
+            frame=pd.DataFrame(dict(
+                SOURCE_FILE="f.csv",VALUE=1.0,COMMODITY="X",YEAR=year,COUNTY=county,
+                DATE=dates.strftime("%Y-%m-%d"),
+                TAVG=np.where(rng.random(len(day))<0.3,np.nan,(tmax+tmin)/2).round(1),
+                TMAX=tmax.round(1),TMIN=tmin.round(1),
+                PRCP=np.abs(rng.normal(0.1,0.2,len(day))).round(2),
+                AWND=np.abs(rng.normal(4,2,len(day))).round(2),
+                SNOW=0.0,
+            ))
+            duplicates=frame.sample(frac=0.2,random_state=year).copy()
+            duplicates["TAVG"]=np.nan
+            duplicates["PRCP"]=np.nan
+            frames+=[frame,duplicates]
+    return pd.concat(frames,ignore_index=True)
+
+
+@pytest.fixture(scope="session")
+def weather_csv(tmp_path_factory):
+    filename=str(tmp_path_factory.mktemp("data")/"weather.csv")
+    make_weather_frame().to_csv(filename,index=False)
+    return filename
+
+
+@pytest.fixture
+def temperature_data(weather_csv):
+    """
+    Prepared TAVG dataset of one county, ready to train on
+    """
+    data=DataSet("Temperature",weather_csv)
+    data.drop_duplicates(['YEAR','COUNTY','DATE'],strategy="first_valid")
+    data.convert_dates_to_julian('DATE')
+    data.filter_data('COUNTY','KING')
+    data.replace_nan_using_avg('TAVG',['TMAX','TMIN'])
+    data.drop_nan_values(['TAVG','PRCP'])
+    data.set_features(['TAVG'])
+    data.set_labels('DATE')
+    return data
+
+
+RANGES=[Range(30,60,1),Range(0,0.5,0.05)]  #Two feature ranges the prediction tests score
+
+
+def predict(model,data,ranges,mode,**options):
+    """
+    :return: (days, sums, counts) of one prediction on a fresh view of data
+    """
+    view=data.derive(data.name)
+    view.input_ranges=ranges
+    view=model.run_prediction(view,mode,**options)
+    distribution=np.array(view.get_probability_dist(),dtype=float).reshape(-1,3)
+    return distribution[:,0],distribution[:,1],distribution[:,2]
+
+
+@pytest.fixture
+def two_feature_data(temperature_data):
+    temperature_data.set_features(['TAVG','PRCP'])
+    return temperature_data
+
+
+@pytest.fixture
+def model(two_feature_data):
+    model=NaiveBayesModel()
+    model.train_model(two_feature_data)
+    return model
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from src.model.data_cache import ColumnarCache
+from src.model.structures import DataSet
+
+
+def is_memory_mapped(values:np.ndarray)->bool:
+    while values is not None:
+        if isinstance(values,np.memmap):
+            return True
+        values=values.base
+    return False
+
+
+def assert_same_frame(found:pd.DataFrame,expected:pd.DataFrame):
+    #(Compared on copies, a memory-mapped column is otherwise reported as a different array class)
+    assert found.dtypes.to_dict()==expected.dtypes.to_dict()
+    pd.testing.assert_frame_equal(found.copy(deep=True),expected)
+
+
+def test_cache_keeps_dtypes(weather_csv,tmp_path):
+    expected=pd.read_csv(weather_csv)
+    cache=ColumnarCache(weather_csv,str(tmp_path/"cache"))
+    cache.read_csv()
+    loaded=cache.load()
+    assert loaded is not None
+    assert_same_frame(loaded,expected)
+
+
+def test_cache_keeps_categories(weather_csv,tmp_path):
+    options={"dtype":{"COUNTY":"category"}}
+    cache=ColumnarCache(weather_csv,str(tmp_path/"cache"))
+    cache.read_csv(**options)
+    loaded=cache.load(**options)
+    assert isinstance(loaded['COUNTY'].dtype,pd.CategoricalDtype)
+    assert loaded['COUNTY'].astype(str).tolist()==pd.read_csv(weather_csv)['COUNTY'].tolist()
+
+
+def test_cached_numeric_columns_stay_memory_mapped(weather_csv,tmp_path):
+    cache=ColumnarCache(weather_csv,str(tmp_path/"cache"))
+    cache.read_csv()
+    loaded=cache.load()
+    assert is_memory_mapped(loaded['TMAX'].to_numpy())
+    assert is_memory_mapped(loaded['YEAR'].to_numpy())
+
+
+def test_streamed_cache_matches_eager_import(weather_csv):
+    eager=DataSet("Eager",weather_csv)
+    streamed=DataSet("Streamed")
+    streamed.import_stream(weather_csv,chunksize=500,use_cache=True)
+    #Second import comes from the cache:
+    again=DataSet("Again")
+    again.import_stream(weather_csv,chunksize=500,use_cache=True)
+    assert_same_frame(streamed.get_data(),eager.get_data())
+    assert_same_frame(again.get_data(),eager.get_data())
+
+
+def test_streamed_cache_widens_a_column_that_gets_blanks(weather_csv,tmp_path):
+    #Whole numbers in the first chunks, a blank in the last one (int64 becomes float64):
+    frame=pd.read_csv(weather_csv)
+    frame["SNOW"]=pd.array(np.arange(len(frame)),dtype="Int64")
+    frame.loc[len(frame)-3,"SNOW"]=pd.NA
+    filename=str(tmp_path/"blank.csv")
+    frame.to_csv(filename,index=False)
+
+    eager=DataSet("Eager",filename)
+    eager.convert_dates_to_julian('DATE')
+    streamed=DataSet("Streamed")
+    streamed.set_lazy()
+    streamed.convert_dates_to_julian('DATE')
+    streamed.import_stream(filename,chunksize=500,use_cache=True)
+    assert streamed.get_data().dtypes["SNOW"]==np.float64
+    assert_same_frame(streamed.get_data(),eager.get_data())
+
+
+def test_streamed_text_in_a_numeric_column_is_read_without_the_cache(weather_csv,tmp_path):
+    frame=pd.read_csv(weather_csv)
+    frame["SNOW"]=frame["SNOW"].astype(object)
+    frame.loc[len(frame)-3,"SNOW"]="T"
+    filename=str(tmp_path/"text.csv")
+    frame.to_csv(filename,index=False)
+
+    streamed=DataSet("Streamed")
+    streamed.import_stream(filename,chunksize=500,use_cache=True)
+    assert streamed.get_data() is not None
+    assert len(streamed.get_data())==len(frame)
+    assert streamed.get_data()["SNOW"].iloc[-3]=="T"
+
+
+def test_date_lookup_is_kept_per_format(tmp_path):
+    filename=str(tmp_path/"dates.csv")
+    pd.DataFrame({"DATE":["03/04/2020","05/06/2020"],"TAVG":[50.0,60.0]}).to_csv(filename,index=False)
+    days=dict()
+    for date_format in ("%m/%d/%Y","%d/%m/%Y","%m/%d/%Y"):
+        data=DataSet("Dates",filename)
+        data.convert_dates_to_julian('DATE',date_format=date_format,use_cache=True)
+        days.setdefault(date_format,[]).append(data.get_data()['DATE'].tolist())
+    assert days["%m/%d/%Y"]==[[64,127],[64,127]]
+    assert days["%d/%m/%Y"]==[[94,157]]
@@ -0,0 +1,26 @@
+import numpy as np
+from sklearn.naive_bayes import GaussianNB
+from src.model.g_naive_bayes import NaiveBayesModel, _feature_log_likelihoods
+from src.model.structures import PredictionGrid
+from conftest import RANGES, predict
+
+
+def test_factorized_matches_legacy(model,two_feature_data):
+    days,sums,counts=predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_LEGACY)
+    mode_days,mode_sums,mode_counts=predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_FACTORIZED)
+    assert np.array_equal(days,mode_days)
+    assert np.array_equal(counts,mode_counts)
+    assert np.allclose(sums,mode_sums,rtol=0,atol=1e-9)
+
+
+def test_factorized_kernel_matches_predict_proba(two_feature_data):
+    sklearn_model=GaussianNB().fit(two_feature_data.get_features().to_numpy(dtype=float),
+                                   two_feature_data.get_labels())
+    grid=PredictionGrid(RANGES)
+    tables=_feature_log_likelihoods(sklearn_model.theta_,sklearn_model.var_,grid.axes)
+    index=np.unravel_index(np.arange(grid.size),grid.shape)
+    joint=np.log(sklearn_model.class_prior_)+sum(table[i] for table,i in zip(tables,index))
+    probabilities=np.exp(joint-joint.max(axis=1,keepdims=True))
+    probabilities/=probabilities.sum(axis=1,keepdims=True)
+    expected=sklearn_model.predict_proba(grid.block(0,grid.size))
+    assert np.abs(probabilities-expected).max()<1e-9
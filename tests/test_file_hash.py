@@ -0,0 +1,45 @@
+import os
+from src.model import file_hash
+from src.model.data_session import DataSession
+from src.model.model_store import ModelStore
+
+
+def test_hash_is_reused_while_mtime_and_size_match(tmp_path):
+    path=tmp_path/"data.csv"
+    path.write_text("a,b\n1,2\n")
+    sha=file_hash.hash_file(str(path))
+
+    #Same size and modification time, so the content is not read again:
+    stat=os.stat(path)
+    path.write_text("a,b\n3,4\n")
+    os.utime(path,ns=(stat.st_atime_ns,stat.st_mtime_ns))
+    assert file_hash.hash_file(str(path))==sha
+
+    path.write_text("a,b\n3,45\n")
+    assert file_hash.hash_file(str(path))!=sha
+
+
+def test_model_store_and_session_share_hashes(tmp_path,weather_csv,monkeypatch):
+    reads=[]
+    real_open=open
+    def counting_open(name,mode="r",*args,**kwargs):
+        if "b" in mode and os.path.abspath(str(name))==os.path.abspath(weather_csv):
+            reads.append(name)
+        return real_open(name,mode,*args,**kwargs)
+
+    monkeypatch.setattr(file_hash,"_known",dict())
+    monkeypatch.setattr(file_hash,"_stores",dict())
+    monkeypatch.setattr(file_hash,"open",counting_open,raising=False)
+    crops=tmp_path/"crops.csv"
+    crops.write_text("Commodity,TAVG_MIN,TAVG_MAX\nWHEAT,40,70\n")
+    session=DataSession(weather_csv,str(crops),use_cache=False)
+    session.refresh()
+    ModelStore(str(tmp_path/"models")).fingerprint(session.view("Everything"))
+    assert session.is_current()
+    assert len(reads)==1
+
+    #A later session finds the hash in the model store's file:
+    monkeypatch.setattr(file_hash,"_known",dict())
+    monkeypatch.setattr(file_hash,"_stores",dict())
+    ModelStore(str(tmp_path/"models")).fingerprint(session.view("Everything"))
+    assert len(reads)==1
@@ -0,0 +1,39 @@
+import warnings
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.prediction_cache import PredictionCache
+from src.model.structures import Range
+from conftest import RANGES, predict
+
+
+def test_update_model_leaves_out_empty_classes(temperature_data):
+    #A first update only sees the first 100 days, the rest of the declared days have no samples:
+    early=temperature_data.derive("Early")
+    early.filter_range('DATE',1,100)
+    early.set_features(['TAVG'])
+    early.set_labels('DATE')
+    model=NaiveBayesModel()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        model.update_model(early)
+        days,sums,counts=predict(model,early,[Range(20,60)],NaiveBayesModel.MODE_GRID)
+        model.update_model(temperature_data)
+        all_days,_,_=predict(model,temperature_data,[Range(20,60)],NaiveBayesModel.MODE_GRID)
+    assert days.max()<=100
+    assert len(all_days)>len(days)
+
+
+def test_prediction_cache_keys_every_setting(model,two_feature_data):
+    cache=PredictionCache()
+    predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_GRID,block_size=64,cache=cache)
+    predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_GRID,block_size=128,cache=cache)
+    assert cache.hits==0
+    predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_GRID,block_size=64,cache=cache)
+    assert cache.hits==1
+
+    #A table of another resolution gives other sums:
+    predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_TABLE,cache=cache)
+    model.build_posterior_table(max_points=400)
+    predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_TABLE,cache=cache)
+    assert cache.hits==1
+    predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_TABLE,cache=cache)
+    assert cache.hits==2
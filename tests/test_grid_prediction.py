@@ -0,0 +1,24 @@
+import numpy as np
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.structures import PredictionGrid
+from conftest import RANGES, predict
+
+
+def test_grid_matches_legacy(model,two_feature_data):
+    days,sums,counts=predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_LEGACY)
+    grid_days,grid_sums,grid_counts=predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_GRID)
+    assert np.array_equal(days,grid_days)
+    assert np.array_equal(counts,grid_counts)
+    assert np.allclose(sums,grid_sums,rtol=0,atol=1e-9)
+
+
+def test_block_size_does_not_change_the_grid(model,two_feature_data):
+    #Last block shorter than the others:
+    assert PredictionGrid(RANGES).size%7!=0
+    whole=predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_GRID,block_size=10**6)
+    #(A fresh model, the same ranges would otherwise come from the incremental state)
+    fresh=NaiveBayesModel()
+    fresh.train_model(two_feature_data)
+    blocks=predict(fresh,two_feature_data,RANGES,NaiveBayesModel.MODE_GRID,block_size=7)
+    for expected,found in zip(whole,blocks):
+        assert np.allclose(expected,found,rtol=0,atol=1e-9)
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.structures import Range
+from conftest import RANGES, predict
+
+
+@pytest.mark.parametrize("mode",[NaiveBayesModel.MODE_GRID,NaiveBayesModel.MODE_FACTORIZED])
+def test_incremental_ranges_match_full_run(model,two_feature_data,mode):
+    #Raise a high, raise a low, lower a high, widen the other range, repeat the same ranges:
+    steps=[
+        [Range(30,62,1),Range(0,0.5,0.05)],
+        [Range(33,62,1),Range(0,0.5,0.05)],
+        [Range(33,55,1),Range(0,0.5,0.05)],
+        [Range(33,55,1),Range(0,0.7,0.05)],
+        [Range(33,55,1),Range(0,0.7,0.05)],
+    ]
+    predict(model,two_feature_data,RANGES,mode)
+    for ranges in steps:
+        days,sums,counts=predict(model,two_feature_data,ranges,mode)
+        fresh=NaiveBayesModel()
+        fresh.train_model(two_feature_data)
+        full_days,full_sums,full_counts=predict(fresh,two_feature_data,ranges,mode)
+        assert np.array_equal(days,full_days)
+        assert np.array_equal(counts,full_counts)
+        assert np.allclose(sums,full_sums,rtol=0,atol=1e-9)
+
+
+@pytest.mark.parametrize("mode",[NaiveBayesModel.MODE_GRID,NaiveBayesModel.MODE_FACTORIZED])
+def test_empty_ranges_can_be_predicted_again(model,two_feature_data,mode):
+    first=predict(model,two_feature_data,[],mode)
+    second=predict(model,two_feature_data,[],mode)
+    for old,new in zip(first,second):
+        assert np.array_equal(old,new)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from scipy.stats import norm
+from src.model.g_naive_bayes import NaiveBayesModel, _log_interval_mass
+from src.model.structures import Range
+from conftest import RANGES, predict
+
+
+@pytest.mark.parametrize("ranges",[
+    RANGES,
+    [Range(45,46),Range(0,0.01)],
+    #Far in the tail of every class, the plain CDF difference is 0 there:
+    [Range(200,210),Range(5,6)],
+])
+def test_integrated_probabilities_sum_to_one(model,two_feature_data,ranges):
+    days,sums,counts=predict(model,two_feature_data,ranges,NaiveBayesModel.MODE_INTEGRATED)
+    assert np.isfinite(sums).all()
+    assert np.array_equal(counts,np.ones(len(days)))
+    assert sums.sum()==pytest.approx(1.0,abs=1e-9)
+
+
+def test_zero_width_range_is_the_point_posterior(model,two_feature_data):
+    #The grid of these ranges holds the single point (45, 0.2):
+    point_days,point_sums,_=predict(model,two_feature_data,[Range(44,45,1),Range(0.1,0.2,0.1)],
+                                    NaiveBayesModel.MODE_GRID)
+    days,sums,_=predict(model,two_feature_data,[Range(45,45),Range(0.2,0.2)],NaiveBayesModel.MODE_INTEGRATED)
+    assert np.array_equal(days,point_days)
+    assert np.allclose(sums,point_sums,rtol=0,atol=1e-12)
+
+
+def test_log_interval_mass_matches_the_cdf():
+    mean,std=np.array([[0.0],[3.0]]),np.array([[1.0],[2.0]])
+    low,high=np.array([-1.0]),np.array([2.0])
+    expected=norm.cdf(high,mean,std)-norm.cdf(low,mean,std)
+    assert np.allclose(np.exp(_log_interval_mass(low,high,mean,std)),expected,rtol=1e-12)
+    #Deep in both tails the mass stays finite and ordered:
+    tails=_log_interval_mass(np.array([40.0]),np.array([41.0]),mean,std)
+    assert np.isfinite(tails).all() and tails[0,0]<tails[1,0]
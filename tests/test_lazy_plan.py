@@ -0,0 +1,42 @@
+import pandas as pd
+from src.model.structures import DataSet
+
+
+def prepare(data:DataSet)->DataSet:
+    """
+    The window's preparation steps followed by a county filter and NaN handling
+    """
+    data.drop_data("SOURCE_FILE")
+    data.drop_data("VALUE")
+    data.drop_data('COMMODITY')
+    data.drop_duplicates()
+    data.drop_duplicates(['YEAR','COUNTY','DATE'],strategy="first_valid")
+    data.convert_dates_to_julian('DATE')
+    data.sort_data(['YEAR'])
+    data.filter_data('COUNTY','CHELAN')
+    data.filter_range('YEAR',2001)
+    data.replace_nan_using_avg('TAVG',['TMAX','TMIN'])
+    data.drop_nan_values(['TAVG'])
+    return data
+
+
+def test_lazy_plan_matches_eager(weather_csv):
+    eager=prepare(DataSet("Eager",weather_csv))
+
+    lazy=DataSet("Lazy",weather_csv)
+    lazy.set_lazy()
+    prepare(lazy)
+    assert "filter_data" in lazy.explain()
+    lazy.execute()
+
+    pd.testing.assert_frame_equal(lazy.get_data().reset_index(drop=True),eager.get_data().reset_index(drop=True))
+
+
+def test_lazy_plan_runs_when_data_is_needed(weather_csv):
+    lazy=DataSet("Lazy",weather_csv)
+    lazy.set_lazy()
+    lazy.filter_data('COUNTY','KING')
+    lazy.drop_nan_values(['PRCP'])
+    lazy.set_features(['PRCP'])
+    assert set(lazy.get_data()['COUNTY'])=={'KING'}
+    assert not lazy.get_features()['PRCP'].isna().any()
@@ -0,0 +1,50 @@
+import shutil
+import numpy as np
+import pandas as pd
+from src.model.g_naive_bayes import NaiveBayesModel
+from src.model.model_store import ModelStore
+from src.model.structures import DataSet, Range
+from conftest import predict
+
+
+def king_temperatures(filename:str)->DataSet:
+    data=DataSet("Temperature",filename)
+    data.filter_data('COUNTY','KING')
+    data.replace_nan_using_avg('TAVG',['TMAX','TMIN'])
+    data.drop_nan_values(['TAVG'])
+    data.convert_dates_to_julian('DATE')
+    data.set_features(['TAVG'])
+    data.set_labels('DATE')
+    return data
+
+
+def test_saved_model_is_loaded_with_the_same_parameters(weather_csv,tmp_path):
+    data=king_temperatures(weather_csv)
+    trained=NaiveBayesModel()
+    assert ModelStore(str(tmp_path/"models")).prepare_model(trained,data)
+
+    #A new store and model find the saved file instead of training:
+    loaded=NaiveBayesModel()
+    assert not ModelStore(str(tmp_path/"models")).prepare_model(loaded,king_temperatures(weather_csv))
+    assert loaded.get_fingerprint()==trained.get_fingerprint()
+    assert loaded.get_parameter_hash()==trained.get_parameter_hash()
+    for expected,found in zip(predict(trained,data,[Range(30,60)],NaiveBayesModel.MODE_GRID),
+                              predict(loaded,data,[Range(30,60)],NaiveBayesModel.MODE_GRID)):
+        assert np.array_equal(expected,found)
+
+
+def test_changed_source_file_invalidates_the_model(weather_csv,tmp_path):
+    filename=str(tmp_path/"weather.csv")
+    shutil.copy(weather_csv,filename)
+    store=ModelStore(str(tmp_path/"models"))
+    first=NaiveBayesModel()
+    store.prepare_model(first,king_temperatures(filename))
+
+    frame=pd.read_csv(filename)
+    frame.loc[frame['COUNTY']=='KING','TMAX']+=5
+    frame.to_csv(filename,index=False)
+
+    again=NaiveBayesModel()
+    assert store.prepare_model(again,king_temperatures(filename))
+    assert again.get_fingerprint()!=first.get_fingerprint()
+    assert again.get_parameter_hash()!=first.get_parameter_hash()
@@ -0,0 +1,20 @@
+import numpy as np
+from sklearn.naive_bayes import GaussianNB
+from src.model.posterior_table import PosteriorTable
+from src.model.structures import PredictionGrid, Range
+
+
+def test_table_sums_match_summed_posteriors(temperature_data):
+    temperature_data.set_features(['TAVG','PRCP'])
+    model=GaussianNB().fit(temperature_data.get_features().to_numpy(dtype=float),temperature_data.get_labels())
+    table=PosteriorTable(model,20000)
+    assert table._PosteriorTable__prefix.dtype==np.float32
+
+    ranges=[Range(40,60),Range(0,0.5)]
+    sums,count=table.query(ranges)
+    #Same table points summed directly in float64:
+    inside=[axis[(axis>=r.low-1e-9*step)&(axis<=r.high+1e-9*step)] for axis,r,step in zip(table.axes,ranges,table.steps)]
+    grid=PredictionGrid(axes=inside)
+    expected=model.predict_proba(grid.block(0,grid.size)).sum(axis=0)
+    assert count==grid.size
+    assert np.abs(sums-expected).max()/count<1e-6
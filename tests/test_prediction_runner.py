@@ -0,0 +1,40 @@
+import threading
+import numpy as np
+import pytest
+from src.model.g_naive_bayes import NaiveBayesModel, PredictionCancelled
+from src.model.prediction_runner import PredictionRunner
+from src.model.structures import Range
+from conftest import RANGES
+
+
+def make_jobs(two_feature_data):
+    temperature=two_feature_data.derive("Temperature")
+    temperature.set_features(['TAVG'])
+    temperature.set_labels('DATE')
+    temperature.input_ranges=[Range(30,60,1)]
+    both=two_feature_data.derive("Both")
+    both.set_features(['TAVG','PRCP'])
+    both.set_labels('DATE')
+    both.input_ranges=RANGES
+    return {"Temperature":(NaiveBayesModel(),temperature),"Both":(NaiveBayesModel(),both)}
+
+
+def test_threads_and_processes_give_the_same_results(two_feature_data):
+    threaded=PredictionRunner(executor=PredictionRunner.THREADS).run(make_jobs(two_feature_data))
+    processed=PredictionRunner(executor=PredictionRunner.PROCESSES).run(make_jobs(two_feature_data))
+    assert threaded.keys()==processed.keys()
+    for name in threaded:
+        _,dataset,trained=threaded[name]
+        _,other,other_trained=processed[name]
+        assert trained and other_trained
+        assert len(dataset.get_probability_dist())>0
+        assert np.array_equal(np.array(dataset.get_probability_dist(),dtype=float),
+                              np.array(other.get_probability_dist(),dtype=float))
+
+
+@pytest.mark.parametrize("executor",[PredictionRunner.THREADS,PredictionRunner.PROCESSES])
+def test_set_cancel_event_stops_the_run(two_feature_data,executor):
+    cancel=threading.Event()
+    cancel.set()
+    with pytest.raises(PredictionCancelled):
+        PredictionRunner(executor=executor).run(make_jobs(two_feature_data),cancel=cancel)
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import threading
+import pytest
+from src.model.prediction_service import PredictionService
+from src.model.weather_data import WeatherData
+
+
+@pytest.fixture
+def crops_csv(tmp_path):
+    crops=tmp_path/"crops.csv"
+    crops.write_text("Commodity,TAVG_MIN,TAVG_MAX,PRCP_MIN,PRCP_MAX,AWND_MIN,AWND_MAX\n"
+                     "WHEAT,40,70,0,0.5,0,8\nHOPS,45,75,,,2,6\n")
+    return str(crops)
+
+
+async def send(port:int,request:bytes):
+    """
+    :return: (HTTP status, decoded JSON answer)
+    """
+    reader,writer=await asyncio.open_connection(PredictionService.HOST,port)
+    writer.write(request)
+    writer.write_eof()
+    response=await reader.read()
+    writer.close()
+    head,_,body=response.partition(b"\r\n\r\n")
+    return int(head.split()[1]),json.loads(body)
+
+
+def post(query,length:int=None)->bytes:
+    body=query if isinstance(query,bytes) else json.dumps(query).encode()
+    length=len(body) if length is None else length
+    return f"POST /predict HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode()+body
+
+
+def serve(weather_csv:str,crops_csv:str,*requests:bytes)->list:
+    """
+    Starts a service, sends the requests one after another and stops it
+    :return: [(status, answer)] of every request followed by the /stats answer
+    """
+    async def run():
+        service=PredictionService(weather_csv,crops_csv)
+        port=await service.start()
+        try:
+            answers=[await send(port,request) for request in requests]
+            return answers+[service.get_stats()]
+        finally:
+            await service.stop()
+    return asyncio.run(run())
+
+
+def test_truncated_and_malformed_bodies_are_bad_requests(weather_csv,crops_csv):
+    truncated,negative,text,stats=serve(weather_csv,crops_csv,
+                                        post({"county":"KING","crop":"WHEAT"},length=500),
+                                        post(b"",length=-1),
+                                        b"POST /predict HTTP/1.1\r\nContent-Length: ten\r\n\r\n")
+    assert [truncated[0],negative[0],text[0]]==[400,400,400]
+    assert "ended after" in truncated[1]["error"]
+
+
+def test_crop_ranges_left_blank_are_skipped(weather_csv,crops_csv):
+    (status,answer),nan_range,stats=serve(weather_csv,crops_csv,
+                                          post({"county":"KING","crop":"HOPS"}),
+                                          post(b'{"county":"KING","ranges":{"Wind":[NaN,5]}}'))
+    assert status==200
+    assert set(answer["results"])=={"Temperature","Wind"}
+    assert len(answer["results"]["Wind"]["days"])>0
+    assert nan_range[0]==400
+
+
+def test_failed_trainings_are_not_counted_as_warm(weather_csv,crops_csv,monkeypatch):
+    variable_data=WeatherData.variable_data
+    def failing(dataset,variable,location=None):
+        if variable[0]=="Wind":
+            raise RuntimeError("No wind data")
+        return variable_data(dataset,variable,location)
+    monkeypatch.setattr(WeatherData,"variable_data",staticmethod(failing))
+
+    wind,temperature,stats=serve(weather_csv,crops_csv,
+                                 post({"county":"KING","ranges":{"Wind":[0,5]}}),
+                                 post({"county":"KING","ranges":{"Temperature":[40,70]}}))
+    assert wind[0]==500
+    assert temperature[0]==200
+    assert stats["warm_models"]==1
+
+
+def test_identical_requests_share_one_prediction(weather_csv,crops_csv,monkeypatch):
+    #Training waits until both requests have arrived:
+    release=threading.Event()
+    variable_data=WeatherData.variable_data
+    def waiting(dataset,variable,location=None):
+        release.wait(30)
+        return variable_data(dataset,variable,location)
+    monkeypatch.setattr(WeatherData,"variable_data",staticmethod(waiting))
+
+    async def run():
+        service=PredictionService(weather_csv,crops_csv)
+        port=await service.start()
+        try:
+            request=post({"county":"KING","ranges":{"Temperature":[40,70]}})
+            first=asyncio.ensure_future(send(port,request))
+            second=asyncio.ensure_future(send(port,request))
+            async def coalesced():
+                while service.get_stats()["coalesced"]<1:
+                    await asyncio.sleep(0.01)
+            await asyncio.wait_for(coalesced(),5)
+            #The service still answers while the prediction is computed:
+            health=await asyncio.wait_for(send(port,b"GET /health HTTP/1.1\r\n\r\n"),5)
+            assert not first.done()
+            release.set()
+            return await asyncio.gather(first,second),health,service.get_stats()
+        finally:
+            release.set()
+            await service.stop()
+
+    (first,second),health,stats=asyncio.run(run())
+    assert first==second
+    assert first[0]==200
+    assert health==(200,{"status":"ok"})
+    assert stats["computed"]==1
+    assert stats["coalesced"]==1
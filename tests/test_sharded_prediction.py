@@ -0,0 +1,27 @@
+import numpy as np
+from src.model.g_naive_bayes import NaiveBayesModel
+from conftest import RANGES, predict
+
+
+def test_sharded_grid_is_bit_identical(model,two_feature_data):
+    single=predict(model,two_feature_data,RANGES,NaiveBayesModel.MODE_GRID,block_size=64)
+    #(A fresh model, the same ranges would otherwise come from the incremental state)
+    fresh=NaiveBayesModel()
+    fresh.train_model(two_feature_data)
+    sharded=predict(fresh,two_feature_data,RANGES,NaiveBayesModel.MODE_GRID,block_size=64,workers=2)
+    for expected,found in zip(single,sharded):
+        assert np.array_equal(expected,found)
+
+
+def test_sharded_grid_continues_an_existing_distribution(model,two_feature_data):
+    #Partial results from the workers are merged into what the dataset already holds:
+    view=two_feature_data.derive("Sharded")
+    view.input_ranges=RANGES
+    view=model.run_prediction(view,NaiveBayesModel.MODE_GRID,block_size=64,workers=2)
+    once=np.array(view.get_probability_dist(),dtype=float)
+    fresh=NaiveBayesModel()
+    fresh.train_model(two_feature_data)
+    view=fresh.run_prediction(view,NaiveBayesModel.MODE_GRID,block_size=64,workers=2)
+    twice=np.array(view.get_probability_dist(),dtype=float)
+    assert np.array_equal(twice[:,0],once[:,0])
+    assert np.allclose(twice[:,1:],2*once[:,1:],rtol=1e-12,atol=0)
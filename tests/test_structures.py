@@ -0,0 +1,100 @@
+import gc
+import pandas as pd
+from src.model.structures import DataSet, GroupIndex
+
+
+def nan_data(tmp_path,schema:dict=None)->DataSet:
+    filename=str(tmp_path/"nan.csv")
+    pd.DataFrame({
+        "TAVG":[50.0,None,None,None],
+        "TMAX":[60.0,70.0,None,None],
+        "TMIN":[40.0,50.0,30.0,None],
+    }).to_csv(filename,index=False)
+    return DataSet("NaN",filename,schema=schema)
+
+
+def test_replace_nan_strategies(tmp_path):
+    results=dict()
+    for strategy,weights in (("mean",None),("first",None),("weighted",[3,1])):
+        data=nan_data(tmp_path)
+        data.replace_nan_using_avg('TAVG',['TMAX','TMIN'],strategy=strategy,weights=weights)
+        results[strategy]=data.get_data()['TAVG'].tolist()
+    #Rows with both, one and none of the sources:
+    assert results["mean"][:3]==[50.0,60.0,30.0]
+    assert results["first"][:3]==[50.0,70.0,30.0]
+    assert results["weighted"][:3]==[50.0,65.0,30.0]
+    assert all(pd.isna(values[3]) for values in results.values())
+
+
+def test_replace_nan_keeps_a_nullable_float_column(tmp_path):
+    data=nan_data(tmp_path,schema={"TAVG":"Float32","TMAX":"float32","TMIN":"float32"})
+    data.replace_nan_using_avg('TAVG',['TMAX','TMIN'])
+    column=data.get_data()['TAVG']
+    assert column.dtype==pd.Float32Dtype()
+    assert column.tolist()[:3]==[50.0,60.0,30.0]
+    assert column.isna().tolist()==[False,False,False,True]
+
+
+def test_group_index_takes_the_same_rows_as_a_mask():
+    data=pd.DataFrame({"COUNTY":["KING","CHELAN","KING",None,"YAKIMA","KING"],"TAVG":range(6)})
+    index=GroupIndex(data,"COUNTY")
+    for county in ("KING","CHELAN","YAKIMA"):
+        pd.testing.assert_frame_equal(index.take(data,county),data[data["COUNTY"]==county])
+    assert index.take(data,"SPOKANE").empty
+    assert index.has_missing
+
+
+def test_group_index_values_are_in_order_of_appearance():
+    data=pd.DataFrame({"COUNTY":pd.Categorical(["KING","CHELAN","KING","ADAMS"],
+                                               categories=["ADAMS","CHELAN","KING"])})
+    index=GroupIndex(data,"COUNTY")
+    assert index.get_values()==["KING","CHELAN","ADAMS"]
+    assert index.take(data,"ADAMS").index.tolist()==[3]
+
+
+def test_group_index_is_not_used_once_its_frame_is_collected():
+    data=pd.DataFrame({"COUNTY":["KING","CHELAN"]})
+    index=GroupIndex(data,"COUNTY")
+    assert index.is_built_on(data)
+    #A new frame could be given the address of the old one, the weak reference tells them apart:
+    del data
+    gc.collect()
+    assert not index.is_built_on(pd.DataFrame({"COUNTY":["CHELAN","KING"]}))
+    assert not index.is_built_on(None)
+
+
+def test_filter_through_the_index_matches_the_plain_filter(weather_csv):
+    plain=DataSet("Plain",weather_csv)
+    plain.drop_nan_values(['PRCP'])
+    plain.filter_data('COUNTY','KING')
+
+    indexed=DataSet("Indexed",weather_csv)
+    indexed.build_index('COUNTY')
+    view=indexed.derive("View")
+    view.filter_data('COUNTY','KING')
+    #The data changed, so the index is not used for the second filter:
+    changed=indexed.derive("Changed")
+    changed.drop_nan_values(['PRCP'])
+    changed.filter_data('COUNTY','KING')
+    pd.testing.assert_frame_equal(changed.get_data(),plain.get_data())
+    assert len(view.get_data())>len(changed.get_data())
+    assert set(view.get_data()['COUNTY'])=={'KING'}
+
+
+def test_first_valid_dedupe_takes_later_values_for_blanks(tmp_path):
+    filename=str(tmp_path/"duplicates.csv")
+    pd.DataFrame({
+        "COUNTY":["KING","KING","CHELAN","KING","CHELAN"],
+        "DATE":["2000-01-02","2000-01-02","2000-01-02","2000-01-01","2000-01-02"],
+        "TAVG":[None,41.0,30.0,45.0,31.0],
+        "PRCP":[0.2,None,None,0.1,0.3],
+    }).to_csv(filename,index=False)
+    data=DataSet("Duplicates",filename)
+    data.drop_duplicates(['COUNTY','DATE'],strategy="first_valid")
+    found=data.get_data()
+    #Groups in order of first appearance, each column's first value that is not NaN:
+    assert found[['COUNTY','DATE']].values.tolist()==[["KING","2000-01-02"],["CHELAN","2000-01-02"],
+                                                       ["KING","2000-01-01"]]
+    assert found['TAVG'].tolist()==[41.0,30.0,45.0]
+    assert found['PRCP'].tolist()==[0.2,0.3,0.1]
+    assert found.index.tolist()==[0,1,2]
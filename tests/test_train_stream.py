@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from sklearn.naive_bayes import GaussianNB
+from src.model.g_naive_bayes import NaiveBayesModel, _holdout_mask
+from src.model.structures import PredictionGrid
+from conftest import RANGES
+
+
+def stream(data,size,test_size):
+    features=data.get_features().to_numpy(dtype=float)
+    labels=data.get_labels().to_numpy()
+    model=NaiveBayesModel()
+    model.train_stream(((features[i:i+size],labels[i:i+size]) for i in range(0,len(labels),size)),
+                       test_size=test_size)
+    return model
+
+
+def assert_matches(model,data,expected):
+    grid=PredictionGrid(RANGES)
+    view=data.derive("Stream")
+    view.input_ranges=RANGES
+    view=model.run_prediction(view,NaiveBayesModel.MODE_GRID)
+    days,sums,counts=np.array(view.get_probability_dist(),dtype=float).T
+    probabilities=expected.predict_proba(grid.block(0,grid.size))
+    passed=probabilities>=0
+    assert np.array_equal(days,expected.classes_)
+    assert np.array_equal(counts,passed.sum(axis=0))
+    assert np.allclose(sums,probabilities.sum(axis=0),rtol=0,atol=1e-9)
+
+
+def test_train_stream_matches_fit(two_feature_data):
+    features=two_feature_data.get_features().to_numpy(dtype=float)
+    labels=two_feature_data.get_labels().to_numpy()
+    assert_matches(stream(two_feature_data,97,0),two_feature_data,GaussianNB().fit(features,labels))
+
+
+def test_train_stream_holdout_does_not_depend_on_chunks(two_feature_data):
+    features=two_feature_data.get_features().to_numpy(dtype=float)
+    labels=two_feature_data.get_labels().to_numpy()
+    train=~_holdout_mask(0,len(labels),0.3,40)
+    assert 0<(~train).sum()<len(labels)
+    expected=GaussianNB().fit(features[train],labels[train])
+    for size in (97,500):
+        assert_matches(stream(two_feature_data,size,0.3),two_feature_data,expected)
+
+
+def test_train_stream_rejects_nan_chunks():
+    features=np.arange(20,dtype=float).reshape(-1,1)
+    labels=np.repeat([1,2],10)
+    chunks=[(features[:10],labels[:10]),(features[10:].copy(),labels[10:])]
+    chunks[1][0][3]=np.nan
+    model=NaiveBayesModel()
+    with pytest.raises(ValueError,match="Chunk 1"):
+        model.train_stream(chunks,test_size=0)
+    assert not model.is_trained()
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from src.model.batch_report import BatchReport
+from src.model.structures import DataSet
+from src.model.weather_data import WeatherData
+
+
+def test_variable_data_matches_the_steps_done_by_hand(weather_csv,tmp_path):
+    crops=tmp_path/"crops.csv"
+    crops.write_text("Commodity,TAVG_MIN,TAVG_MAX,PRCP_MIN,PRCP_MAX,AWND_MIN,AWND_MAX\nWHEAT,40,70,0,0.5,0,8\n")
+    session=WeatherData.open_session(weather_csv,str(crops))
+    data=WeatherData.variable_data(session.view("Temperature"),WeatherData.get_variable("Temperature"),"KING")
+
+    expected=DataSet("Expected",weather_csv,schema=WeatherData.DATA_SCHEMA)
+    expected.drop_duplicates()
+    expected.drop_duplicates(['YEAR','COUNTY','DATE'],strategy="first_valid")
+    expected.convert_dates_to_julian('DATE')
+    expected.sort_data(['YEAR'])
+    expected.filter_data('COUNTY','KING')
+    expected.replace_nan_using_avg('TAVG',['TMAX','TMIN'])
+    expected.drop_nan_values(['TAVG'])
+    expected.set_features(['TAVG'])
+    expected.set_labels('DATE')
+
+    assert data.name=="Temperature"
+    np.testing.assert_array_equal(data.get_features().to_numpy(),expected.get_features().to_numpy())
+    np.testing.assert_array_equal(data.get_labels().to_numpy(),expected.get_labels().to_numpy())
+
+
+def test_batch_report_skips_crops_without_a_range(weather_csv,tmp_path):
+    crops=tmp_path/"crops.csv"
+    crops.write_text("Commodity,TAVG_MIN,TAVG_MAX,PRCP_MIN,PRCP_MAX,AWND_MIN,AWND_MAX\n"
+                     "WHEAT,40,70,0,0.5,0,8\nHOPS,45,75,,,2,6\n")
+    failed=BatchReport(weather_csv,str(crops),str(tmp_path/"reports")).run(counties=["KING"])
+    assert failed=={}
+    report=pd.read_csv(tmp_path/"reports"/"KING.csv")
+    assert set(report["VARIABLE"][report["CROP"]=="WHEAT"])=={"Temperature","Precipitation","Wind"}
+    assert set(report["VARIABLE"][report["CROP"]=="HOPS"])=={"Temperature","Wind"}